@@ -36,24 +36,15 @@ if st.secrets:
 else:
     safe_load_dotenv()
 
-# ---- DIAGNOSTIC (temporary; remove after it shows ✅) ----
-loaded = list(getattr(st, "secrets", {}).keys())
-st.sidebar.write("🔐 Secrets present:", loaded)  # shows only the keys, not values
-st.sidebar.write("FIREBASE_API_KEY seen?", bool(os.getenv("FIREBASE_API_KEY")))
-st.sidebar.write("Service account dict present?",
-                 "FIREBASE_SERVICE_ACCOUNT" in loaded or bool(os.getenv("FIREBASE_SERVICE_ACCOUNT_JSON")))
-# ----------------------------------------------------------
-
 
 
 # Now normal imports
-import io, datetime, time, random
+import json, datetime, random
 import numpy as np
 import pandas as pd
 import plotly.express as px
 import matplotlib.pyplot as plt
 from PIL import Image, ImageFilter, ImageEnhance, ImageDraw
-from gtts import gTTS
 
 # optional mic recorder
 try:
@@ -66,12 +57,18 @@ from streamlit_drawable_canvas import st_canvas
 import streamlit.components.v1 as components
 
 # utils (your modules)
-from utils.ai import gemini_reply, reflect_mood, generate_affirmation, classify_crisis, transcribe_or_understand_audio
+from utils.ai import gemini_reply, classify_crisis, understand_audio_clips
 from utils.auth import signup_email_password, login_email_password, anonymous_signin
 from utils.db import (
     log_mood, list_recent_moods, store_letter, due_letters, mark_letter_delivered, update_daily_report,
-    add_memory, list_memories, add_schedule_item, list_schedule
+    add_memory, list_memories, add_schedule_item, list_schedule, watch_user,
+    letters_flag, set_letters_flag
 )
+from utils.tts import synthesize, BREATHING_CUES
+from utils import metrics, profiler, reflections, router, doodle, blobs, insights, letters, cache, warmup, affirmations, importer, trends
+from utils import moods as mood_vocab
+
+profiler.begin_rerun()  # no-op unless SERENITY_PROFILE=1
 
 # ===== basics & helpers (top of file) =====
 
@@ -79,12 +76,7 @@ from PIL import Image, ImageFilter, ImageEnhance, ImageDraw
 from streamlit_drawable_canvas import st_canvas
 
 # --- safe stubs if not defined elsewhere ---
-if "log_mood" not in globals():
-    def log_mood(user_id, mood, note, details):
-        st.session_state.setdefault("_mood_log", []).append(
-            {"user_id": user_id, "mood": mood, "note": note, "details": details, "ts": time.time()}
-        )
-
+# (run without Firebase: SERENITY_STORAGE=memory or sqlite, see utils/storage.py)
 if "delete_schedule_item" not in globals():
     def delete_schedule_item(user_id, index_zero_based: int):
         """Fallback only. Replace with your real backend delete if you have one."""
@@ -139,6 +131,16 @@ import streamlit.components.v1 as components
 
 st.set_page_config(page_title="Serenity Bot", page_icon="🧘", layout="centered")
 
+_COMPONENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "components")
+memory_match = components.declare_component("memory_match", path=os.path.join(_COMPONENTS_DIR, "memory_match"))
+
+def session_blobs() -> blobs.SessionBlobs:
+    """This session's blob handles; files are released when the session goes away."""
+    if "_blobs" not in st.session_state:
+        st.session_state._blobs = blobs.SessionBlobs()
+    return st.session_state._blobs
+
+
 # --- Auth ---
 def ensure_auth():
     if "user" not in st.session_state:
@@ -172,12 +174,59 @@ def ensure_auth():
         st.stop()
 
 
-ensure_auth()
+def render_diagnostics():
+    """Admin-only sidebar panel: config sanity + per-call latency/token/doc stats."""
+    admins = {e.strip().lower() for e in os.getenv("SERENITY_ADMIN_EMAILS", "").split(",") if e.strip()}
+    email = ((st.session_state.user or {}).get("email") or "").lower()
+    if not email or email not in admins:
+        return
+    with st.sidebar.expander("🛠️ Diagnostics (admin)"):
+        loaded = list(getattr(st, "secrets", {}).keys())
+        st.write("🔐 Secrets present:", loaded)  # shows only the keys, not values
+        st.write("FIREBASE_API_KEY seen?", bool(os.getenv("FIREBASE_API_KEY")))
+        st.write("Service account dict present?",
+                 "FIREBASE_SERVICE_ACCOUNT" in loaded or bool(os.getenv("FIREBASE_SERVICE_ACCOUNT_JSON")))
+        rows = metrics.summary()
+        if rows:
+            st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        else:
+            st.caption("No Gemini / Firestore calls recorded yet.")
+        bs = blobs.stats()
+        st.caption(f"Session blobs: {bs['sessions']} sessions, {bs['blobs']} files, "
+                   f"{bs['disk_bytes'] / 1e6:.1f} MB on disk, {bs['mem_bytes'] / 1e6:.1f} MB in memory")
+        warm = warmup.status()
+        if warm["steps"]:
+            st.caption("Warmup: " + ", ".join(f"{k} {v['ms']} ms" + ("" if v["ok"] else " ⚠️")
+                                               for k, v in warm["steps"].items()))
+        lat = router.latency_snapshot()
+        if lat:
+            st.caption("Model latency (EWMA ms): " + ", ".join(f"{m} {v}" for m, v in sorted(lat.items())))
+        st.download_button("⬇️ Prometheus metrics", metrics.prometheus_text(),
+                           file_name="serenity_metrics.txt", mime="text/plain")
+        spans = profiler.summary()
+        if spans:
+            st.caption("⏱️ Rerun profile (all sessions, this process)")
+            st.dataframe(pd.DataFrame(spans), use_container_width=True, hide_index=True)
+
+
+with profiler.span("auth"):
+    ensure_auth()
+metrics.start_http_exporter()  # only when SERENITY_METRICS_PORT is set
+with profiler.span("diagnostics"):
+    render_diagnostics()
+warmup.start()  # no-op when launched via `python -m utils.warmup app.py`; includes TTS prerender
+letters.start()  # only when SERENITY_LETTER_SCHEDULER=1
 user_id = st.session_state.user["uid"]
 
+# SERENITY_LIVE_VIEWS=1: snapshot listeners keep this user's docs in memory;
+# the handle lives in session_state and detaches when the session is dropped;
+# a failed or missing view is re-attached with backoff (utils/live.py renew).
+st.session_state._live = watch_user(user_id, st.session_state.get("_live"))
+
 # --- Sidebar preferences ---
 st.sidebar.header("Preferences")
 style = st.sidebar.selectbox("Conversation style", ["friendly", "mentor", "coach"])
+speak_replies = st.sidebar.toggle("🔊 Read replies aloud", value=False)
 st.sidebar.write("---")
 st.sidebar.write("Tips: use the tabs below to explore features.")
 
@@ -186,15 +235,14 @@ st.title("🧘 Serenity Bot — Youth Mental Wellness")
 tabs = st.tabs(["Chat", "MoodTracker" ,"Breathing Coach", "Letters","insights", "Memory & Schedule Tab" ,"Mini Games"])
 
 # --- Chat Tab ---
-with tabs[0]:
+with tabs[0], profiler.span("Chat"):
     st.subheader("Chat with Serenity")
     st.caption("Record a quick voice note or upload audio, and/or type.")
 
     rec_cols = st.columns([1, 1])
 
-    # Persistent storage
-    if "rec_bytes" not in st.session_state:
-        st.session_state.rec_bytes = None
+    # Large payloads live in the session blob store; session_state keeps handles only
+    blob_store = session_blobs()
 
     with rec_cols[0]:
         if mic_recorder is not None:
@@ -209,9 +257,9 @@ with tabs[0]:
 
             if audio_data and audio_data.get("bytes"):
                 # Save audio immediately
-                st.session_state.rec_bytes = audio_data["bytes"]
+                blob_store.put("rec", audio_data["bytes"], "audio/wav")
                 st.success("🎤 Recording captured successfully!")
-                st.audio(st.session_state.rec_bytes, format="audio/wav")
+                st.audio(audio_data["bytes"], format="audio/wav")
         else:
             st.warning("Microphone recording not available (component not installed).")
 
@@ -224,23 +272,26 @@ with tabs[0]:
     if st.button("Send", key="chat_send"):
         content_summary = ""
 
-        # Prefer recorded mic bytes if available
-        if st.session_state.rec_bytes:
-            with st.spinner("Understanding your recorded audio..."):
-                content_summary = transcribe_or_understand_audio(
-                    st.session_state.rec_bytes, mime_type="audio/wav"
-                )
-            st.info(f"🎧 Recorded audio summary: {content_summary}")
+        # Gather recorded mic bytes and/or uploaded file, then understand them together
+        clips, labels = [], []
+        rec_bytes = blob_store.get("rec")
+        if rec_bytes:
+            clips.append((rec_bytes, "audio/wav"))
+            labels.append("🎧 Recorded audio summary")
 
-        # Uploaded audio
         if audio is not None:
             bytes_data = audio.read()
             ext = audio.name.split(".")[-1].lower()
             mime = "audio/wav" if ext == "wav" else ("audio/mp3" if ext == "mp3" else "audio/m4a")
-            with st.spinner("Understanding your uploaded audio..."):
-                file_summary = transcribe_or_understand_audio(bytes_data, mime_type=mime)
-            st.info(f"📎 Uploaded audio summary: {file_summary}")
-            content_summary = (content_summary + " " + file_summary).strip()
+            clips.append((bytes_data, mime))
+            labels.append("📎 Uploaded audio summary")
+
+        if clips:
+            with st.spinner("Understanding your audio..."):
+                summaries = understand_audio_clips(clips, user_id=user_id)
+            for label, summary in zip(labels, summaries):
+                st.info(f"{label}: {summary}")
+            content_summary = " ".join(s for s in summaries if s).strip()
 
         final_text = (text or "") + (" " + content_summary if content_summary else "")
         final_text = final_text.strip()
@@ -248,7 +299,7 @@ with tabs[0]:
         if not final_text:
             st.warning("Please provide text or audio.")
         else:
-            crisis = classify_crisis(final_text)
+            crisis = classify_crisis(final_text, user_id=user_id)
             if crisis["risk"] == "high":
                 st.error("🚨 It sounds serious. Reach out to AASRA: 91-9820466726 or KIRAN: 1800-599-0019.")
             elif crisis["risk"] == "medium":
@@ -278,12 +329,20 @@ with tabs[0]:
             prompt_text = (memory_context + final_text).strip()
 
             with st.spinner("Thinking..."):
-               reply = gemini_reply(prompt_text, style=style, mood_hint=mood_hint)
+               reply = gemini_reply(prompt_text, style=style, mood_hint=mood_hint, user_id=user_id)
+
+            st.chat_message("assistant", avatar="🧘").write(reply)
+            if speak_replies and reply:
+                try:
+                    audio_bytes, audio_mime = synthesize(reply)
+                    st.audio(audio_bytes, format=audio_mime)
+                except Exception as e:
+                    st.caption(f"🔇 Voice playback unavailable: {e}")
 
 
 
 # --- MoodTracker Tab ---
-with tabs[1]:
+with tabs[1], profiler.span("MoodTracker"):
     st.subheader("🪞 Daily Mood, Journal & Reflection")
 
     col1, col2 = st.columns(2)
@@ -299,17 +358,57 @@ with tabs[1]:
         note = st.text_input("One-line note (optional)")
 
     if st.button("💾 Save today's mood"):
-        with st.spinner("Reflecting..."):
-            reflection = reflect_mood(f"{mood} {note}")
-        log_mood(user_id, mood, note, reflection)
+        # save first; the reflection is generated in the background and patched onto the doc
+        mood_doc_id = log_mood(user_id, mood, note, None)
         try:
             update_daily_report(user_id)
         except Exception:
             pass
-        st.success("Saved! " + reflection)
+        st.session_state.reflection_job = reflections.start(user_id, mood_doc_id, f"{mood} {note}")
+        st.success("Saved! ✨ Your reflection is on its way…")
+
+    if not st.session_state.get("_reflections_resumed"):
+        st.session_state._reflections_resumed = True
+        try:
+            # reflections left "pending" by a restart: re-queue today's, expire the rest
+            st.session_state.reflection_job = reflections.resume(user_id) or st.session_state.get("reflection_job")
+        except Exception:
+            pass
+
+    if st.session_state.get("reflection_job"):
+        @st.fragment(run_every="2s")
+        def _reflection_poller():
+            res = reflections.poll(st.session_state.get("reflection_job") or "")
+            if res["state"] == "pending":
+                st.caption("🪞 Reflecting on your entry…")
+                return
+            st.session_state.reflection_job = None
+            if res["state"] == "done" and res["result"]:
+                st.session_state.last_reflection = res["result"]
+            elif res["state"] == "failed":
+                st.caption("🪞 Couldn't reflect right now — your mood is saved.")
+            if st.session_state.get("last_reflection"):
+                st.info("🪞 " + st.session_state.last_reflection)
+
+        _reflection_poller()
+    elif st.session_state.get("last_reflection"):
+        st.info("🪞 " + st.session_state.last_reflection)
+
+    # gentle check-in when the online trend detector sees a sustained dip (utils/trends.py)
+    try:
+        check_in = trends.check_in_due(user_id)
+    except Exception:
+        check_in = False
+    if check_in:
+        st.info("💙 The last few days look heavier than usual. Want to take a moment for yourself? "
+                "The Breathing Coach tab is here, or you could share what's going on in Chat. "
+                "Talking to someone you trust can help too.")
+        if st.button("I'm okay, thanks", key="trend_checkin_ack"):
+            trends.acknowledge(user_id)
+            st.rerun()
 
     st.markdown("### 📊 Your Emotional Journey (Past 14 Days)")
-    data = list_recent_moods(user_id, days=14)
+    data = list_recent_moods(user_id, days=14, full_text=True)  # notes go into the chart tooltips
 
     if not data:
         st.info("No data yet. Log a mood above.")
@@ -327,14 +426,8 @@ with tabs[1]:
         df.dropna(subset=["date"], inplace=True)
         df.sort_values("date", inplace=True)
 
-        # Map mood → numeric score (add new positives)
-        mood_map = {
-            "😊 Happy": 5, "🎉 Excited": 5, "😌 Calm": 5,
-            "🙂 Okay": 4,
-            "😟 Anxious": 2, "😢 Sad": 1, "😠 Angry": 1, "😴 Tired": 2, "🤒 Unwell": 1,
-            "⭐ Good Deed": 5, "🙏 Gratitude": 5,
-        }
-        df["score"] = df["mood"].map(mood_map).fillna(3)
+        # Map mood → numeric score (shared vocabulary, utils/moods.py)
+        df["score"] = df["mood"].map(mood_vocab.MOOD_SCORES).fillna(mood_vocab.DEFAULT_SCORE)
 
         # 🎨 Mood color map (add colors for new moods)
         color_map = {
@@ -465,18 +558,30 @@ with tabs[1]:
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             )
 
+    # --- ⬆️ Import mood history (CSV / XLSX, batched writes; see utils/importer.py) ---
+    with st.expander("⬆️ Import mood history"):
+        st.caption("Columns: date, mood (label, emoji, name or 1–5), note (optional). Duplicates are skipped.")
+        upload = st.file_uploader("CSV or Excel file", type=["csv", "xlsx"], key="mood_import")
+        if upload is not None and st.button("Import moods", key="mood_import_go"):
+            with st.spinner("Importing…"):
+                try:
+                    res = importer.import_file(user_id, upload, upload.name)
+                except Exception as e:
+                    res = None
+                    st.error(f"Could not read that file: {e}")
+            if res is not None:
+                st.success(f"Imported {res['imported']} of {res['rows']} rows "
+                           f"({res['duplicates']} duplicates, {res['rejected']} rejected).")
+                for line in res["errors"]:
+                    st.caption(line)
+
     # --- 🌿 Adaptive Affirmations ---
     st.markdown("---")
     st.subheader("🌿 Personalized Daily Affirmation")
 
     history = list_recent_moods(user_id, days=7)
-    if history:
-        moods = [h["mood"] for h in history]
-        hint = "based on recent moods: " + ", ".join(moods)
-        last_mood = moods[-1]
-    else:
-        hint = "no prior mood data"
-        last_mood = None
+    moods = [h["mood"] for h in history]
+    last_mood = moods[-1] if moods else None
 
     if last_mood in ["😢 Sad", "😟 Anxious", "😠 Angry", "🤒 Unwell"]:
         st.caption("💌 You seem to be going through a rough patch — here's something comforting.")
@@ -487,11 +592,11 @@ with tabs[1]:
 
     if st.button("✨ Generate Affirmation"):
         with st.spinner("Creating your personalized affirmation..."):
-            aff = generate_affirmation(hint)
+            aff = affirmations.affirmation_for(moods, user_id=user_id)  # pooled; LLM only for rare patterns
         st.success(f"💫 {aff}")
 
 # --- Breathing Coach Tab ---
-with tabs[2]:
+with tabs[2], profiler.span("Breathing Coach"):
     st.subheader("Box Breathing (4–4–4)")
     st.caption("Inhale 4 • Hold 4 • Exhale 4 • Hold 4")
 
@@ -507,6 +612,19 @@ with tabs[2]:
         # You can tweak size with the slider
         size = st.slider("Circle size", 120, 400, 240, step=10)
         speed = st.slider("Breath speed (seconds per phase)", 3, 8, 4, step=1)
+        spoken_cues = st.toggle("🗣️ Spoken cues", value=False, help="Voice says Inhale / Hold / Exhale")
+
+        cue_audio = {}
+        if spoken_cues:
+            import base64
+            for cue in BREATHING_CUES:
+                try:
+                    cue_bytes, cue_mime = synthesize(cue)  # pre-rendered at startup, so a cache hit
+                    cue_audio[cue] = f"data:{cue_mime};base64," + base64.b64encode(cue_bytes).decode("utf-8")
+                except Exception:
+                    cue_audio = {}
+                    st.caption("🔇 No voice engine available for spoken cues.")
+                    break
 
         circle_html = f"""
         <div style="display:flex;flex-direction:column;align-items:center;gap:10px;">
@@ -527,6 +645,11 @@ with tabs[2]:
           const circle = document.getElementById('breath-circle');
           const text = document.getElementById('breath-text');
           const phase = {speed} * 1000;
+          const cues = {json.dumps(cue_audio)};
+          function say(label) {{
+            if (!cues[label]) return;
+            try {{ new Audio(cues[label]).play(); }} catch (e) {{}}
+          }}
           // Phases: Inhale (grow) → Hold → Exhale (shrink) → Hold
           let t = 0;
           function step() {{
@@ -534,13 +657,17 @@ with tabs[2]:
             if (mod === 0) {{
               circle.style.transform = 'scale(1.00)';
               text.textContent = 'Inhale…';
+              say('Inhale…');
             }} else if (mod === 1) {{
               text.textContent = 'Hold…';
+              say('Hold…');
             }} else if (mod === 2) {{
               circle.style.transform = 'scale(0.75)';
               text.textContent = 'Exhale…';
+              say('Exhale…');
             }} else {{
               text.textContent = 'Hold…';
+              say('Hold…');
             }}
             t++;
           }}
@@ -555,16 +682,19 @@ with tabs[2]:
     # --- Background music (opt-in, only when this tab is active) ---
     import base64, os
     if music_on:
-        if "breath_audio_bytes" not in st.session_state:
+        blob_store = session_blobs()
+        if "breath_audio" not in blob_store:
             default_path = os.path.join("assets", "breath.mp3")
             if os.path.exists(default_path):
-                st.session_state.breath_audio_bytes = open(default_path, "rb").read()
+                with open(default_path, "rb") as f:
+                    blob_store.put("breath_audio", f.read(), "audio/mpeg")
             else:
                 up = st.file_uploader("Upload MP3 (optional)", type=["mp3"], key="upl_breath")
-                if up: st.session_state.breath_audio_bytes = up.read()
+                if up: blob_store.put("breath_audio", up.read(), "audio/mpeg")
 
-        if "breath_audio_bytes" in st.session_state:
-            b64 = base64.b64encode(st.session_state.breath_audio_bytes).decode("utf-8")
+        breath_audio = blob_store.get("breath_audio")
+        if breath_audio:
+            b64 = base64.b64encode(breath_audio).decode("utf-8")
             audio_html = f"""
             <audio id="bgm" autoplay loop playsinline>
               <source src="data:audio/mpeg;base64,{b64}" type="audio/mpeg">
@@ -598,141 +728,99 @@ with tabs[2]:
             st.caption("Load music by placing assets/breath.mp3 or uploading an MP3.")
 
 # --- Letters Tab ---
-with tabs[3]:
+with tabs[3], profiler.span("Letters"):
     st.subheader("Write a letter to your future self")
     content = st.text_area("Write from the heart... (only you can see this)")
     default_date = (datetime.date.today() + datetime.timedelta(days=7)).isoformat()
     deliver_on = st.date_input("Deliver to me on", value=datetime.date.fromisoformat(default_date))
 
+    user_email = (st.session_state.user or {}).get("email")
+    email_me = st.checkbox("📧 Email me a reminder when it's ready", value=False, disabled=not user_email)
+
     if st.button("Save Letter"):
-        store_letter(user_id, content, deliver_on.isoformat())
+        store_letter(user_id, content, deliver_on.isoformat(), notify_email=user_email if email_me else None)
         st.success(f"Saved! I'll show this back to you on or after {deliver_on.isoformat()}.")
 
     st.write("### Letters ready for you")
-    due = due_letters(user_id)
+    # The scheduler (utils/letters.py) and store_letter keep a one-doc flag; skip the letters query
+    # only while the flag says nothing is due (nor falls due today) and a scheduler is scanning.
+    flag = letters_flag(user_id)
+    came_due = bool(flag and flag.get("next_due") and flag["next_due"] <= datetime.date.today().isoformat())
+    try:
+        trust_flag = flag is not None and not flag.get("has_due") and not came_due and letters.scheduler_alive()
+    except Exception:
+        trust_flag = False
+    due = [] if trust_flag else due_letters(user_id)
+    if flag and (flag.get("has_due") or came_due) and not due:
+        set_letters_flag(user_id, False, next_due=None)  # later letters: the scheduler flags them
     if due:
         for item in due:
             with st.expander(f"Letter from {item['deliver_on']}"):
                 st.write(item["content"])
                 if st.button("Mark as read", key=item["id"]):
-                    mark_letter_delivered(item["id"])
+                    mark_letter_delivered(item["id"], user_id)
+                    if flag is not None and len(due) == 1:
+                        set_letters_flag(user_id, False)
                     st.success("Marked delivered.")
                     st.rerun()
     else:
         st.info("No letters due yet.")
 
 # --- Insights Tab ---
-with tabs[4]:
+with tabs[4], profiler.span("Insights"):
     st.subheader("📈 Daily Insights (last 30 days)")
 
-    # 1) Pull data (30d so it feels more useful than 14)
-    raw = list_recent_moods(user_id, days=30)
+    # 1) Per-day aggregates: nightly insights/{uid} snapshot + today's moods (utils/insights.py)
+    days = insights.load_days(user_id)
+    summary = insights.summarize(days)
 
-    if not raw:
+    if summary is None:
         st.info("Log moods to see insights.")
-        st.stop()
-
-    # 2) Build DataFrame and normalize dates safely
-    df = pd.DataFrame(raw)
-
-    # Try to assemble a reliable datetime column "dt":
-    # - Prefer explicit string 'date' (YYYY-MM-DD) from our db.py
-    # - Else try Firestore Timestamp 'ts'
-    # - Else try 'created_at'
-    def _coerce_dt(row):
-        # a) fast path: yyyy-mm-dd string
-        d = row.get("date")
-        if isinstance(d, str) and len(d) >= 10:
-            try:
-                return pd.to_datetime(d, errors="coerce")
-            except Exception:
-                pass
-        # b) Firestore Timestamp-like object (has .to_datetime or .isoformat or is datetime)
-        for k in ("ts", "created_at"):
-            t = row.get(k)
-            if t is None:
-                continue
-            # pandas handles python datetimes and numpy datetimes
-            try:
-                return pd.to_datetime(t, errors="coerce")
-            except Exception:
-                # last resort: str → to_datetime
-                try:
-                    return pd.to_datetime(str(t), errors="coerce")
-                except Exception:
-                    pass
-        return pd.NaT
-
-    df["dt"] = df.apply(_coerce_dt, axis=1)
-    df.dropna(subset=["dt"], inplace=True)
-    if df.empty:
-        st.info("I fetched moods but couldn't parse their dates. Try logging one new mood now, then come back here.")
-        st.stop()
-
-    df.sort_values("dt", inplace=True)
-
-    # 3) Score mapping (keep in sync with MoodTracker)
-    mood_map = {
-        "😊 Happy": 5, "🎉 Excited": 5, "😌 Calm": 5,
-        "🙂 Okay": 4,
-        "😟 Anxious": 2, "😢 Sad": 1, "😠 Angry": 1, "😴 Tired": 2, "🤒 Unwell": 1,
-        "⭐ Good Deed": 5, "🙏 Gratitude": 5,
-    }
-    df["score"] = df["mood"].map(mood_map).fillna(3)
-
-    # 4) KPIs
-    last30_avg = df["score"].mean()
-    most_common = df["mood"].value_counts().idxmax()
-
-    # Streak: consecutive days with any entry (from most recent backwards)
-    dailies = df.groupby(df["dt"].dt.date).agg(avg=("score", "mean")).reset_index()
-    dailies.sort_values("dt", inplace=True)
-    # compute streak ending today
-    today = pd.Timestamp(pd.Timestamp.today().date())
-    dates_set = set(pd.to_datetime(dailies["dt"]).dt.date.tolist())
-    streak = 0
-    cur = today
-    while cur.date() in dates_set:
-        streak += 1
-        cur = cur - pd.Timedelta(days=1)
-
-    c1, c2, c3 = st.columns(3)
-    c1.metric("Avg mood (30d)", f"{last30_avg:.2f}/5")
-    c2.metric("Most frequent mood", most_common)
-    c3.metric("Daily logging streak", f"{streak} days")
-
-    # 5) Weekly average trend (week starts Monday)
-    df["week"] = df["dt"].dt.to_period("W-MON").apply(lambda r: r.start_time)
-    weekly = df.groupby("week", observed=False)["score"].mean().reset_index()
-    line = px.line(weekly, x="week", y="score", markers=True, title="Weekly Average Mood")
-    line.update_layout(yaxis=dict(range=[0, 5.5]), plot_bgcolor="white", paper_bgcolor="white", height=320, margin=dict(l=20,r=20,t=40,b=20))
-    st.plotly_chart(line, use_container_width=True)
-
-    # 6) Weekday heatmap (how your mood varies by day of week)
-    df["weekday"] = df["dt"].dt.day_name()
-    wmap = (df.groupby("weekday", observed=False)["score"].mean()
-              .reindex(["Monday","Tuesday","Wednesday","Thursday","Friday","Saturday","Sunday"]))
-    heat_df = pd.DataFrame({"weekday": wmap.index, "avg_score": wmap.values})
-    heat = px.bar(heat_df, x="weekday", y="avg_score", title="Average Mood by Weekday", range_y=[0,5.5])
-    heat.update_layout(showlegend=False, plot_bgcolor="white", paper_bgcolor="white", height=300, margin=dict(l=20,r=20,t=40,b=20))
-    st.plotly_chart(heat, use_container_width=True)
-
-    # 7) Small wins / prompts
-    pos_days = (dailies["avg"] >= 4.5).sum()
-    tough_days = (dailies["avg"] <= 2.0).sum()
-    if pos_days:
-        st.success(f"🌞 {pos_days} super-positive day(s) in the last month — keep doing what works!")
-    if tough_days:
-        st.info(f"💪 {tough_days} tough day(s). Check your Breathing Coach or add a Good Deed to nudge momentum.")
-
-    # 8) Optional debug (so you never get stuck wondering why it's empty)
-    with st.expander("🛠️ Debug: show parsed moods"):
-        st.write(f"Loaded rows: {len(df)}")
-        st.dataframe(df[["dt","mood","note","score"]].tail(20), use_container_width=True)
+    else:
+        # 2) KPIs
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Avg mood (30d)", f"{summary['avg']:.2f}/5")
+        c2.metric("Most frequent mood", summary["most_common"] or "—")
+        c3.metric("Daily logging streak", f"{summary['streak']} days")
+
+        # 3) Weekly average trend (week starts Monday)
+        weekly = pd.DataFrame(summary["weekly"], columns=["week", "score"])
+        weekly["week"] = pd.to_datetime(weekly["week"])
+        line = px.line(weekly, x="week", y="score", markers=True, title="Weekly Average Mood")
+        line.update_layout(yaxis=dict(range=[0, 5.5]), plot_bgcolor="white", paper_bgcolor="white", height=320, margin=dict(l=20,r=20,t=40,b=20))
+        st.plotly_chart(line, use_container_width=True)
+
+        # 4) Weekday profile (how your mood varies by day of week)
+        heat_df = pd.DataFrame({"weekday": list(summary["weekday"]), "avg_score": list(summary["weekday"].values())})
+        heat = px.bar(heat_df, x="weekday", y="avg_score", title="Average Mood by Weekday", range_y=[0,5.5])
+        heat.update_layout(showlegend=False, plot_bgcolor="white", paper_bgcolor="white", height=300, margin=dict(l=20,r=20,t=40,b=20))
+        st.plotly_chart(heat, use_container_width=True)
+
+        # 4b) Note sentiment over time (scored locally, utils/sentiment.py)
+        if summary["sentiment"]:
+            sent = pd.DataFrame(summary["sentiment"], columns=["date", "sentiment"])
+            sent["date"] = pd.to_datetime(sent["date"])
+            sline = px.line(sent, x="date", y="sentiment", markers=True, title="Journal Note Sentiment")
+            sline.add_hline(y=0, line_dash="dot", line_color="#9CA3AF")
+            sline.update_layout(yaxis=dict(range=[-1.05, 1.05], title="negative ← → positive"),
+                                plot_bgcolor="white", paper_bgcolor="white", height=300, margin=dict(l=20,r=20,t=40,b=20))
+            st.plotly_chart(sline, use_container_width=True)
+
+        # 5) Small wins / prompts
+        if summary["pos_days"]:
+            st.success(f"🌞 {summary['pos_days']} super-positive day(s) in the last month — keep doing what works!")
+        if summary["tough_days"]:
+            st.info(f"💪 {summary['tough_days']} tough day(s). Check your Breathing Coach or add a Good Deed to nudge momentum.")
+
+        # 6) Optional debug (so you never get stuck wondering why it's empty)
+        with st.expander("🛠️ Debug: show daily aggregates"):
+            st.write(f"Entries: {summary['entries']} over {len(summary['daily'])} day(s)")
+            st.dataframe(pd.DataFrame(summary["daily"], columns=["date", "avg_score"]).tail(20),
+                         use_container_width=True)
 
 
 # --- Memory & Schedule Tab ---
-with tabs[5]:
+with tabs[5], profiler.span("Memory & Schedule"):
     st.subheader("🧠 Memory & Schedule (helps me help YOU)")
 
     # ========================================
@@ -773,18 +861,21 @@ with tabs[5]:
     # ========================================
     st.markdown("### 🗓️ Weekly Schedule (for clash-aware suggestions)")
 
-    # local cache so delete reflects instantly
-    if "_schedule_cache" not in st.session_state:
-        try:
-            st.session_state._schedule_cache = list_schedule(user_id) or []
-        except Exception:
-            st.session_state._schedule_cache = []
+    # working copy in the shared cache (utils/cache.py) so delete reflects instantly on every replica
+    _sched_ns = cache.user_ns(user_id, "ui")
 
     def _get_schedule():
-        return st.session_state.get("_schedule_cache", [])
+        rows = cache.get(_sched_ns, "schedule")
+        if rows is None:
+            try:
+                rows = list_schedule(user_id) or []
+            except Exception:
+                rows = []
+            cache.set(_sched_ns, "schedule", rows, ttl=cache.SESSION_TTL_S)
+        return rows
 
     def _set_schedule(new_list):
-        st.session_state._schedule_cache = new_list
+        cache.set(_sched_ns, "schedule", new_list, ttl=cache.SESSION_TTL_S)
 
     scol1, scol2 = st.columns(2)
     with scol1:
@@ -807,15 +898,8 @@ with tabs[5]:
                 location=s_loc, notes=s_notes,
                 priority=s_priority, travel_mins=int(s_travel)
             )
-            # update cache immediately
-            local = _get_schedule()
-            local.append({
-                "title": s_title, "days": s_days,
-                "start_time": s_start, "end_time": s_end,
-                "priority": int(s_priority), "travel_mins": int(s_travel),
-                "location": s_loc, "notes": s_notes,
-            })
-            _set_schedule(local)
+            # drop the working copy; the next _get_schedule() reloads it (new item included)
+            cache.delete(_sched_ns, "schedule")
             st.success("✅ Added to weekly schedule!")
             st.rerun()
         except Exception as e:
@@ -900,8 +984,8 @@ with tabs[5]:
 
 
 # --- Mini Games Tab ---
-with tabs[6]:
-    import io, time, random, numpy as np
+with tabs[6], profiler.span("Mini Games"):
+    import random, numpy as np
     from PIL import Image, ImageDraw, ImageFilter, ImageEnhance
     try:
         from streamlit_drawable_canvas import st_canvas
@@ -919,6 +1003,10 @@ with tabs[6]:
     if st.button("Save Gratitude", key="gratitude_save"):
         note = "Grateful for: " + ", ".join(picked) if picked else "Grateful practice opened."
         log_mood(uid_safe, "🙏 Gratitude", note, "Practiced gratitude.")
+        try:
+            update_daily_report(uid_safe)  # batched with the mood write when write-behind is on
+        except Exception:
+            pass
         st.success("Saved. Gratitude boosts resilience!")
 
     st.write("---")
@@ -927,78 +1015,21 @@ with tabs[6]:
     st.subheader("🎴 Emoji Memory Match")
     st.caption("Flip two cards. Match the pair. Clear the board in the fewest moves and time!")
 
-    if "mm_board" not in st.session_state:
-        emojis = ["🐶","🐱","🦊","🐼","🐵","🦄","🐸","🐯","🍉","🍓","🍒","🍋","🍇","🍑","🍍","🥝"]
-        chosen = random.sample(emojis, 8)
-        board = chosen + chosen
-        random.shuffle(board)
-        st.session_state.mm_board    = board
-        st.session_state.mm_matched  = set()
-        st.session_state.mm_selected = []
-        st.session_state.mm_moves    = 0
-        st.session_state.mm_start_ts = time.time()
-        st.session_state.mm_done_s   = None
-        st.session_state.mm_best     = st.session_state.get("mm_best", None)
-
-    def _reset_memory():
-        random.shuffle(st.session_state.mm_board)
-        st.session_state.mm_matched  = set()
-        st.session_state.mm_selected = []
-        st.session_state.mm_moves    = 0
-        st.session_state.mm_start_ts = time.time()
-        st.session_state.mm_done_s   = None
-
-    c1, c2, c3 = st.columns(3)
-    with c1:
-        elapsed = int((st.session_state.mm_done_s or time.time()) - st.session_state.mm_start_ts)
-        st.metric("⏱ Time", f"{elapsed}s")
-    with c2:
-        st.metric("🧮 Moves", str(st.session_state.mm_moves))
-    with c3:
-        if st.button("🔁 New Game", key="mm_new"):
-            _reset_memory()
-            st.rerun()
-
-    board = st.session_state.mm_board
-    cols_per_row = 4
-    for r in range(0, len(board), cols_per_row):
-        cols = st.columns(cols_per_row)
-        for i, col in enumerate(cols, start=r):
-            if i >= len(board): 
-                continue
-            with col:
-                is_matched  = i in st.session_state.mm_matched
-                is_selected = i in st.session_state.mm_selected
-                face = board[i] if (is_matched or is_selected) else "❓"
-                disabled = is_matched or is_selected or st.session_state.mm_done_s is not None
-
-                if st.button(face, key=f"mm_card_{i}", disabled=disabled):
-                    st.session_state.mm_selected.append(i)
-                    if len(st.session_state.mm_selected) == 2:
-                        a, b = st.session_state.mm_selected
-                        st.session_state.mm_moves += 1
-                        if board[a] == board[b]:
-                            st.session_state.mm_matched.update({a, b})
-                            st.session_state.mm_selected = []
-                            if len(st.session_state.mm_matched) == len(board):
-                                st.session_state.mm_done_s = time.time()
-                        else:
-                            st.rerun()
-
-    if len(st.session_state.mm_selected) == 2:
-        if st.button("🙈 Hide mismatch", key="mm_hide", help="Click to continue"):
-            st.session_state.mm_selected = []
-            st.rerun()
-
-    if st.session_state.mm_done_s is not None:
-        final_secs = int(st.session_state.mm_done_s - st.session_state.mm_start_ts)
-        st.success(f"🎉 You cleared the board in {st.session_state.mm_moves} moves and {final_secs}s!")
+    # the whole game runs in the browser; we only hear back once per cleared board
+    result = memory_match(pairs=8, best=st.session_state.get("mm_best"), key="memory_match")
+    if result and result.get("finished_at") != st.session_state.get("mm_last_finish"):
+        st.session_state.mm_last_finish = result.get("finished_at")
+        best = st.session_state.get("mm_best")
+        if not best or (result["moves"], result["seconds"]) < (best["moves"], best["seconds"]):
+            st.session_state.mm_best = {"moves": result["moves"], "seconds": result["seconds"]}
+    if result:
+        st.success(f"🎉 Last game: {result['moves']} moves in {result['seconds']}s.")
 
     st.write("---")
 
     # ------------------ 🎨 Doodle & De-Stress (VISIBLE) ------------------
     st.subheader("🎨 Doodle & De-Stress")
-    st.caption("Draw freely. Use the toolbar (pen / eraser / undo). Toggle ✨ sparkle if you like.")
+    st.caption("Draw freely. Use the toolbar (undo / redo / clear / send). Toggle ✨ sparkle if you like.")
 
     # Make the canvas obviously visible (border, bg, shadow)
     st.markdown("""
@@ -1022,6 +1053,8 @@ with tabs[6]:
     # If the canvas ever fails to mount, changing this key forces a remount.
     canvas_key = st.number_input("Canvas key (touch only if canvas hides)", 1, 9999, value=1, step=1, key="dk")
 
+    # Strokes stay in the browser until the toolbar's send button is pressed;
+    # then only the fabric scene (json_data) is used, pixels are drawn here on demand.
     canvas = st_canvas(
         fill_color="rgba(0,0,0,0)",
         stroke_width=int(stroke_width),
@@ -1031,50 +1064,36 @@ with tabs[6]:
         height=CANVAS_H,
         drawing_mode="freedraw",
         display_toolbar=True,
-        update_streamlit=True,
+        update_streamlit=False,
         key=f"doodle_{canvas_key}",
     )
 
-    # Small, reliable glitter
-    def _has_drawing(img: Image.Image | None) -> bool:
-        if img is None: return False
-        return (np.array(img.convert("L")) < 250).any()
-
-    def _sparkle(img: Image.Image) -> Image.Image:
-        base = img.convert("RGBA")
-        blur = base.filter(ImageFilter.GaussianBlur(1.6))
-        base = Image.blend(base, blur, 0.25)
-        gray = np.array(base.convert("L"))
-        ys, xs = np.where(gray < 235)
-        overlay = Image.new("RGBA", base.size, (0,0,0,0))
-        draw = ImageDraw.Draw(overlay)
-        if len(xs) > 0:
-            n = min(70, max(24, len(xs)//140))
-            for _ in range(n):
-                k = random.randrange(len(xs))
-                x, y = int(xs[k]), int(ys[k])
-                draw.ellipse((x-1, y-1, x+1, y+1), fill=(255,245,190,180))
-        return Image.alpha_composite(base, overlay)
-
-    if canvas.image_data is not None:
-        img = Image.fromarray(canvas.image_data.astype("uint8"))
-        if _has_drawing(img):
-            if sparkle_on:
-                img = _sparkle(img)
-            out = io.BytesIO()
-            img.save(out, format="PNG")
-            out.seek(0)
-            st.session_state["doodle_png"] = out.getvalue()
+    blob_store = session_blobs()
+    scene = canvas.json_data if canvas is not None else None
+    if not doodle.has_strokes(scene):
+        st.caption("Press the ⬇️ send button in the canvas toolbar to sync your doodle.")
+        blob_store.drop("doodle_png")
+    else:
+        render_key = (doodle.scene_digest(scene), bool(sparkle_on))
+        if st.session_state.get("doodle_png_key") != render_key:
+            blob_store.drop("doodle_png")
+        if st.button("🖼️ Render PNG", key="doodle_render", use_container_width=True):
+            blob_store.put("doodle_png", doodle.to_png(scene, CANVAS_W, CANVAS_H, "#f8f6ff",
+                                                       with_sparkle=sparkle_on), "image/png")
+            st.session_state["doodle_png_key"] = render_key
             st.success("🧑‍🎨 Doodle saved!")
-        else:
-            st.session_state.pop("doodle_png", None)
+    doodle_png = blob_store.get("doodle_png")
+    if sparkle_on and doodle_png:
+        st.image(doodle_png, caption="✨ Sparkled")
 
     st.download_button(
         "📥 Download doodle",
-        data=st.session_state.get("doodle_png", b""),
+        data=doodle_png or b"",
         file_name="doodle.png",
         mime="image/png",
-        disabled=("doodle_png" not in st.session_state),
+        disabled=doodle_png is None,
         use_container_width=True,
         key="doodle_download",
     )
+
+profiler.end_rerun()
@@ -0,0 +1,221 @@
+# benchmarks/bench_app.py
+"""
+End-to-end benchmarks for the chat, mood and insights paths.
+
+Streamlit renders every tab on each rerun, so the mood_tracker and insights
+scenarios time a plain rerun but report only their tab's profiler span.
+
+Drives the real app.py with Streamlit's AppTest against the in-memory storage
+backend and the stub LLM, both with configurable latency, at several synthetic
+data sizes. Reports p50/p95 latency plus Firestore reads and LLM calls per
+interaction, and compares against benchmarks/baselines.json.
+
+    python -m benchmarks.bench_app                      # run + compare
+    python -m benchmarks.bench_app --save-baseline      # run + overwrite baselines
+    python -m benchmarks.bench_app --sizes 10 1000 --repeat 10 --llm-ms 400 --db-ms 40
+"""
+import os, sys, json, time, random, argparse, datetime, statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "app.py")
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baselines.json")
+BENCH_USER = {"uid": "bench-user", "email": "bench@example.com"}
+
+MOODS = ["😊 Happy", "🎉 Excited", "😌 Calm", "🙂 Okay", "😟 Anxious", "😢 Sad", "😠 Angry", "😴 Tired", "🤒 Unwell"]
+
+
+def _parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Serenity Bot end-to-end benchmarks")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000], help="moods per user")
+    p.add_argument("--repeat", type=int, default=20, help="iterations per scenario")
+    p.add_argument("--llm-ms", type=float, default=0.0, help="stub Gemini latency per call")
+    p.add_argument("--db-ms", type=float, default=0.0, help="stub Firestore latency per round trip")
+    p.add_argument("--scenarios", nargs="+", default=None, help="subset of scenarios to run")
+    p.add_argument("--save-baseline", action="store_true", help="write results as the new baseline")
+    p.add_argument("--tolerance", type=float, default=0.20, help="allowed p95 regression (fraction)")
+    return p.parse_args(argv)
+
+
+def _configure_env(args):
+    # must happen before utils.* is imported: backends are picked at import time
+    os.environ["SERENITY_STORAGE"] = "memory"
+    os.environ["SERENITY_LLM"] = "stub"
+    os.environ["SERENITY_STUB_LLM_MS"] = str(args.llm_ms)
+    os.environ["SERENITY_STORAGE_LATENCY_MS"] = str(args.db_ms)
+    os.environ["SERENITY_TTS_PRERENDER"] = "0"
+    os.environ.setdefault("SERENITY_LLM_RPM", "1000000")  # measure the app, not the quota manager
+    os.environ.setdefault("SERENITY_LLM_USER_RPM", "1000000")
+    os.environ["SERENITY_PROFILE"] = "1"  # per-tab spans (MoodTracker, Insights, ...)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+# -----------------------------
+# Synthetic data
+# -----------------------------
+def seed_user(client, user_id: str, n_moods: int, rng: random.Random):
+    """Moods spread over the last 30 days (all inside the Insights window), plus memories/schedule/letters."""
+    today = datetime.date.today()
+    span = max(1, min(n_moods, 30))
+    batch, pending = client.batch(), 0
+
+    def _put(collection, doc):
+        nonlocal batch, pending
+        batch.set(client.collection(collection).document(), doc)
+        pending += 1
+        if pending >= 500:
+            batch.commit()
+            batch, pending = client.batch(), 0
+
+    for i in range(n_moods):
+        day = today - datetime.timedelta(days=i % span)
+        _put("moods", {"user_id": user_id, "mood": rng.choice(MOODS), "note": f"note {i}",
+                       "reflection": "", "date": day.isoformat()})
+    for i in range(20):
+        _put("memories", {"user_id": user_id, "key": f"fact {i}", "value": "something to remember",
+                          "tags": [], "importance": 3, "created_date": today.isoformat()})
+    for i, (start, end) in enumerate([("08:00", "09:00"), ("08:30", "10:00"), ("18:00", "19:30")]):
+        _put("schedules", {"user_id": user_id, "title": f"activity {i}", "days": ["Mon", "Wed", "Fri"],
+                           "start_time": start, "end_time": end, "priority": 3, "travel_mins": 15})
+    for i in range(3):
+        _put("letters", {"user_id": user_id, "content": f"letter {i}", "delivered": False,
+                         "deliver_on": (today - datetime.timedelta(days=i)).isoformat()})
+    if pending:
+        batch.commit()
+
+
+# -----------------------------
+# Scenarios: fn(at) performs the interaction, then at.run() is timed
+# -----------------------------
+def _by_label(elements, label):
+    return next(e for e in elements if e.label == label)
+
+
+def _chat_send(at):
+    _by_label(at.text_area, "Type what's on your mind").input("I feel a bit stressed about exams")
+    at.button(key="chat_send").click()
+
+
+def _save_mood(at):
+    _by_label(at.button, "💾 Save today's mood").click()
+
+
+def _rerun(at):
+    pass  # plain rerun; every tab renders, the scenario's span picks one out
+
+
+def _find_clashes(at):
+    _by_label(at.button, "Find time clashes").click()
+
+
+# name -> (interaction, profiler span to time or None for the whole rerun)
+SCENARIOS = {
+    "chat_send": (_chat_send, None),
+    "save_mood": (_save_mood, None),
+    "mood_tracker": (_rerun, "MoodTracker"),
+    "insights": (_rerun, "Insights"),
+    "find_clashes": (_find_clashes, None),
+}
+
+
+# -----------------------------
+# Runner
+# -----------------------------
+def _pct(samples, q):
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+
+
+def run_scenario(name, fn, size, repeat, storage, metrics, profiler, span=None):
+    """Latency is the whole rerun, or just `span` (a tab) when given; reads / LLM calls are per rerun."""
+    from streamlit.testing.v1 import AppTest
+
+    storage.reset("memory")
+    client = storage.client("memory")
+    seed_user(client, BENCH_USER["uid"], size, random.Random(size))
+
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.session_state["user"] = dict(BENCH_USER)
+    at.run()  # warm: imports, first figure, session state
+    if at.exception:
+        raise RuntimeError(f"{name}@{size}: app raised {at.exception[0].value}")
+
+    lat, reads, calls, spans = [], [], [], {}
+    for _ in range(repeat):
+        fn(at)
+        before = metrics.totals()
+        t0 = time.perf_counter()
+        at.run()
+        total_ms = (time.perf_counter() - t0) * 1000.0
+        after = metrics.totals()
+        last = profiler.last_rerun()
+        lat.append(last.get(span, total_ms) if span else total_ms)
+        reads.append(after["docs_read"] - before["docs_read"])
+        calls.append(after["llm_calls"] - before["llm_calls"])
+        for k, ms in last.items():
+            spans.setdefault(k, []).append(ms)
+        if at.exception:
+            raise RuntimeError(f"{name}@{size}: app raised {at.exception[0].value}")
+
+    return {
+        "p50_ms": round(statistics.median(lat), 2),
+        "p95_ms": round(_pct(lat, 0.95), 2),
+        "reads": round(statistics.mean(reads), 1),
+        "llm_calls": round(statistics.mean(calls), 2),
+        "spans_p50_ms": {k: round(statistics.median(v), 2) for k, v in sorted(spans.items())},
+    }
+
+
+def compare(results: dict, baselines: dict, tolerance: float) -> list[str]:
+    """Regression messages: p95 beyond tolerance, or more reads / LLM calls than baseline."""
+    out = []
+    for key, cur in results.items():
+        base = baselines.get(key)
+        if not base:
+            continue
+        if cur["p95_ms"] > base["p95_ms"] * (1 + tolerance) and cur["p95_ms"] - base["p95_ms"] > 5:
+            out.append(f"{key}: p95 {base['p95_ms']}ms -> {cur['p95_ms']}ms")
+        if cur["reads"] > base["reads"]:
+            out.append(f"{key}: reads/interaction {base['reads']} -> {cur['reads']}")
+        if cur["llm_calls"] > base["llm_calls"]:
+            out.append(f"{key}: LLM calls/interaction {base['llm_calls']} -> {cur['llm_calls']}")
+    return out
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    _configure_env(args)
+    from utils import storage, metrics, profiler
+
+    names = args.scenarios or list(SCENARIOS)
+    results = {}
+    print(f"{'scenario':<14}{'moods':>7}{'p50 ms':>10}{'p95 ms':>10}{'reads':>9}{'llm':>6}")
+    for size in args.sizes:
+        for name in names:
+            fn, span = SCENARIOS[name]
+            res = run_scenario(name, fn, size, args.repeat, storage, metrics, profiler, span)
+            results[f"{name}@{size}"] = res
+            print(f"{name:<14}{size:>7}{res['p50_ms']:>10}{res['p95_ms']:>10}{res['reads']:>9}{res['llm_calls']:>6}")
+            tabs = {k: v for k, v in res["spans_p50_ms"].items() if "/" not in k}
+            print(" " * 21 + "  ".join(f"{k} {v}ms" for k, v in tabs.items()))
+
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            baselines = json.load(f)
+
+    if args.save_baseline:
+        baselines.update(results)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {BASELINE_PATH}")
+        return 0
+
+    regressions = compare(results, baselines, args.tolerance)
+    for msg in regressions:
+        print("REGRESSION", msg)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
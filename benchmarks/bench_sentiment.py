@@ -0,0 +1,70 @@
+# benchmarks/bench_sentiment.py
+"""
+Throughput of the local note scorer (utils/sentiment.py) in notes per second.
+
+Scores synthetic one-line notes in batches of several sizes, and one at a time
+for comparison (the per-save path in log_mood).
+
+    python -m benchmarks.bench_sentiment
+    python -m benchmarks.bench_sentiment --notes 100000 --batch 1 100 1000 10000 --repeat 5
+"""
+import os, sys, time, random, argparse, statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FILLER = ["today", "i", "felt", "the", "class", "was", "after", "school", "with", "my", "mom", "and",
+          "then", "we", "went", "home", "practice", "dance", "a", "lot", "of", "homework", "it"]
+MODIFIERS = ["not", "very", "really", "didn't", "so", "kinda", "never"]
+
+
+def synthetic_notes(n: int, rng: random.Random) -> list[str]:
+    from utils import sentiment
+    words = sentiment._WORDS
+    notes = []
+    for _ in range(n):
+        k = rng.randint(4, 20)
+        toks = [rng.choice(FILLER) for _ in range(k)]
+        for _ in range(rng.randint(0, 3)):
+            pos = rng.randrange(k)
+            toks[pos] = rng.choice(words)
+            if rng.random() < 0.3 and pos:
+                toks[pos - 1] = rng.choice(MODIFIERS)
+        notes.append(" ".join(toks).capitalize() + rng.choice([".", "!", "", "..."]))
+    return notes
+
+
+def bench(notes: list[str], batch: int, repeat: int) -> dict:
+    from utils import sentiment
+    rates = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        if batch == 1:
+            for note in notes:
+                sentiment.score(note)
+        else:
+            for i in range(0, len(notes), batch):
+                sentiment.score_batch(notes[i:i + batch])
+        rates.append(len(notes) / (time.perf_counter() - t0))
+    return {"batch": batch, "notes_per_s": statistics.median(rates), "best": max(rates)}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Local note sentiment throughput")
+    p.add_argument("--notes", type=int, default=20000, help="synthetic notes per run")
+    p.add_argument("--batch", type=int, nargs="+", default=[1, 100, 1000, 10000], help="batch sizes")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--seed", type=int, default=7)
+    args = p.parse_args(argv)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    notes = synthetic_notes(args.notes, random.Random(args.seed))
+    print(f"{'batch':>8} {'notes/s (median)':>18} {'best':>12}")
+    for b in args.batch:
+        r = bench(notes if b > 1 else notes[:min(len(notes), 5000)], b, args.repeat)
+        print(f"{r['batch']:>8} {r['notes_per_s']:>18,.0f} {r['best']:>12,.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
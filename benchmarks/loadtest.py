@@ -0,0 +1,282 @@
+# benchmarks/loadtest.py
+"""
+Concurrent-session load test against the real app.py.
+
+Populates a SQLite backend with synthetic users (benchmarks/synthetic.py), then
+for each concurrency level M starts M worker processes, each driving one
+AppTest session. Each session loops a scripted journey
+(login -> chat -> save mood -> Insights -> gratitude game) with think time, for
+--duration seconds. Gemini is the stub backend (SERENITY_LLM=stub) with
+configurable latency.
+
+One process per session because AppTest is not thread-safe: every run()
+installs a mock Runtime singleton and resets it when it finishes, which breaks
+any sibling run in the same process (download buttons, audio, images). The
+price is that sessions share no in-process state (caches, LLM coalescing, job
+pools), which makes the numbers a little pessimistic against one
+`streamlit run` server hosting M sessions; that server is what to measure
+before trusting the knee for sizing.
+
+Per level it reports:
+  - steps/s and journeys/s
+  - rerun latency p50 / p95 / p99
+  - errors
+  - resident memory per session
+It then names the saturation point: the first level where throughput stops
+growing (< --min-gain) or p95 exceeds --slo-ms.
+
+    python -m benchmarks.loadtest
+    python -m benchmarks.loadtest --users 1000 --concurrency 1 2 4 8 16 32 --duration 30 --llm-ms 400
+
+AppTest does not render custom components, so the memory-match board is not
+exercised; the Mini Games step plays the gratitude picker instead.
+"""
+import os, sys, gc, json, time, random, argparse, tempfile, subprocess, statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "app.py")
+
+CHAT_LINES = ["I feel a bit stressed about exams", "today was actually pretty good",
+              "can't sleep again", "how do I stop overthinking?", "I helped a friend today"]
+
+
+def _parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Serenity Bot concurrent-session load test")
+    p.add_argument("--users", type=int, default=200, help="synthetic users to generate")
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="sessions per level")
+    p.add_argument("--duration", type=float, default=20.0, help="seconds per level")
+    p.add_argument("--think-ms", type=float, default=250.0, help="pause between steps per session")
+    p.add_argument("--llm-ms", type=float, default=300.0, help="stub Gemini latency per call")
+    p.add_argument("--db-ms", type=float, default=0.0, help="extra storage latency per round trip")
+    p.add_argument("--db", default=None, help="sqlite file (default: fresh temp file)")
+    p.add_argument("--slo-ms", type=float, default=2000.0, help="p95 rerun latency considered saturated")
+    p.add_argument("--min-gain", type=float, default=0.10, help="throughput growth below this = saturated")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--json", default=None, help="write results to this file")
+    p.add_argument("--worker", default=None, help=argparse.SUPPRESS)  # internal: user id of one session
+    return p.parse_args(argv)
+
+
+def _configure_env(args, db_path):
+    # must happen before utils.* is imported: backends are picked at import time
+    os.environ["SERENITY_STORAGE"] = "sqlite"
+    os.environ["SERENITY_SQLITE_PATH"] = db_path
+    os.environ["SERENITY_LLM"] = "stub"
+    os.environ["SERENITY_STUB_LLM_MS"] = str(args.llm_ms)
+    os.environ["SERENITY_STORAGE_LATENCY_MS"] = str(args.db_ms)
+    os.environ["SERENITY_TTS_PRERENDER"] = "0"
+    os.environ.setdefault("SERENITY_LLM_RPM", "1000000")  # load the app, not the quota manager
+    os.environ.setdefault("SERENITY_LLM_USER_RPM", "1000000")
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # peak, Linux KiB
+
+
+def _pct(samples, q):
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))] if s else 0.0
+
+
+def _by_label(elements, label):
+    return next(e for e in elements if e.label == label)
+
+
+# -----------------------------
+# Journey steps: fn(at, rng) prepares the interaction, then at.run() is timed
+# -----------------------------
+def _chat(at, rng):
+    _by_label(at.text_area, "Type what's on your mind").input(rng.choice(CHAT_LINES))
+    at.button(key="chat_send").click()
+
+
+def _save_mood(at, rng):
+    from utils import moods
+    _by_label(at.selectbox, "How are you feeling today?").select(
+        rng.choice([m for m, _ in moods.MOODS if m not in moods.GOOD_DEEDS]))
+    _by_label(at.text_input, "One-line note (optional)").input(rng.choice(["long day", "felt calm", ""]))
+    _by_label(at.button, "💾 Save today's mood").click()
+
+
+def _insights(at, rng):
+    pass  # plain rerun: every tab, Insights included, renders on each run
+
+
+def _game(at, rng):
+    picker = _by_label(at.multiselect, "Choose any 3")
+    for option in rng.sample(["Family", "Friends", "Music", "Nature", "Kindness"], 2):
+        picker.select(option)
+    at.button(key="gratitude_save").click()
+
+
+JOURNEY = [("chat", _chat), ("save_mood", _save_mood), ("insights", _insights), ("game", _game)]
+
+
+class Session:
+    """One simulated browser tab: an AppTest bound to a synthetic user."""
+
+    def __init__(self, user_id: str, seed: int):
+        from streamlit.testing.v1 import AppTest
+        self.rng = random.Random(seed)
+        self.user_id = user_id
+        self.at = AppTest.from_file(APP_PATH, default_timeout=300)
+        self.at.session_state["user"] = {"uid": user_id, "email": f"{user_id}@example.com"}
+
+    def step(self, name, fn) -> tuple[float, bool]:
+        if fn is not None:
+            fn(self.at, self.rng)
+        t0 = time.perf_counter()
+        self.at.run()
+        ms = (time.perf_counter() - t0) * 1000.0
+        return ms, not self.at.exception
+
+
+def worker(args) -> int:
+    """One session in its own process: warm, log in, wait for "go", run the journey, print JSON."""
+    Session(args.worker, args.seed).step("warm", None)  # imports + first figures, not measured
+    gc.collect()
+    rss0 = _rss_bytes()
+    s = Session(args.worker, args.seed)
+    login_ms, ok = s.step("login", None)
+    errors = 0 if ok else 1
+    gc.collect()
+    mem = _rss_bytes() - rss0
+    print("ready", flush=True)
+    sys.stdin.readline()  # released together with the other sessions of this level
+    out, sys.stdout = sys.stdout, open(os.devnull, "w")  # app prints must not fill the pipe
+
+    samples, journeys = [], 0
+    deadline = time.perf_counter() + args.duration
+    while time.perf_counter() < deadline:
+        for name, fn in JOURNEY:
+            if time.perf_counter() >= deadline:
+                break
+            try:
+                ms, ok = s.step(name, fn)
+            except Exception:
+                ms, ok = 0.0, False
+            samples.append((name, ms))
+            errors += 0 if ok else 1
+            time.sleep(args.think_ms / 1000.0 * s.rng.uniform(0.5, 1.5))
+        else:
+            journeys += 1
+    print(json.dumps({"samples": samples, "errors": errors, "journeys": journeys,
+                      "login_ms": login_ms, "mem_bytes": mem}), file=out, flush=True)
+    return 0
+
+
+def _worker_cmd(args, user_id: str, seed: int) -> list[str]:
+    return [sys.executable, "-m", "benchmarks.loadtest", "--worker", user_id, "--seed", str(seed),
+            "--duration", str(args.duration), "--think-ms", str(args.think_ms)]
+
+
+def run_level(m: int, users: list[str], args) -> dict:
+    procs = [subprocess.Popen(_worker_cmd(args, users[i % len(users)], args.seed + i), cwd=ROOT,
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+             for i in range(m)]
+    try:
+        for p in procs:  # every session warmed up and logged in
+            while (line := p.stdout.readline()) and line.strip() != "ready":
+                pass
+        start = time.perf_counter()
+        for p in procs:
+            try:
+                p.stdin.write("go\n")
+                p.stdin.flush()
+            except BrokenPipeError:
+                pass  # died during warmup; counted as an error below
+        results = []
+        for p in procs:
+            out = [l for l in p.stdout.read().splitlines() if l.startswith('{"samples"')]
+            p.wait()
+            results.append(json.loads(out[-1]) if out and p.returncode == 0 else None)
+        elapsed = time.perf_counter() - start
+    finally:
+        for p in procs:
+            if p.poll() is None:
+                p.kill()
+
+    ok = [r for r in results if r]
+    samples = [tuple(x) for r in ok for x in r["samples"]]
+    lat = [ms for _, ms in samples]
+    login = [r["login_ms"] for r in ok]
+    by_step = {}
+    for name, ms in samples:
+        by_step.setdefault(name, []).append(ms)
+    return {
+        "sessions": m,
+        "steps": len(samples),
+        "steps_per_s": round(len(samples) / elapsed, 2),
+        "journeys_per_s": round(sum(r["journeys"] for r in ok) / elapsed, 3),
+        "p50_ms": round(_pct(lat, 0.50), 1),
+        "p95_ms": round(_pct(lat, 0.95), 1),
+        "p99_ms": round(_pct(lat, 0.99), 1),
+        "login_p50_ms": round(statistics.median(login), 1) if login else 0.0,
+        "errors": sum(r["errors"] for r in ok) + (len(results) - len(ok)),
+        "mem_per_session_mb": round(statistics.mean(r["mem_bytes"] for r in ok) / 2**20, 2) if ok else 0.0,
+        "steps_p95_ms": {k: round(_pct(v, 0.95), 1) for k, v in sorted(by_step.items())},
+    }
+
+
+def saturation(results: list[dict], slo_ms: float, min_gain: float) -> dict | None:
+    """First level past which adding sessions stops paying off."""
+    prev = None
+    for r in results:
+        knee = prev["sessions"] if prev else None
+        if r["p95_ms"] > slo_ms:
+            return {**r, "knee": knee, "reason": f"p95 {r['p95_ms']} ms > SLO {slo_ms:.0f} ms"}
+        if prev and r["steps_per_s"] < prev["steps_per_s"] * (1 + min_gain):
+            return {**r, "knee": knee, "reason": f"throughput {prev['steps_per_s']} -> {r['steps_per_s']} steps/s"}
+        prev = r
+    return None
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    if args.worker:  # environment inherited from the parent run
+        if ROOT not in sys.path:
+            sys.path.insert(0, ROOT)
+        return worker(args)
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="serenity-load-"), "load.sqlite3")
+    _configure_env(args, db_path)
+    from benchmarks import synthetic
+    from utils import storage
+
+    t0 = time.perf_counter()
+    counts = synthetic.generate(storage.client("sqlite"), args.users, args.seed)
+    print(f"seeded {args.users} users in {time.perf_counter() - t0:.1f}s: "
+          + ", ".join(f"{k} {v}" for k, v in sorted(counts.items())))
+    users = synthetic.user_ids(args.users)
+
+    results = []
+    print(f"{'sessions':>8}{'steps/s':>10}{'journeys/s':>12}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'errors':>8}{'MB/sess':>9}")
+    for m in args.concurrency:
+        r = run_level(m, users, args)
+        results.append(r)
+        print(f"{r['sessions']:>8}{r['steps_per_s']:>10}{r['journeys_per_s']:>12}{r['p50_ms']:>9}"
+              f"{r['p95_ms']:>9}{r['p99_ms']:>9}{r['errors']:>8}{r['mem_per_session_mb']:>9}")
+        print(" " * 8 + "  ".join(f"{k} p95 {v}ms" for k, v in r["steps_p95_ms"].items()))
+
+    sat = saturation(results, args.slo_ms, args.min_gain)
+    if sat:
+        print(f"Saturated at {sat['sessions']} concurrent sessions ({sat['reason']}); "
+              f"last level that scaled: {sat['knee'] or 'none'}.")
+    else:
+        print(f"No saturation up to {results[-1]['sessions']} sessions; try higher --concurrency.")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "seeded": counts, "levels": results, "saturation": sat}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
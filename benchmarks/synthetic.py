@@ -0,0 +1,169 @@
+# benchmarks/synthetic.py
+"""
+Synthetic users for load tests and capacity planning.
+
+Each user gets a personality (baseline mood, volatility, how often they check
+in, how long they've used the app) and a history drawn from it: an AR(1) daily
+mood walk, 1-3 entries on active days, notes on about half of them, plus
+letters (past and future), memories and a weekly schedule. Writes go through
+batches of 500 into any storage backend (sqlite by default).
+
+    python -m benchmarks.synthetic --users 500 --db .cache/synthetic.sqlite3
+"""
+import os, sys, math, random, argparse, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BATCH_SIZE = 500
+
+WHO = ["my best friend", "my sister", "mom", "my team", "the dance group", "grandma", "my classmates"]
+TASKS = ["maths homework", "the science project", "exams", "practice", "my essay", "the presentation"]
+NOTES = {
+    "up": ["had a great time with {who}", "finished {task} early, really proud", "so grateful for {who}",
+           "laughed a lot with {who} today", "calm and relaxed after practice", "good day, {task} went well"],
+    "mid": ["{task} today", "normal day at school", "a bit tired but okay", "spent the evening on {task}",
+            "quiet day at home", "okay day, nothing special"],
+    "down": ["really stressed about {task}", "felt lonely after school", "argued with {who}, still upset",
+             "couldn't sleep, exhausted", "worried about {task}", "not a good day, cried a bit"],
+}
+LETTERS = ["Dear future me, I hope {task} went okay. Remember to breathe.",
+           "Hey you! Be proud of how far you've come with {task}.",
+           "Future me: call {who} more often. They care about you."]
+MEMORIES = [("Dance class", "Bharatanatyam on Mon/Wed/Fri evenings", ["dance"]),
+            ("Exams", "Finals start in the last week of the month", ["school"]),
+            ("Family", "Lives with mom and a younger sister", ["family"]),
+            ("Best friend", "Talks to her best friend every evening", ["friends"]),
+            ("Sleep", "Tries to sleep by 11 pm", ["health"]),
+            ("Project", "Working on a robotics project", ["school", "project"])]
+ACTIVITIES = ["Dance class", "Football", "Tuition", "Piano", "Study group", "Swimming", "Art club"]
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def _poisson(rng: random.Random, lam: float) -> int:
+    limit, k, p = math.exp(-lam), 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= limit:
+            return k
+        k += 1
+
+
+def _fill(rng, text):
+    return text.format(who=rng.choice(WHO), task=rng.choice(TASKS))
+
+
+def _mood_for(rng: random.Random, x: float, by_score: dict) -> str:
+    if rng.random() < 0.04:
+        return rng.choice(["⭐ Good Deed", "🙏 Gratitude"])
+    if x >= 4.5:
+        s = 5
+    elif x >= 3.5:
+        s = 4
+    elif x >= 2.5:
+        s = rng.choice([4, 2])
+    elif x >= 1.5:
+        s = 2
+    else:
+        s = 1
+    return rng.choice(by_score[s])
+
+
+def user_docs(user_id: str, rng: random.Random, today: datetime.date):
+    """Yield (collection, document) for one synthetic user."""
+    from utils import moods, sentiment
+
+    by_score = {}
+    for label, s in moods.MOODS:
+        if label not in moods.GOOD_DEEDS:
+            by_score.setdefault(s, []).append(label)
+
+    baseline = min(4.8, max(1.5, rng.gauss(3.4, 0.7)))
+    volatility = rng.uniform(0.3, 1.2)
+    engagement = rng.betavariate(2, 3)  # share of days with a check-in
+    history = rng.choices([7, 30, 90, 180], weights=[2, 4, 3, 1])[0]
+
+    x = baseline
+    for back in range(history, -1, -1):
+        x = baseline + 0.6 * (x - baseline) + rng.gauss(0, volatility)
+        if rng.random() > engagement:
+            continue
+        day = (today - datetime.timedelta(days=back)).isoformat()
+        for _ in range(1 + _poisson(rng, 0.4)):
+            label = _mood_for(rng, x, by_score)
+            note = ""
+            if rng.random() < 0.55:
+                tone = "up" if moods.score(label) >= 4 else "down" if moods.score(label) <= 2 else "mid"
+                note = _fill(rng, rng.choice(NOTES[tone if rng.random() < 0.8 else "mid"]))
+            yield "moods", {"user_id": user_id, "mood": label, "note": note, "reflection": "",
+                            "reflection_status": "done", "date": day, **sentiment.fields(note)}
+
+    for _ in range(_poisson(rng, 1.2)):
+        deliver_on = today + datetime.timedelta(days=rng.randint(-60, 90))
+        delivered = deliver_on <= today and rng.random() < 0.6
+        yield "letters", {"user_id": user_id, "content": _fill(rng, rng.choice(LETTERS)),
+                          "deliver_on": deliver_on.isoformat(), "delivered": delivered, "notified": delivered}
+
+    for key, value, tags in rng.sample(MEMORIES, min(len(MEMORIES), _poisson(rng, 3))):
+        yield "memories", {"user_id": user_id, "key": key, "value": value, "tags": tags,
+                           "importance": rng.randint(1, 5), "expires_on": None,
+                           "created_date": (today - datetime.timedelta(days=rng.randint(0, history))).isoformat()}
+
+    for _ in range(_poisson(rng, 2.5)):
+        start = rng.choices(range(7, 21), weights=[3, 2, 1, 1, 1, 1, 1, 1, 2, 3, 4, 4, 3, 2])[0] * 60
+        start += rng.choice([0, 30])
+        end = start + rng.choice([30, 45, 60, 90, 120])
+        yield "schedules", {"user_id": user_id, "title": rng.choice(ACTIVITIES),
+                            "days": sorted(rng.sample(DAYS, rng.randint(1, 3)), key=DAYS.index),
+                            "start_time": f"{start // 60:02d}:{start % 60:02d}",
+                            "end_time": f"{end // 60:02d}:{end % 60:02d}",
+                            "location": "", "notes": "", "priority": rng.randint(1, 5),
+                            "travel_mins": rng.choice([0, 0, 10, 15, 30])}
+
+
+def user_ids(n: int) -> list[str]:
+    return [f"synth-{i:05d}" for i in range(n)]
+
+
+def generate(client, n_users: int, seed: int = 7, today: datetime.date | None = None) -> dict:
+    """Write n_users synthetic users; returns documents written per collection."""
+    today = today or datetime.date.today()
+    rng = random.Random(seed)
+    counts = {}
+    batch, pending = client.batch(), 0
+    for uid in user_ids(n_users):
+        for collection, doc in user_docs(uid, rng, today):
+            batch.set(client.collection(collection).document(), doc)
+            counts[collection] = counts.get(collection, 0) + 1
+            pending += 1
+            if pending >= BATCH_SIZE:
+                batch.commit()
+                batch, pending = client.batch(), 0
+    if pending:
+        batch.commit()
+    return counts
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Populate a local backend with synthetic users")
+    p.add_argument("--users", type=int, default=200)
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--db", default=os.path.join(".cache", "synthetic.sqlite3"), help="sqlite file")
+    p.add_argument("--buckets", action="store_true", help="also build monthly mood buckets")
+    args = p.parse_args(argv)
+
+    os.environ["SERENITY_STORAGE"] = "sqlite"
+    os.environ["SERENITY_SQLITE_PATH"] = args.db
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    from utils import storage, buckets
+
+    client = storage.client("sqlite")
+    counts = generate(client, args.users, args.seed)
+    if args.buckets:
+        counts["mood_buckets"] = buckets.backfill(client)
+    print(f"{args.users} users -> " + ", ".join(f"{k} {v}" for k, v in sorted(counts.items())))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+# utils/affirmations.py
+"""
+Pre-generated affirmation pools keyed by a coarse mood-pattern signature.
+
+The 7-day mood history behind the "Generate Affirmation" button collapses to
+one of ~100 signatures (last mood x how much of the week was low x trend), so an
+offline job can generate a pool per signature and the button picks from a JSON
+table in memory. Only histories with labels outside utils/moods.py, or a
+signature missing from the table, still go to the LLM.
+
+    python -m utils.affirmations build [--pool 8] [--concurrency 4] [--rpm 30]
+    python -m utils.affirmations build --missing-only      # top up a table
+    python -m utils.affirmations show "😢 Sad" "🙂 Okay"    # signature + pool for a history
+"""
+import os, sys, json, time, random, argparse, datetime, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils import moods, metrics
+
+TABLE_PATH = os.getenv("SERENITY_AFFIRMATION_TABLE",
+                       os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                    "assets", "affirmations.json"))
+POOL_SIZE = 8
+MAX_WORDS = 14
+NO_HISTORY = "none"
+
+MIX = ("up", "mixed", "down")  # share of low (score <= 2) moods: < 1/3, middle, > 2/3
+TREND = ("rising", "steady", "falling")
+
+_table = None
+_table_lock = threading.Lock()
+
+
+# -----------------------------
+# Signatures
+# -----------------------------
+def signature(labels: list[str]) -> str | None:
+    """Coarse key for a chronological mood list; None if it contains unknown labels."""
+    if not labels:
+        return NO_HISTORY
+    if any(l not in moods.MOOD_CODES for l in labels):
+        return None
+    scores = [moods.score(l) for l in labels]
+    low = sum(1 for s in scores if s <= 2) / len(scores)
+    mix = "up" if low < 1 / 3 else "down" if low > 2 / 3 else "mixed"
+    half = len(scores) // 2
+    trend = "steady"
+    if half:
+        delta = sum(scores[half:]) / (len(scores) - half) - sum(scores[:half]) / half
+        trend = "rising" if delta >= 1 else "falling" if delta <= -1 else "steady"
+    return f"{moods.MOOD_CODES[labels[-1]]}|{mix}|{trend}"
+
+
+def all_signatures() -> list[str]:
+    return [NO_HISTORY] + [f"{code}|{mix}|{trend}"
+                           for code in range(len(moods.MOODS)) for mix in MIX for trend in TREND]
+
+
+def describe(sig: str) -> str:
+    if sig == NO_HISTORY:
+        return "no mood check-ins yet this week"
+    code, mix, trend = sig.split("|")
+    week = {"up": "mostly good days", "mixed": "a mix of good and hard days", "down": "mostly hard days"}[mix]
+    return f"latest mood {moods.label(int(code))}, {week} this week, mood {trend}"
+
+
+# -----------------------------
+# Lookup (serving path)
+# -----------------------------
+def load_table(path: str | None = None) -> dict:
+    """{signature: [affirmation, ...]}, loaded once; empty if no table has been built."""
+    global _table
+    if _table is None or path:
+        with _table_lock:
+            try:
+                with open(path or TABLE_PATH, encoding="utf-8") as f:
+                    pools = json.load(f).get("pools") or {}
+            except (OSError, ValueError):
+                pools = {}
+            if path:
+                return pools
+            _table = pools
+    return _table
+
+
+def lookup(labels: list[str]) -> list[str] | None:
+    sig = signature(labels)
+    return load_table().get(sig) if sig is not None else None
+
+
+def affirmation_for(labels: list[str], user_id: str | None = None) -> str:
+    """Pooled affirmation for this history, or a live LLM one for rare patterns."""
+    pool = lookup(labels)
+    if pool:
+        with metrics.track("affirmation", "pool"):
+            return random.choice(pool)
+    from utils.ai import generate_affirmation
+    hint = "based on recent moods: " + ", ".join(labels) if labels else "no prior mood data"
+    return generate_affirmation(hint, user_id=user_id)
+
+
+# -----------------------------
+# Offline build
+# -----------------------------
+def _prompt(sig: str, n: int) -> str:
+    return (f"Write {n} different short daily affirmations for a young person whose check-ins show: "
+            f"{describe(sig)}. Warm, specific, under 12 words each, no emojis, no numbering. "
+            f"Respond only with a JSON array of strings.")
+
+
+def parse_pool(text: str) -> list[str]:
+    """JSON array from the model, falling back to one affirmation per line."""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    try:
+        items = json.loads(text)
+        items = items if isinstance(items, list) else []
+    except ValueError:
+        items = text.splitlines()
+    out = []
+    for item in items:
+        s = str(item).strip().lstrip("-*•0123456789.) ").strip().strip('"').strip()
+        if s and len(s.split()) <= MAX_WORDS and s not in out:
+            out.append(s)
+    return out
+
+
+def build(signatures: list[str], pool_size: int = POOL_SIZE, concurrency: int = 4,
+          rpm: float = 30.0, existing: dict | None = None) -> dict:
+    """Generate pools concurrently, paced to `rpm` requests/minute. Returns {signature: pool}."""
+    from utils import ai, quota
+
+    pools = dict(existing or {})
+    bucket = quota.TokenBucket(rpm, capacity=max(1.0, float(concurrency)))
+    pace = threading.Lock()
+
+    def _one(sig):
+        while True:
+            with pace:
+                if bucket.take():
+                    break
+                wait = bucket.wait_time()
+            time.sleep(wait)
+        return sig, parse_pool(ai.generate_offline(_prompt(sig, pool_size), "affirmation_pool"))
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(_one, sig) for sig in signatures]
+        for fut in as_completed(futures):
+            try:
+                sig, items = fut.result()
+            except Exception as e:
+                print(f"[affirmations] failed: {type(e).__name__}: {e}")
+                continue
+            if items:
+                pools[sig] = items[:pool_size]
+    return pools
+
+
+def save_table(pools: dict, path: str | None = None, **meta):
+    doc = {"version": 1, "generated": datetime.date.today().isoformat(), **meta,
+           "pools": dict(sorted(pools.items()))}
+    path = path or TABLE_PATH
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(doc, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Offline affirmation pools")
+    sub = p.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="generate pools for every signature")
+    b.add_argument("--pool", type=int, default=POOL_SIZE, help="affirmations per signature")
+    b.add_argument("--concurrency", type=int, default=4, help="parallel LLM calls")
+    b.add_argument("--rpm", type=float, default=30.0, help="max LLM requests per minute")
+    b.add_argument("--missing-only", action="store_true", help="keep existing pools, fill the gaps")
+    b.add_argument("--out", default=TABLE_PATH)
+    s = sub.add_parser("show", help="signature and pool for a mood history")
+    s.add_argument("labels", nargs="*")
+    args = p.parse_args(argv)
+
+    if args.command == "show":
+        sig = signature(args.labels)
+        print(sig, "->", describe(sig) if sig else "(rare pattern: live LLM)")
+        for line in (load_table().get(sig) or []) if sig else []:
+            print("  " + line)
+        return 0
+
+    existing = load_table(args.out) if args.missing_only else {}
+    todo = [sig for sig in all_signatures() if sig not in existing]
+    print(f"[affirmations] generating {len(todo)} pool(s)")
+    pools = build(todo, args.pool, args.concurrency, args.rpm, existing)
+    from utils import router
+    save_table(pools, args.out, model=router.STRONG_MODEL, pool_size=args.pool)
+    print(f"[affirmations] wrote {len(pools)}/{len(all_signatures())} pools to {args.out}")
+    return 0 if len(pools) == len(all_signatures()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,25 @@
 
-import os
-import google.generativeai as genai
+import os, json, time, random, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+try:
+    import google.generativeai as genai
+except Exception:
+    genai = None  # only the stub backend works without it
+
+from utils import metrics, quota, router, cache
+from utils.audio import preprocess_audio
+from utils.tts import AFFIRMATION_PHRASES
+
 load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-MODEL = "gemini-2.5-flash"
+if genai is not None:
+    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+MODEL = router.STRONG_MODEL  # default / strong tier; see utils/router.py
+
+# "stub" answers locally after SERENITY_STUB_LLM_MS (benchmarks / load tests)
+LLM_BACKEND = os.getenv("SERENITY_LLM", "gemini").lower()
+STUB_LATENCY_S = float(os.getenv("SERENITY_STUB_LLM_MS", "0")) / 1000.0
 
 _system_persona_base = """You are Serenity, a youth mental wellness companion.
 - Be empathetic, clear, and human. Sound like a caring close friend; warm, a little playful, never clinical.
@@ -15,6 +29,171 @@ _system_persona_base = """You are Serenity, a youth mental wellness companion.
 - If you detect self-harm or harm to others, recommend contacting trusted adults and helplines immediately."""
 
 
+def _stub_text(contents) -> str:
+    prompt = contents if isinstance(contents, str) else " ".join(c for c in contents if isinstance(c, str))
+    if "Classify the following text for crisis risk" in prompt:
+        return json.dumps({"risk": "none", "reason": "stub"})
+    return "You're doing okay. Take one slow breath and be gentle with yourself."
+
+
+_TRANSIENT_ERRORS = ("ServiceUnavailable", "DeadlineExceeded", "InternalServerError")
+MAX_RETRIES = 1
+
+
+def _approx_tokens(contents) -> int:
+    parts = [contents] if isinstance(contents, str) else contents
+    return sum(len(p) // 4 for p in parts if isinstance(p, str))
+
+
+# Request types whose identical concurrent prompts may share one upstream call.
+# Chat replies / crisis checks stay individual.
+SINGLEFLIGHT_TASKS = set(filter(None, os.getenv(
+    "SERENITY_SINGLEFLIGHT", "reflect_mood,generate_affirmation").split(",")))
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_inflight: dict = {}
+_inflight_lock = threading.Lock()
+
+
+def _singleflight(key, fn):
+    """Concurrent callers with the same key wait for the first caller's result."""
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = _Flight()
+    if not leader:
+        with metrics.track("llm_coalesced", key[0]):
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+    ok = False
+    try:
+        flight.result = fn()
+        ok = True
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        if not ok and flight.error is None:  # KeyboardInterrupt / SystemExit / thread teardown
+            flight.error = RuntimeError(f"{key[0]}: shared call was abandoned")
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        flight.done.set()
+
+
+# What each request type degrades to when its quota lane is out of budget
+_DEGRADED = {
+    "generate_affirmation": lambda: random.choice(AFFIRMATION_PHRASES),
+    "reflect_mood": lambda: "Thanks for checking in with yourself today; noticing how you feel is a real step.",
+    "gemini_reply": lambda: "I'm here with you. I'm a little overloaded right now; could you send that again in a minute?",
+    "understand_audio": lambda: "",
+}
+RESULT_TTL_S = float(os.getenv("SERENITY_LLM_RESULT_TTL_S", str(7 * 24 * 3600)))  # last good answer per (task, prompt)
+PRIVATE_TASKS = {"gemini_reply"}  # chat text never goes into the shared result cache
+AUDIO_TTL_S = float(os.getenv("SERENITY_AUDIO_SUMMARY_TTL_S", "3600"))  # per user: voice notes are private
+
+
+def _prompt_key(name: str, contents: str) -> str:
+    return f"{name}:{hashlib.sha256(contents.encode('utf-8')).hexdigest()[:32]}"
+
+
+def _generate(contents, name: str = "generate", user_id: str | None = None, strict: bool = False) -> str:
+    """Every Gemini call goes through here (quota-admitted, timed + token-counted in utils.metrics).
+
+    strict=True raises QuotaExceeded instead of returning the canned degraded text
+    (a cached real answer is still fine)."""
+    if name in SINGLEFLIGHT_TASKS and isinstance(contents, str):
+        return _singleflight((name, contents, strict), lambda: _admitted(contents, name, user_id, strict))
+    return _admitted(contents, name, user_id, strict)
+
+
+def _admitted(contents, name: str, user_id: str | None, strict: bool = False) -> str:
+    key = _prompt_key(name, contents) if isinstance(contents, str) and name not in PRIVATE_TASKS else None
+    try:
+        quota.acquire(name, user_id)
+    except quota.QuotaExceeded:
+        with metrics.track("llm_degraded", name):
+            cached = cache.get("llm_result", key) if key else None
+            if cached is not None:
+                return cached
+            if strict:
+                raise
+            return _DEGRADED.get(name, lambda: "")()
+    text = _generate_once(contents, name)
+    if key is not None and name in _DEGRADED:
+        cache.set("llm_result", key, text, ttl=RESULT_TTL_S)
+    return text
+
+
+def generate_offline(contents, name: str) -> str:
+    """Model call for batch jobs (utils/affirmations.py): skips the interactive quota lanes; callers pace themselves."""
+    return _generate_once(contents, name)
+
+
+def _generate_once(contents, name: str) -> str:
+    """Try the task's model tiers in order; a failing tier falls through to the next one."""
+    routes = router.candidates(name)
+    for i, route in enumerate(routes):
+        try:
+            return _call_model(contents, name, route)
+        except Exception as e:
+            if i == len(routes) - 1:
+                raise
+            metrics.count("llm_fallback", name, ok=False, error=type(e).__name__, model=route["model"])
+
+
+def _call_model(contents, name: str, route: dict) -> str:
+    model = route["model"]
+    timeout = route.get("timeout_s")  # set when a fallback tier follows (utils/router.py)
+    with metrics.track("llm", name, model=model, tier=route["tier"]) as rec:
+        t0 = time.perf_counter()
+        if LLM_BACKEND == "stub":
+            if timeout is not None and STUB_LATENCY_S > timeout:
+                time.sleep(timeout)
+                router.observe(model, (time.perf_counter() - t0) * 1000.0)
+                raise TimeoutError(f"{model} exceeded {timeout:.1f}s")
+            time.sleep(STUB_LATENCY_S)
+            text = _stub_text(contents)
+            rec["prompt_tokens"] = _approx_tokens(contents)
+            rec["response_tokens"] = len(text) // 4
+            router.observe(model, (time.perf_counter() - t0) * 1000.0)
+            return text
+
+        config = {"max_output_tokens": route["max_output_tokens"]} if route["max_output_tokens"] else None
+        options = {"timeout": timeout} if timeout is not None else None
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = genai.GenerativeModel(model, generation_config=config).generate_content(
+                    contents, request_options=options)
+                break
+            except Exception as e:
+                transient = type(e).__name__ in _TRANSIENT_ERRORS
+                if timeout is not None and type(e).__name__ in ("DeadlineExceeded", "TimeoutError"):
+                    # too slow for this tier: record it and let the caller try the next one
+                    router.observe(model, (time.perf_counter() - t0) * 1000.0)
+                    raise
+                if attempt >= MAX_RETRIES or not transient:
+                    raise
+                rec["retries"] = rec.get("retries", 0) + 1
+                time.sleep(0.5 * (attempt + 1))
+        router.observe(model, (time.perf_counter() - t0) * 1000.0)
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            rec["prompt_tokens"] = getattr(usage, "prompt_token_count", 0) or 0
+            rec["response_tokens"] = getattr(usage, "candidates_token_count", 0) or 0
+        return response.text or ""
+
+
 def _style_suffix(style: str) -> str:
     s = (style or "friendly").lower()
     if s == "mentor":
@@ -30,23 +209,22 @@ def _mood_hint_line(mood_hint: str | None) -> str:
     return f"User mood context: {mood_hint}" if mood_hint else ""
 
 
-def gemini_reply(user_text: str, style: str = "friendly", mood_hint: str | None = None) -> str:
+def gemini_reply(user_text: str, style: str = "friendly", mood_hint: str | None = None,
+                 user_id: str | None = None) -> str:
     prompt = f"{_system_persona_base}\n{_style_suffix(style)}\n{_mood_hint_line(mood_hint)}\nUser: {user_text}\nReply in 2-4 short sentences."
-    response = genai.GenerativeModel(MODEL).generate_content(prompt)
-    return (response.text or "").strip()
+    return _generate(prompt, "gemini_reply", user_id).strip()
 
 
-def reflect_mood(one_line_context: str) -> str:
+def reflect_mood(one_line_context: str, user_id: str | None = None, strict: bool = False) -> str:
+    """strict=True: raise quota.QuotaExceeded rather than return the generic degraded sentence."""
     prompt = f"Summarize the user's mood in one supportive sentence. Input: {one_line_context}"
-    response = genai.GenerativeModel(MODEL).generate_content(prompt)
-    return (response.text or "").strip()
+    return _generate(prompt, "reflect_mood", user_id, strict=strict).strip()
 
-def generate_affirmation(history_hint: str) -> str:
+def generate_affirmation(history_hint: str, user_id: str | None = None) -> str:
     prompt = f"Create a short, specific daily affirmation for a youth based on: {history_hint}. Keep it under 12 words."
-    response = genai.GenerativeModel(MODEL).generate_content(prompt)
-    return (response.text or "").strip().strip('"')
+    return _generate(prompt, "generate_affirmation", user_id).strip().strip('"')
 
-def classify_crisis(user_text: str) -> dict:
+def classify_crisis(user_text: str, user_id: str | None = None) -> dict:
     """
     Returns dict: {"risk": "none"|"medium"|"high", "reason": "..."}
     """
@@ -57,21 +235,48 @@ If user mentions self-harm/suicidal ideation -> high.
 If severe hopelessness -> medium.
 Otherwise none.
 """
-    response = genai.GenerativeModel(MODEL).generate_content(prompt)
-    import json
+    text = _generate(prompt, "classify_crisis", user_id)
     try:
-        j = json.loads(response.text)
+        j = json.loads(text)
         if j.get("risk") not in ["none","medium","high"]:
             j["risk"] = "none"
         return j
     except Exception:
         return {"risk":"none","reason":"Parser fallback"}
 
-def transcribe_or_understand_audio(file_bytes: bytes, mime_type: str = "audio/wav") -> str:
+def _understand_processed(clip, user_id: str | None = None) -> str:
+    ns = cache.user_ns(user_id, "audio_summary") if user_id else None  # never shared across users
+    cached = cache.get(ns, clip.digest) if ns else None
+    if cached is not None:
+        return cached
+    part = {"mime_type": clip.mime_type, "data": clip.data}
+    summary = _generate(["Summarize the core message and emotion in one sentence:", part],
+                        "understand_audio", user_id).strip()
+    if not summary or ns is None:
+        return summary  # degraded / empty / anonymous: don't cache
+    cache.set(ns, clip.digest, summary, ttl=AUDIO_TTL_S)
+    return summary
+
+
+def transcribe_or_understand_audio(file_bytes: bytes, mime_type: str = "audio/wav",
+                                   user_id: str | None = None) -> str:
     """
     Sends audio to Gemini for understanding. Returns a short summary of what the user said/felt.
+    Audio is trimmed/downmixed/re-encoded locally first; the same user re-sending a clip is served from cache.
+    """
+    return _understand_processed(preprocess_audio(file_bytes, mime_type), user_id)
+
+
+def understand_audio_clips(clips: list[tuple[bytes, str]], max_workers: int = 4,
+                           user_id: str | None = None) -> list[str]:
+    """
+    Preprocess and understand several (bytes, mime_type) clips concurrently.
+    Identical clips (same processed hash) share one Gemini call. Returns summaries in input order.
     """
-    model = genai.GenerativeModel(MODEL)
-    part = {"mime_type": mime_type, "data": file_bytes}
-    resp = model.generate_content(["Summarize the core message and emotion in one sentence:", part])
-    return (resp.text or "").strip()
+    if not clips:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        processed = list(pool.map(lambda c: preprocess_audio(c[0], c[1]), clips))
+        unique = {p.digest: p for p in processed}
+        summaries = dict(zip(unique, pool.map(lambda c: _understand_processed(c, user_id), unique.values())))
+    return [summaries[p.digest] for p in processed]
@@ -0,0 +1,154 @@
+# utils/audio.py
+import io, os, wave, hashlib
+from dataclasses import dataclass
+import numpy as np
+
+# optional encoder/decoder (libsndfile); falls back to 16 kHz mono PCM WAV
+try:
+    import soundfile as sf
+except Exception:
+    sf = None
+
+TARGET_RATE = 16000
+MAX_CLIP_SECONDS = float(os.getenv("SERENITY_MAX_CLIP_SECONDS", "60"))
+SILENCE_THRESHOLD = 0.01      # ~ -40 dBFS
+SILENCE_FRAME_MS = 20
+SILENCE_PAD_MS = 200
+
+
+@dataclass
+class ProcessedAudio:
+    data: bytes
+    mime_type: str
+    digest: str
+    seconds: float | None = None
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# -----------------------------
+# Decode
+# -----------------------------
+def _decode_wav(file_bytes: bytes):
+    """Decode PCM WAV to float32 samples shaped (frames, channels)."""
+    with wave.open(io.BytesIO(file_bytes), "rb") as w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        raw = w.readframes(w.getnframes())
+
+    if width == 1:
+        pcm = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        pcm = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        pcm = ints.astype(np.float32) / 8388608.0
+    elif width == 4:
+        pcm = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {width}")
+
+    return pcm.reshape(-1, channels), rate
+
+
+def _decode(file_bytes: bytes, mime_type: str):
+    """Returns (samples, rate) or None when the format can't be decoded locally."""
+    if mime_type in ("audio/wav", "audio/x-wav", "audio/wave"):
+        try:
+            return _decode_wav(file_bytes)
+        except (wave.Error, ValueError, EOFError):
+            pass  # e.g. float WAV; let libsndfile try
+    if sf is not None:
+        try:
+            data, rate = sf.read(io.BytesIO(file_bytes), dtype="float32", always_2d=True)
+            return data, rate
+        except Exception:
+            return None
+    return None
+
+
+# -----------------------------
+# DSP steps
+# -----------------------------
+def _to_mono(samples: np.ndarray) -> np.ndarray:
+    return samples.mean(axis=1) if samples.ndim == 2 else samples
+
+
+def _resample(mono: np.ndarray, rate: int, target: int = TARGET_RATE) -> np.ndarray:
+    if rate == target or len(mono) == 0:
+        return mono
+    if rate > target:
+        # cheap box low-pass before decimating so speech doesn't alias
+        width = int(round(rate / target))
+        if width > 1:
+            mono = np.convolve(mono, np.ones(width, dtype=np.float32) / width, mode="same")
+    n_out = int(round(len(mono) * target / rate))
+    x_old = np.arange(len(mono), dtype=np.float64) / rate
+    x_new = np.arange(n_out, dtype=np.float64) / target
+    return np.interp(x_new, x_old, mono).astype(np.float32)
+
+
+def _trim_silence(mono: np.ndarray, rate: int) -> np.ndarray:
+    frame = max(1, int(rate * SILENCE_FRAME_MS / 1000))
+    n_frames = len(mono) // frame
+    if n_frames == 0:
+        return mono
+    rms = np.sqrt((mono[: n_frames * frame].reshape(n_frames, frame) ** 2).mean(axis=1))
+    voiced = np.flatnonzero(rms > SILENCE_THRESHOLD)
+    if len(voiced) == 0:
+        return mono  # all quiet: keep as-is rather than sending nothing
+    pad = int(rate * SILENCE_PAD_MS / 1000)
+    start = max(0, voiced[0] * frame - pad)
+    end = min(len(mono), (voiced[-1] + 1) * frame + pad)
+    return mono[start:end]
+
+
+def _encode(mono: np.ndarray, rate: int):
+    """Encode to OGG/Vorbis when libsndfile is available, else PCM16 WAV."""
+    if sf is not None:
+        try:
+            buf = io.BytesIO()
+            sf.write(buf, mono, rate, format="OGG", subtype="VORBIS")
+            return buf.getvalue(), "audio/ogg"
+        except Exception:
+            pass
+    pcm = (np.clip(mono, -1.0, 1.0) * 32767.0).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue(), "audio/wav"
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def preprocess_audio(file_bytes: bytes, mime_type: str = "audio/wav",
+                     max_seconds: float = MAX_CLIP_SECONDS) -> ProcessedAudio:
+    """
+    Trim silence, downmix to mono, resample to 16 kHz, cap length and re-encode.
+    Formats we can't decode locally (e.g. m4a without libsndfile) pass through unchanged, as do
+    clips that needed no trimming/capping and wouldn't shrink. `digest` always describes what is sent.
+    """
+    decoded = _decode(file_bytes, mime_type)
+    if decoded is None:
+        return ProcessedAudio(file_bytes, mime_type, _digest(file_bytes))
+
+    samples, rate = decoded
+    mono = _resample(_to_mono(samples), rate)
+    full = len(mono)
+    mono = _trim_silence(mono, TARGET_RATE)
+    mono = mono[: int(max_seconds * TARGET_RATE)]
+
+    data, mime = _encode(mono, TARGET_RATE)
+    if len(mono) == full and len(data) >= len(file_bytes):
+        # nothing trimmed or capped and already compact (e.g. short mp3): send the upload itself
+        return ProcessedAudio(file_bytes, mime_type, _digest(file_bytes), len(samples) / rate)
+    # hash the samples that were encoded, not the container: Ogg streams get a random serial per encode
+    digest = _digest(np.ascontiguousarray(mono, dtype="<f4").tobytes())
+    return ProcessedAudio(data, mime, digest, len(mono) / TARGET_RATE)
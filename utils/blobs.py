@@ -0,0 +1,231 @@
+# utils/blobs.py
+"""
+Session blob store: large per-session payloads (recordings, background music,
+rendered doodles) live in content-addressed files under SERENITY_BLOB_DIR and
+st.session_state keeps only a SessionBlobs handle table.
+
+- identical payloads (e.g. assets/breath.mp3 in every session) share one file
+- a process-wide LRU keeps hot blobs in memory up to SERENITY_BLOB_MEM_MB
+- each session may reference at most SERENITY_SESSION_BLOB_MB; its least
+  recently used blobs are dropped beyond that
+- the whole store is capped at SERENITY_BLOB_DISK_MB; the oldest sessions' blobs
+  go first
+- files are released when the session's SessionBlobs object is collected
+  (Streamlit drops session_state on disconnect), via weakref.finalize
+
+Locking: each SessionBlobs has its own lock (another session's put() may evict
+it for the disk budget); a session lock may take the module lock, never the
+other way round.
+"""
+import os, uuid, hashlib, threading, weakref
+from collections import OrderedDict
+
+from utils import metrics
+
+BLOB_DIR = os.getenv("SERENITY_BLOB_DIR", os.path.join(".cache", "blobs"))
+MEM_BUDGET = int(float(os.getenv("SERENITY_BLOB_MEM_MB", "64")) * 1024 * 1024)
+SESSION_BUDGET = int(float(os.getenv("SERENITY_SESSION_BLOB_MB", "32")) * 1024 * 1024)
+DISK_BUDGET = int(float(os.getenv("SERENITY_BLOB_DISK_MB", "2048")) * 1024 * 1024)
+
+_lock = threading.RLock()
+_refs: dict = {}           # digest -> number of session handles pointing at it
+_sizes: dict = {}          # digest -> bytes
+_hot = OrderedDict()       # digest -> bytes (in-memory LRU)
+_hot_bytes = 0
+_sessions = OrderedDict()  # session id -> SessionBlobs table (weak), oldest first
+
+
+def _path(digest: str) -> str:
+    return os.path.join(BLOB_DIR, digest[:2], digest)
+
+
+def _gauges():
+    metrics.set_gauge("session_blob_bytes", float(sum(_sizes.values())))
+    metrics.set_gauge("session_blob_mem_bytes", float(_hot_bytes))
+    metrics.set_gauge("session_blob_sessions", float(len(_sessions)))
+
+
+def _remember(digest: str, data: bytes):
+    global _hot_bytes
+    if len(data) > MEM_BUDGET:
+        return
+    if digest in _hot:
+        _hot.move_to_end(digest)
+        return
+    _hot[digest] = data
+    _hot_bytes += len(data)
+    while _hot_bytes > MEM_BUDGET and _hot:
+        _, old = _hot.popitem(last=False)
+        _hot_bytes -= len(old)
+
+
+def _retain(data: bytes, digest: str | None = None) -> str:
+    digest = digest or hashlib.sha256(data).hexdigest()
+    with _lock:
+        if digest not in _refs:
+            path = _path(digest)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            _refs[digest] = 0
+            _sizes[digest] = len(data)
+        _refs[digest] += 1
+        _remember(digest, data)
+    return digest
+
+
+def _release(digest: str):
+    global _hot_bytes
+    with _lock:
+        n = _refs.get(digest, 0) - 1
+        if n > 0:
+            _refs[digest] = n
+            return
+        _refs.pop(digest, None)
+        _sizes.pop(digest, None)
+        data = _hot.pop(digest, None)
+        if data is not None:
+            _hot_bytes -= len(data)
+        try:
+            os.remove(_path(digest))
+        except OSError:
+            pass
+
+
+def _load(digest: str) -> bytes | None:
+    with _lock:
+        data = _hot.get(digest)
+        if data is not None:
+            _hot.move_to_end(digest)
+            return data
+    try:
+        with open(_path(digest), "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    with _lock:
+        if digest in _refs:
+            _remember(digest, data)
+    return data
+
+
+def _release_all(session_id: str, handles: dict, lock):
+    """weakref.finalize callback: must not reference the SessionBlobs object."""
+    with lock:
+        for digest, _, _ in list(handles.values()):
+            _release(digest)
+        handles.clear()
+    with _lock:
+        _sessions.pop(session_id, None)
+        _gauges()
+
+
+def _enforce_disk_budget(keep: str):
+    """Clear the least recently active sessions (never `keep`) until under DISK_BUDGET.
+
+    Called without any lock held: clear() takes the victim's own lock first."""
+    with _lock:
+        if sum(_sizes.values()) <= DISK_BUDGET:
+            return
+        victims = [(sid, ref) for sid, ref in _sessions.items() if sid != keep]
+    for sid, ref in victims:
+        owner = ref()
+        if owner is not None:
+            owner.clear()
+        with _lock:
+            if sum(_sizes.values()) <= DISK_BUDGET:
+                return
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+class SessionBlobs:
+    """Per-session handle table; keep one in st.session_state."""
+
+    def __init__(self, budget: int | None = None):
+        self.id = uuid.uuid4().hex
+        self.budget = SESSION_BUDGET if budget is None else budget
+        self._handles = OrderedDict()  # name -> (digest, size, mime), LRU order
+        self._lock = threading.RLock()
+        self._finalizer = weakref.finalize(self, _release_all, self.id, self._handles, self._lock)
+        with _lock:
+            _sessions[self.id] = weakref.ref(self)
+            _gauges()
+
+    @property
+    def bytes_used(self) -> int:
+        with self._lock:
+            return sum(size for _, size, _ in self._handles.values())
+
+    def put(self, name: str, data: bytes | None, mime: str | None = None):
+        """Store/replace a named payload. None or b"" removes it."""
+        if not data:
+            self.drop(name)
+            return
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            entry = self._handles.get(name)
+            if entry is not None and entry[0] == digest:  # same payload: don't release + rewrite the file
+                self._handles[name] = (digest, entry[1], mime)
+                self._handles.move_to_end(name)
+            else:
+                self.drop(name)
+                self._handles[name] = (_retain(data, digest), len(data), mime)
+                while self.bytes_used > self.budget and len(self._handles) > 1:
+                    self.drop(next(iter(self._handles)))
+        with _lock:
+            if self.id in _sessions:
+                _sessions.move_to_end(self.id)
+        _enforce_disk_budget(keep=self.id)
+        with _lock:
+            _gauges()
+
+    def get(self, name: str) -> bytes | None:
+        with self._lock:
+            entry = self._handles.get(name)
+            if entry is None:
+                return None
+            self._handles.move_to_end(name)
+        data = _load(entry[0])
+        if data is None:  # file vanished (disk cleanup); forget the handle
+            with self._lock:
+                if self._handles.get(name) == entry:
+                    self._handles.pop(name, None)
+        return data
+
+    def mime(self, name: str) -> str | None:
+        with self._lock:
+            entry = self._handles.get(name)
+        return entry[2] if entry else None
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._handles
+
+    def drop(self, name: str):
+        with self._lock:
+            entry = self._handles.pop(name, None)
+            if entry is not None:
+                _release(entry[0])
+        if entry is not None:
+            with _lock:
+                _gauges()
+
+    def clear(self):
+        with self._lock:
+            for name in list(self._handles):
+                self.drop(name)
+
+    def close(self):
+        """Release everything now (also runs automatically when collected)."""
+        self._finalizer()
+
+
+def stats() -> dict:
+    with _lock:
+        return {"sessions": len(_sessions), "blobs": len(_refs), "disk_bytes": sum(_sizes.values()),
+                "mem_bytes": _hot_bytes, "mem_budget": MEM_BUDGET}
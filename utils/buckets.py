@@ -0,0 +1,258 @@
+# utils/buckets.py
+"""
+Monthly mood buckets (SERENITY_MOOD_BUCKETS=1).
+
+Besides its own document in `moods`, every mood is merged into
+mood_buckets/{user_id}_{YYYY-MM} as entries.{mood doc id} =
+{d, m, s, t, h, hr, rs, ts}: date, mood code from utils/moods.py, score, note
+sentiment, has-note / has-reflection flags, reflection status, timestamp. A
+30-day range then costs 1-2 document reads instead of one per mood.
+
+Entries carry no free text (a few dozen bytes each), so buckets stay far from
+Firestore's 1 MiB limit. The entry key is the mood doc id: where a note or
+reflection is actually shown, hydrate() fetches just those docs in one get_all.
+A month with more than MAX_ENTRIES moods still spills into shards
+{user_id}_{YYYY-MM}_1, _2, ...; the base doc records how many in `shards`, and
+every mood doc records its bucket id.
+
+    python -m utils.buckets backfill [--user UID]   # build buckets from `moods`
+    python -m utils.buckets check [--user UID]      # diff buckets against `moods`
+"""
+import os, sys, argparse, datetime
+from collections import defaultdict
+
+from utils import moods, cache, metrics
+from utils.storage import FieldFilter
+
+ENABLED = os.getenv("SERENITY_MOOD_BUCKETS", "0") == "1"
+COLLECTION = "mood_buckets"
+# entries are ~100 bytes; the cap only guards against a runaway writer
+MAX_ENTRIES = int(os.getenv("SERENITY_BUCKET_MAX_ENTRIES", "2000"))
+BATCH_SIZE = 500
+
+
+def bucket_id(user_id: str, date_iso: str) -> str:
+    """Base bucket of the month (shard 0)."""
+    return f"{user_id}_{date_iso[:7]}"
+
+
+def shard_id(user_id: str, month: str, k: int = 0) -> str:
+    return f"{user_id}_{month}" if k == 0 else f"{user_id}_{month}_{k}"
+
+
+def months_between(since: datetime.date, until: datetime.date) -> list[str]:
+    out, y, m = [], since.year, since.month
+    while (y, m) <= (until.year, until.month):
+        out.append(f"{y:04d}-{m:02d}")
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return out
+
+
+def entry(mood: dict) -> dict:
+    label = mood.get("mood", "")
+    e = {"d": mood.get("date", ""), "s": moods.score(label)}
+    if (mood.get("note") or "").strip():
+        e["h"] = 1  # text only in the mood doc
+    if mood.get("sentiment") is not None:
+        e["t"] = mood["sentiment"]
+    e.update(reflection_fields(mood.get("reflection") or "", mood.get("reflection_status")))
+    ts = mood.get("ts")
+    if isinstance(ts, datetime.datetime):
+        e["ts"] = ts.isoformat()
+    code = moods.MOOD_CODES.get(label)
+    if code is None:
+        e["l"] = label  # label outside the fixed set: keep it verbatim
+    else:
+        e["m"] = code
+    return e
+
+
+def reflection_fields(reflection: str, status: str | None) -> dict:
+    """Entry fields for a reflection (also used to patch an existing entry)."""
+    e = {"hr": 1 if reflection else 0}
+    if status:
+        e["rs"] = status
+    return e
+
+
+def bucket_doc(user_id: str, month: str, entries: dict | None, shards: int | None = None) -> dict:
+    """entries=None leaves them out (merge-safe: an empty map would replace the existing one)."""
+    doc = {"user_id": user_id, "month": month}
+    if entries is not None:
+        doc["entries"] = entries
+    if shards:
+        doc["shards"] = shards
+    return doc
+
+
+def _shard_state(db, user_id: str, month: str) -> dict:
+    """{"k": open shard, "count": entries in it}; cached, 1-2 reads on a miss."""
+    ns = cache.user_ns(user_id, "bucket")
+    state = cache.get(ns, month)
+    if state is None:
+        base = db.collection(COLLECTION).document(shard_id(user_id, month)).get()
+        metrics.add(docs_read=1)
+        doc = base.to_dict() if base.exists else {}
+        k = int(doc.get("shards") or 0)
+        if k:
+            snap = db.collection(COLLECTION).document(shard_id(user_id, month, k)).get()
+            metrics.add(docs_read=1)
+            doc = snap.to_dict() if snap.exists else {}
+        state = {"k": k, "count": len(doc.get("entries") or {})}
+    return state
+
+
+def place(db, user_id: str, month: str, n: int = 1) -> tuple[list[str], int | None]:
+    """Bucket doc ids for n new entries of this month, filling the open shard up to MAX_ENTRIES.
+
+    Returns (ids, shards): shards is the new shard count when one was opened (merge it into
+    the base doc), else None. Counts are per process, so concurrent writers on other
+    replicas can overfill a shard a little; MAX_ENTRIES leaves headroom for that.
+    """
+    state = _shard_state(db, user_id, month)
+    opened, ids = None, []
+    for _ in range(n):
+        if state["count"] >= MAX_ENTRIES:
+            state = {"k": state["k"] + 1, "count": 0}
+            opened = state["k"]
+        ids.append(shard_id(user_id, month, state["k"]))
+        state["count"] += 1
+    cache.set(cache.user_ns(user_id, "bucket"), month, state, ttl=24 * 3600)
+    return ids, opened
+
+
+def read_month(db, user_id: str, month: str) -> dict:
+    """All entries of a month (base doc + shards) as {mood doc id: entry}."""
+    snap = db.collection(COLLECTION).document(shard_id(user_id, month)).get()
+    metrics.add(docs_read=1)
+    if not snap.exists:
+        return {}
+    base = snap.to_dict() or {}
+    entries = dict(base.get("entries") or {})
+    for k in range(1, int(base.get("shards") or 0) + 1):
+        s = db.collection(COLLECTION).document(shard_id(user_id, month, k)).get()
+        metrics.add(docs_read=1)
+        if s.exists:
+            entries.update((s.to_dict() or {}).get("entries") or {})
+    return entries
+
+
+def rows(user_id: str, doc: dict | None) -> list[dict]:
+    """Expand a bucket document (or read_month() entries under "entries") into mood-shaped rows.
+
+    note / reflection are "" here; rows whose mood doc has text carry "_partial": True
+    (see hydrate()). Entries written before the flags existed are treated as partial."""
+    out = []
+    for doc_id, e in ((doc or {}).get("entries") or {}).items():
+        r = {"id": doc_id, "user_id": user_id, "mood": moods.label(e.get("m")) or e.get("l", ""),
+             "note": "", "date": e.get("d", ""), "score": e.get("s"),
+             "sentiment": e.get("t"), "reflection": "",
+             "reflection_status": e.get("rs", "done")}
+        if e.get("ts"):
+            r["ts"] = datetime.datetime.fromisoformat(e["ts"])
+        if e.get("h") or e.get("hr") or "hr" not in e:
+            r["_partial"] = True
+        out.append(r)
+    return out
+
+
+def hydrate(db, rows_: list[dict]) -> list[dict]:
+    """Fill note / reflection of "_partial" rows from their mood docs, in one get_all."""
+    todo = [r for r in rows_ if r.get("_partial")]
+    if not todo:
+        return rows_
+    refs = [db.collection("moods").document(r["id"]) for r in todo]
+    full = {s.id: (s.to_dict() or {}) for s in db.get_all(refs) if s.exists}
+    metrics.add(docs_read=len(refs))
+    out = []
+    for r in rows_:
+        if r.get("_partial"):
+            f = full.get(r["id"], {})
+            r = {k: v for k, v in r.items() if k != "_partial"}
+            # an unflushed write overlaid on the row (utils/writequeue.py) is newer than the doc
+            r.update(note=r.get("note") or f.get("note", ""), reflection=r.get("reflection") or f.get("reflection", ""))
+        out.append(r)
+    return out
+
+
+# -----------------------------
+# Backfill / consistency check
+# -----------------------------
+def _raw_moods(db, user_id=None):
+    q = db.collection("moods")
+    if user_id:
+        q = q.where(filter=FieldFilter("user_id", "==", user_id))
+    grouped = defaultdict(dict)  # (uid, month) -> {doc id: entry}
+    for d in q.stream():
+        m = d.to_dict() or {}
+        uid, date = m.get("user_id"), str(m.get("date") or "")
+        if uid and len(date) >= 7:
+            grouped[(uid, date[:7])][d.id] = entry(m)
+    return grouped
+
+
+def backfill(db, user_id=None) -> int:
+    """Rewrite buckets from the raw collection (idempotent). Returns bucket docs written."""
+    batch, pending, written = db.batch(), 0, 0
+    for (uid, month), entries in _raw_moods(db, user_id).items():
+        ids = sorted(entries, key=lambda i: (entries[i]["d"], i))
+        chunks = [ids[i:i + MAX_ENTRIES] for i in range(0, len(ids), MAX_ENTRIES)]
+        for k, chunk in enumerate(chunks):
+            doc = bucket_doc(uid, month, {i: entries[i] for i in chunk}, shards=len(chunks) - 1 if k == 0 else None)
+            batch.set(db.collection(COLLECTION).document(shard_id(uid, month, k)), doc)
+            pending += 1
+            written += 1
+            if pending >= BATCH_SIZE:
+                batch.commit()
+                batch, pending = db.batch(), 0
+        cache.delete(cache.user_ns(uid, "bucket"), month)
+    if pending:
+        batch.commit()
+    return written
+
+
+def check(db, user_id=None) -> list[str]:
+    """Human-readable differences between `moods` and the buckets."""
+    raw_all = _raw_moods(db, user_id)
+    q = db.collection(COLLECTION)
+    if user_id:
+        q = q.where(filter=FieldFilter("user_id", "==", user_id))
+    buckets = {}
+    for d in q.stream():  # base docs and shards alike carry user_id + month
+        b = d.to_dict() or {}
+        buckets.setdefault((b.get("user_id"), b.get("month")), {}).update(b.get("entries") or {})
+
+    problems = []
+    for uid, month in sorted(raw_all.keys() | buckets.keys(), key=str):
+        raw, have = raw_all.get((uid, month), {}), buckets.get((uid, month), {})
+        for doc_id in sorted(raw.keys() - have.keys()):
+            problems.append(f"{uid} {month}: missing {doc_id}")
+        for doc_id in sorted(have.keys() - raw.keys()):
+            problems.append(f"{uid} {month}: orphan {doc_id}")
+        for doc_id in sorted(raw.keys() & have.keys()):
+            if any(raw[doc_id].get(k) != have[doc_id].get(k) for k in ("d", "m", "l")):
+                problems.append(f"{uid} {month}: differs {doc_id}")
+    return problems
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Monthly mood bucket maintenance")
+    p.add_argument("command", choices=["backfill", "check"])
+    p.add_argument("--user", default=None, help="only this user id")
+    args = p.parse_args(argv)
+
+    from utils.db import _client
+    db = _client()
+    if args.command == "backfill":
+        n = backfill(db, args.user)
+        print(f"Wrote {n} bucket documents")
+        return 0
+    problems = check(db, args.user)
+    for line in problems:
+        print(line)
+    print("OK" if not problems else f"{len(problems)} differences")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+# utils/cache.py
+"""
+Small shared cache / state store so several Streamlit replicas behind a load
+balancer see the same LLM results, quota counters and per-user read caches.
+
+SERENITY_CACHE:
+  memory     in-process dict with TTLs and an LRU bound (default; one replica)
+  redis      SERENITY_REDIS_URL (redis-py, any Redis >= 2.6.12), shared by every replica
+  fakeredis  in-process Redis stand-in (pip install fakeredis) for local tests
+
+Keys are "<prefix>:<namespace>:<key>"; user_ns(uid, name) scopes a namespace to
+one user so clear() can drop just that user's entries. Values are JSON (datetimes
+survive the round trip). Cache errors never propagate: a broken Redis behaves
+like an empty cache.
+"""
+import os, json, time, datetime, threading
+from collections import OrderedDict
+
+from utils import metrics
+
+try:
+    import redis as _redis
+except Exception:
+    _redis = None  # only needed for SERENITY_CACHE=redis
+
+BACKEND = os.getenv("SERENITY_CACHE", "memory").lower()
+REDIS_URL = os.getenv("SERENITY_REDIS_URL", "redis://localhost:6379/0")
+PREFIX = os.getenv("SERENITY_CACHE_PREFIX", "serenity")
+MAX_ITEMS = int(os.getenv("SERENITY_CACHE_MAX_ITEMS", "20000"))  # memory backend only
+SESSION_TTL_S = float(os.getenv("SERENITY_SESSION_TTL_S", str(12 * 3600)))  # per-user UI state
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+# -----------------------------
+# (de)serialization
+# -----------------------------
+def _json_default(o):
+    if isinstance(o, datetime.datetime):
+        return {"__dt__": o.isoformat()}
+    if isinstance(o, datetime.date):
+        return o.isoformat()
+    if isinstance(o, (set, tuple)):
+        return list(o)
+    return str(o)  # e.g. Firestore sentinels / timestamps
+
+
+def _json_hook(d):
+    if len(d) == 1 and "__dt__" in d:
+        return datetime.datetime.fromisoformat(d["__dt__"])
+    return d
+
+
+def dumps(value) -> bytes:
+    return json.dumps(value, default=_json_default, separators=(",", ":")).encode("utf-8")
+
+
+def loads(raw):
+    if raw is None:
+        return None
+    return json.loads(raw, object_hook=_json_hook)
+
+
+# -----------------------------
+# Backends (bytes in, bytes out)
+# -----------------------------
+class MemoryBackend:
+    shared = False
+
+    def __init__(self, max_items: int = MAX_ITEMS):
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (expires_at | None, bytes)
+        self._max = max_items
+
+    def _live(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[0] is not None and item[0] <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key, time.monotonic())
+            return item[1] if item else None
+
+    def set(self, key, raw, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl if ttl else None, raw)
+            self._data.move_to_end(key)
+            while len(self._data) > self._max:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._lock:
+            now = time.monotonic()
+            item = self._live(key, now)
+            value = (int(item[1]) if item else 0) + amount
+            expires = item[0] if item else (now + ttl if ttl else None)
+            self._data[key] = (expires, str(value).encode())
+            return value
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+
+def _ms(ttl):
+    """Redis PX argument: sub-second TTLs would round to an invalid EX 0."""
+    return max(1, int(ttl * 1000)) if ttl else None
+
+
+class RedisBackend:
+    shared = True
+
+    def __init__(self, client):
+        self._r = client
+
+    def get(self, key):
+        return self._r.get(key)
+
+    def set(self, key, raw, ttl=None):
+        self._r.set(key, raw, px=_ms(ttl))
+
+    def delete(self, key):
+        self._r.delete(key)
+
+    def incr(self, key, amount=1, ttl=None):
+        pipe = self._r.pipeline()
+        if ttl:
+            pipe.set(key, 0, px=_ms(ttl), nx=True)  # TTL starts with the window (EXPIRE NX needs Redis 7)
+        pipe.incrby(key, amount)
+        return int(pipe.execute()[-1])
+
+    def delete_prefix(self, prefix):
+        keys = list(self._r.scan_iter(match=prefix + "*", count=500))
+        for i in range(0, len(keys), 500):
+            self._r.delete(*keys[i:i + 500])
+
+
+def _make(name: str):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "redis":
+        if _redis is None:
+            raise RuntimeError("SERENITY_CACHE=redis needs the redis package (pip install redis).")
+        return RedisBackend(_redis.Redis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5))
+    if name == "fakeredis":
+        import fakeredis
+        return RedisBackend(fakeredis.FakeRedis())
+    raise ValueError(f"Unknown cache backend: {name}")
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _make(BACKEND)
+    return _backend
+
+
+def use(b):
+    """Swap the backend (tests / benchmarks): cache.use(cache.MemoryBackend())."""
+    global _backend
+    with _backend_lock:
+        _backend = b
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def _key(ns: str, key) -> str:
+    return f"{PREFIX}:{ns}:{key}"
+
+
+def user_ns(user_id: str, name: str) -> str:
+    return f"u:{user_id}:{name}"
+
+
+def shared() -> bool:
+    """True when entries are visible to other processes (Redis)."""
+    try:
+        return backend().shared
+    except Exception:
+        return False
+
+
+def _guard(op: str, fn, default=None):
+    try:
+        return fn()
+    except Exception as e:
+        metrics.count("cache_error", op, ok=False, error=type(e).__name__)
+        return default
+
+
+def get(ns: str, key, default=None):
+    value = _guard("get", lambda: loads(backend().get(_key(ns, key))))
+    return default if value is None else value
+
+
+def set(ns: str, key, value, ttl: float | None = None):
+    _guard("set", lambda: backend().set(_key(ns, key), dumps(value), ttl))
+
+
+def delete(ns: str, key):
+    _guard("delete", lambda: backend().delete(_key(ns, key)))
+
+
+def incr(ns: str, key, amount: int = 1, ttl: float | None = None) -> int | None:
+    """Atomic counter; ttl applies when the key is created. None if the cache is unavailable."""
+    return _guard("incr", lambda: backend().incr(_key(ns, key), amount, ttl))
+
+
+def clear(ns: str):
+    """Drop every key in a namespace (e.g. one user's read cache)."""
+    _guard("clear", lambda: backend().delete_prefix(_key(ns, "")))
+
+
+def get_or_set(ns: str, key, fn, ttl: float | None = None):
+    value = get(ns, key)
+    if value is None:
+        value = fn()
+        if value is not None:
+            set(ns, key, value, ttl)
+    return value
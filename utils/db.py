@@ -1,8 +1,14 @@
 # utils/db.py
 import os, json, datetime
-import firebase_admin
-from firebase_admin import credentials, firestore
-from google.cloud.firestore_v1 import FieldFilter
+
+try:
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+except Exception:
+    firebase_admin = credentials = firestore = None  # local backends don't need the Admin SDK
+
+from utils import writequeue, storage, metrics, live, buckets, cache, sentiment, trends, moods as mood_vocab
+from utils.storage import FieldFilter, SERVER_TIMESTAMP
 
 try:
     import streamlit as st
@@ -10,6 +16,8 @@ except Exception:
     st = None  # allows local scripts/tests without Streamlit
 
 _app = None
+READ_CACHE_S = float(os.getenv("SERENITY_READ_CACHE_S", "300"))  # shared per-user read cache TTL
+LETTER_FLAG_TTL_S = 300  # the scheduler also drops the entry when it flips has_due
 
 
 def _init():
@@ -17,6 +25,11 @@ def _init():
     global _app
     if _app is not None:
         return
+    if firebase_admin is None:
+        raise RuntimeError(
+            "firebase-admin is not installed. Install requirements.txt, or set "
+            "SERENITY_STORAGE=memory|sqlite|emulator for local runs."
+        )
     if firebase_admin._apps:
         _app = firebase_admin.get_app()
         return
@@ -59,99 +72,322 @@ def _init():
 
 
 def _client():
+    """Firestore client, or a drop-in local/emulator client per SERENITY_STORAGE."""
+    if storage.BACKEND != "firestore":
+        return storage.client()
     _init()
     return firestore.client()
 
 
+def _rows(q) -> list:
+    """Stream a query into dicts (with id), counting documents read."""
+    rows = [{**d.to_dict(), "id": d.id} for d in q.stream()]
+    metrics.add(docs_read=len(rows))
+    return rows
+
+
+def _write(collection: str, data: dict, doc_id: str | None = None, merge: bool = False) -> str:
+    """Create/overwrite a document (write-behind when enabled). Returns the document id."""
+    if writequeue.enabled():
+        writequeue.start(_client, SERVER_TIMESTAMP)
+        return writequeue.enqueue(collection, data, doc_id=doc_id, merge=merge)
+    db = _client()
+    ref = db.collection(collection).document(doc_id) if doc_id else db.collection(collection).document()
+    ref.set(data, merge=merge)
+    metrics.add(docs_written=1)
+    return ref.id
+
+
+def _update(collection: str, doc_id: str, fields: dict, user_id: str | None = None):
+    if writequeue.enabled():
+        writequeue.start(_client, SERVER_TIMESTAMP)
+        writequeue.enqueue(collection, fields, doc_id=doc_id, kind="update", user_id=user_id)
+        return
+    _client().collection(collection).document(doc_id).update(fields)
+    metrics.add(docs_written=1)
+
+
+def _cached(collection: str, user_id: str, keep=None) -> list | None:
+    """Rows from the user's live view (SERENITY_LIVE_VIEWS), or None to query Firestore."""
+    view = live.view(user_id)
+    rows = view.rows(collection) if view is not None else None
+    if rows is None:
+        return None
+    return [r for r in rows if keep(r)] if keep else rows
+
+
+def _user_rows(collection: str, user_id: str) -> list:
+    """Committed rows for one user: live view, then the shared read cache, then a query."""
+    rows = _cached(collection, user_id)
+    if rows is not None:
+        return rows
+    ns = cache.user_ns(user_id, "reads")
+    rows = cache.get(ns, collection)
+    if rows is not None:
+        return rows
+    dirty = writequeue.pending(collection, user_id)  # a flush mid-query would leave the cache stale
+    rows = _rows(_client().collection(collection).where(filter=FieldFilter("user_id", "==", user_id)))
+    if not dirty and not writequeue.pending(collection, user_id):
+        cache.set(ns, collection, rows, ttl=READ_CACHE_S)
+    return rows
+
+
+def _invalidate(collection: str, user_id: str):
+    cache.delete(cache.user_ns(user_id, "reads"), collection)
+
+
 # -----------------------------
 # Public API
 # -----------------------------
-def log_mood(user_id: str, mood: str, note: str, reflection: str):
-    db = _client()
-    return db.collection("moods").add({
+def watch_user(user_id: str, handle=None):
+    """Keep this user's documents hot via snapshot listeners; store the handle in session_state.
+
+    Pass the previous handle back in: a broken or missing view is re-attached with backoff."""
+    return live.renew(user_id, handle, _client)
+
+
+@metrics.timed("firestore")
+def log_mood(user_id: str, mood: str, note: str, reflection: str | None):
+    """reflection=None stores the mood now with reflection_status "pending" (see update_mood_reflection)."""
+    doc = {
         "user_id": user_id,
         "mood": mood,
         "note": note,
-        "reflection": reflection,
+        "reflection": reflection or "",
+        "reflection_status": "pending" if reflection is None else "done",
         "date": datetime.date.today().isoformat(),
-        "ts": firestore.SERVER_TIMESTAMP,
-    })
-
-
-def list_recent_moods(user_id: str, days: int = 14):
+        "ts": SERVER_TIMESTAMP,
+        **sentiment.fields(note),  # local lexicon score, see utils/sentiment.py
+    }
+    doc_id = writequeue.auto_id()  # known up front so the mood doc can name its bucket
+    shards = None
+    if buckets.ENABLED:
+        month = doc["date"][:7]
+        (doc["bucket"],), shards = buckets.place(_client(), user_id, month)
+        cache.set(cache.user_ns(user_id, "bucket_of"), doc_id, doc["bucket"], ttl=24 * 3600)
+    _write("moods", doc, doc_id=doc_id)
+    if buckets.ENABLED:
+        _write(buckets.COLLECTION,
+               buckets.bucket_doc(user_id, month, {doc_id: buckets.entry(doc)}),
+               doc_id=doc["bucket"], merge=True)
+        if shards:
+            _write(buckets.COLLECTION, buckets.bucket_doc(user_id, month, None, shards=shards),
+                   doc_id=buckets.bucket_id(user_id, doc["date"]), merge=True)
+    try:
+        trends.record(user_id, doc["date"], mood_vocab.score(mood))  # O(1) online update, see utils/trends.py
+    except Exception as e:
+        metrics.count("trend_error", "record", ok=False, error=type(e).__name__)  # the mood itself is saved
+    return doc_id
+
+
+def _bucketed_moods(user_id: str, since: datetime.date, until: datetime.date) -> list:
+    """Moods in [since, until] from the monthly bucket docs (one read per month, plus shards).
+
+    Rows come without note / reflection text (flagged "_partial"); see hydrate_moods()."""
     db = _client()
+    out = []
+    for month in buckets.months_between(since, until):
+        out.extend(buckets.rows(user_id, {"entries": buckets.read_month(db, user_id, month)}))
+    lo, hi = since.isoformat(), until.isoformat()
+    return [r for r in out if lo <= r["date"] <= hi]
+
+
+def hydrate_moods(rows: list) -> list:
+    """Fill in note / reflection text on rows served from mood buckets (one get_all); no-op otherwise."""
+    if not any(r.get("_partial") for r in rows):
+        return rows
+    return buckets.hydrate(_client(), rows)
+
+
+def _bucket_of(user_id: str, doc_id: str) -> str | None:
+    """Bucket doc holding a mood's entry: cache, then the unflushed write, then the mood doc."""
+    bid = cache.get(cache.user_ns(user_id, "bucket_of"), doc_id)
+    if bid:
+        return bid
+    p = writequeue.pending("moods", user_id).get(doc_id) if writequeue.enabled() else None
+    mood = p["data"] if p else None
+    if mood is None:
+        snap = _client().collection("moods").document(doc_id).get()
+        metrics.add(docs_read=1)
+        mood = snap.to_dict() if snap.exists else None
+    if not mood or not mood.get("date"):
+        return None
+    return mood.get("bucket") or buckets.bucket_id(user_id, mood["date"])
+
+
+@metrics.timed("firestore")
+def update_mood_reflection(doc_id: str, reflection: str, user_id: str | None = None, status: str = "done"):
+    _update("moods", doc_id, {"reflection": reflection, "reflection_status": status}, user_id=user_id)
+    if buckets.ENABLED and user_id:
+        bid = _bucket_of(user_id, doc_id)
+        if bid:
+            _write(buckets.COLLECTION, {"entries": {doc_id: buckets.reflection_fields(reflection, status)}},
+                   doc_id=bid, merge=True)
+
+
+@metrics.timed("firestore")
+def list_recent_moods(user_id: str, days: int = 14, full_text: bool = False):
+    """Moods of the last `days` days, oldest first.
+
+    With mood buckets, note / reflection are only filled in when full_text=True
+    (pass it where the text is shown)."""
     since = datetime.date.today() - datetime.timedelta(days=days)
-    q = (db.collection("moods")
-           .where(filter=FieldFilter("user_id", "==", user_id))
-           .where(filter=FieldFilter("date", ">=", since.isoformat()))
-           .order_by("date"))
-    return [{**d.to_dict(), "id": d.id} for d in q.stream()]
-
-
-def store_letter(user_id: str, content: str, deliver_on: str):
-    db = _client()
-    return db.collection("letters").add({
+    view = live.view(user_id)
+    rows = None
+    if view is not None and since.isoformat() >= view.mood_since:
+        rows = _cached("moods", user_id, keep=lambda r: r.get("date", "") >= since.isoformat())
+    if rows is None and buckets.ENABLED:
+        rows = _bucketed_moods(user_id, since, datetime.date.today())
+    if rows is not None:
+        rows.sort(key=lambda r: r.get("date", ""))
+    else:
+        db = _client()
+        q = (db.collection("moods")
+               .where(filter=FieldFilter("user_id", "==", user_id))
+               .where(filter=FieldFilter("date", ">=", since.isoformat()))
+               .order_by("date"))
+        rows = _rows(q)
+    if writequeue.enabled():
+        rows = writequeue.overlay("moods", user_id, rows, keep=lambda r: r.get("date", "") >= since.isoformat())
+        rows.sort(key=lambda r: r.get("date", ""))
+    return hydrate_moods(rows) if full_text else rows
+
+
+@metrics.timed("firestore")
+def store_letter(user_id: str, content: str, deliver_on: str, notify_email: str | None = None):
+    """notify_email: where the letter scheduler (utils/letters.py) sends the reminder, if anywhere."""
+    # keep letter_flags current without waiting for a scheduler scan
+    if deliver_on <= _today_iso():
+        set_letters_flag(user_id, True)
+    else:
+        flag = letters_flag(user_id) or {}
+        if not flag.get("next_due") or deliver_on < flag["next_due"]:
+            set_letters_flag(user_id, bool(flag.get("has_due")), next_due=deliver_on)
+    return _write("letters", {
         "user_id": user_id,
         "content": content,
         "deliver_on": deliver_on,
         "delivered": False,
-        "ts": firestore.SERVER_TIMESTAMP,
+        "notified": False,
+        "notify_email": notify_email,
+        "ts": SERVER_TIMESTAMP,
     })
 
 
+@metrics.timed("firestore")
 def due_letters(user_id: str):
-    db = _client()
     today = datetime.date.today().isoformat()
-    q = (db.collection("letters")
-           .where(filter=FieldFilter("user_id", "==", user_id))
-           .where(filter=FieldFilter("delivered", "==", False))
-           .where(filter=FieldFilter("deliver_on", "<=", today)))
-    return [{**d.to_dict(), "id": d.id} for d in q.stream()]
-
-
-def mark_letter_delivered(doc_id: str):
-    db = _client()
-    db.collection("letters").document(doc_id).update({"delivered": True})
+    rows = _cached("letters", user_id, keep=lambda r: r.get("deliver_on", "") <= today)
+    if rows is None:
+        db = _client()
+        q = (db.collection("letters")
+               .where(filter=FieldFilter("user_id", "==", user_id))
+               .where(filter=FieldFilter("delivered", "==", False))
+               .where(filter=FieldFilter("deliver_on", "<=", today)))
+        rows = _rows(q)
+    return writequeue.overlay("letters", user_id, rows,
+                              keep=lambda r: not r.get("delivered") and r.get("deliver_on", "") <= today)
+
+
+@metrics.timed("firestore")
+def mark_letter_delivered(doc_id: str, user_id: str | None = None):
+    _update("letters", doc_id, {"delivered": True, "notified": True}, user_id=user_id)
+
+
+@metrics.timed("firestore")
+def letters_flag(user_id: str):
+    """letter_flags/{user_id} ({"has_due": bool, "next_due": date}), or None if nothing set it yet.
+
+    Cached per user (a missing doc too); set_letters_flag and the scheduler keep the entry current."""
+    ns = cache.user_ns(user_id, "letters")
+    flag = cache.get(ns, "flag")
+    if flag is None:
+        snap = _client().collection("letter_flags").document(user_id).get()
+        metrics.add(docs_read=1)
+        flag = (snap.to_dict() if snap.exists else None) or {}
+        flag.pop("updated", None)
+        cache.set(ns, "flag", flag, ttl=LETTER_FLAG_TTL_S)
+    return flag or None
+
+
+@metrics.timed("firestore")
+def set_letters_flag(user_id: str, has_due: bool, **fields):
+    """fields: other flag fields, e.g. next_due (earliest known future deliver_on, or None)."""
+    doc = {"user_id": user_id, "has_due": has_due, **fields}
+    _write("letter_flags", {**doc, "updated": SERVER_TIMESTAMP}, doc_id=user_id, merge=True)
+    ns = cache.user_ns(user_id, "letters")
+    cache.set(ns, "flag", {**(cache.get(ns, "flag") or {}), **doc}, ttl=LETTER_FLAG_TTL_S)
+
+
+@metrics.timed("firestore")
+def get_trend_state(user_id: str):
+    """trends/{user_id} kept by utils/trends.py, or None before the first mood."""
+    snap = _client().collection(trends.COLLECTION).document(user_id).get()
+    metrics.add(docs_read=1)
+    return snap.to_dict() if snap.exists else None
+
+
+@metrics.timed("firestore")
+def put_trend_state(user_id: str, state: dict, report_day: str | None = None, report_trend: dict | None = None):
+    """Persist the detector state; its summary is also merged into that day's daily report."""
+    _write(trends.COLLECTION, {**state, "updated": SERVER_TIMESTAMP}, doc_id=user_id)
+    if report_day and report_trend is not None:
+        _write("daily_reports", {"user_id": user_id, "date": report_day, "trend": report_trend},
+               doc_id=f"{user_id}_{report_day}", merge=True)
 
 
 def _today_iso():
     return datetime.date.today().isoformat()
 
 
-def update_daily_report(user_id: str):
-    db = _client()
-    today = _today_iso()
-    moods_snap = (db.collection("moods")
-                    .where(filter=FieldFilter("user_id", "==", user_id))
-                    .where(filter=FieldFilter("date", "==", today))
-                 ).stream()
-    moods = [d.to_dict() for d in moods_snap]
-
-    mood_map = {
-        "😊 Happy": 5, "🎉 Excited": 5, "😌 Calm": 5,
-        "🙂 Okay": 4, "😟 Anxious": 2, "😢 Sad": 1,
-        "😠 Angry": 1, "😴 Tired": 2, "🤒 Unwell": 1,
-        "⭐ Good Deed": 5, "🙏 Gratitude": 5,
-    }
-
-    scores = [mood_map.get(m.get("mood", ""), 3) for m in moods]
-    avg = (sum(scores) / len(scores)) if scores else None
-    good_deeds = [m for m in moods if m.get("mood") in ["⭐ Good Deed", "🙏 Gratitude"]]
-
-    doc = {
+def daily_report_doc(user_id: str, day: str, moods: list) -> dict:
+    """daily_reports/{user_id}_{day} body from that day's mood rows."""
+    scores = [mood_vocab.score(m.get("mood")) for m in moods]
+    good_deeds = [m for m in moods if m.get("mood") in mood_vocab.GOOD_DEEDS]
+    sents = [t for t in sentiment.row_sentiments(moods) if t is not None]
+    return {
         "user_id": user_id,
-        "date": today,
+        "date": day,
         "count_entries": len(moods),
-        "avg_score": avg,
+        "avg_score": (sum(scores) / len(scores)) if scores else None,
+        "avg_sentiment": (sum(sents) / len(sents)) if sents else None,
         "good_deeds": len(good_deeds),
         "notes": [m.get("note", "") for m in moods if m.get("note")],
-        "ts": firestore.SERVER_TIMESTAMP,
+        "ts": SERVER_TIMESTAMP,
     }
-    db.collection("daily_reports").document(f"{user_id}_{today}").set(doc, merge=True)
 
 
+@metrics.timed("firestore")
+def update_daily_report(user_id: str, day: str | None = None):
+    """Recompute one day's report (default today) from its moods."""
+    day = day or _today_iso()
+    on_day = datetime.date.fromisoformat(day)
+    view = live.view(user_id)
+    moods = None
+    if view is not None and day >= view.mood_since:
+        moods = _cached("moods", user_id, keep=lambda r: r.get("date") == day)
+    if moods is None and buckets.ENABLED:
+        moods = _bucketed_moods(user_id, on_day, on_day)
+    if moods is None:
+        db = _client()
+        moods = _rows(db.collection("moods")
+                        .where(filter=FieldFilter("user_id", "==", user_id))
+                        .where(filter=FieldFilter("date", "==", day)))
+    moods = writequeue.overlay("moods", user_id, moods, keep=lambda r: r.get("date") == day)
+    # write-behind: lands in the same WriteBatch as the log_mood that triggered it
+    _write("daily_reports", daily_report_doc(user_id, day, moods), doc_id=f"{user_id}_{day}", merge=True)
+
+
+@metrics.timed("firestore")
+def get_insights_snapshot(user_id: str):
+    """insights/{user_id} written by the nightly job (utils/insights.py), or None."""
+    snap = _client().collection("insights").document(user_id).get()
+    metrics.add(docs_read=1)
+    return snap.to_dict() if snap.exists else None
+
+
+@metrics.timed("firestore")
 def add_memory(user_id: str, key: str, value: str, tags=None, importance=3, expires_on=None):
-    db = _client()
     doc = {
         "user_id": user_id,
         "key": key.strip(),
@@ -160,15 +396,16 @@ def add_memory(user_id: str, key: str, value: str, tags=None, importance=3, expi
         "importance": int(importance),
         "created_date": datetime.date.today().isoformat(),
         "expires_on": expires_on,
-        "ts": firestore.SERVER_TIMESTAMP,
+        "ts": SERVER_TIMESTAMP,
     }
-    return db.collection("memories").add(doc)
+    doc_id = _write("memories", doc)
+    _invalidate("memories", user_id)
+    return doc_id
 
 
+@metrics.timed("firestore")
 def list_memories(user_id: str, limit=100):
-    db = _client()
-    q = db.collection("memories").where(filter=FieldFilter("user_id", "==", user_id))
-    rows = [{**d.to_dict(), "id": d.id} for d in q.stream()]
+    rows = writequeue.overlay("memories", user_id, _user_rows("memories", user_id))
 
     def _key(rec):
         cd = rec.get("created_date") or ""
@@ -179,9 +416,9 @@ def list_memories(user_id: str, limit=100):
     return rows[:limit]
 
 
+@metrics.timed("firestore")
 def add_schedule_item(user_id, title, days, start_time, end_time,
                       location="", notes="", priority=3, travel_mins=0):
-    db = _client()
     doc = {
         "user_id": user_id,
         "title": title.strip(),
@@ -192,18 +429,17 @@ def add_schedule_item(user_id, title, days, start_time, end_time,
         "notes": notes.strip(),
         "priority": int(priority),
         "travel_mins": int(travel_mins),
-        "ts": firestore.SERVER_TIMESTAMP,
+        "ts": SERVER_TIMESTAMP,
     }
-    return db.collection("schedules").add(doc)
+    doc_id = _write("schedules", doc)
+    _invalidate("schedules", user_id)
+    return doc_id
 
 
+@metrics.timed("firestore")
 def list_schedule(user_id):
-    db = _client()
-    q = db.collection("schedules").where(filter=FieldFilter("user_id", "==", user_id))
     out = []
-    for d in q.stream():
-        rec = d.to_dict()
-        rec["id"] = d.id
+    for rec in writequeue.overlay("schedules", user_id, _user_rows("schedules", user_id)):
         rec.setdefault("priority", 3)
         rec.setdefault("travel_mins", 0)
         out.append(rec)
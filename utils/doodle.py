@@ -0,0 +1,108 @@
+# utils/doodle.py
+"""
+Server-side rendering for the Doodle & De-Stress canvas.
+
+The canvas syncs its fabric.js scene (json_data: a list of stroke paths)
+instead of being read back as pixels every stroke; the PNG is only drawn from
+those paths here when the user asks for a download or the sparkle effect.
+"""
+import io, json, random, hashlib
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageColor
+
+CURVE_STEPS = 8  # points sampled per quadratic segment
+
+
+def scene_digest(json_data: dict | None) -> str:
+    """Stable key for a canvas scene (used to skip re-rendering an unchanged doodle)."""
+    objs = (json_data or {}).get("objects") or []
+    return hashlib.sha256(json.dumps(objs, sort_keys=True).encode()).hexdigest()
+
+
+def has_strokes(json_data: dict | None) -> bool:
+    return any(o.get("type") == "path" for o in (json_data or {}).get("objects") or [])
+
+
+def _quad(p0, p1, p2):
+    out = []
+    for i in range(1, CURVE_STEPS + 1):
+        t = i / CURVE_STEPS
+        a, b, c = (1 - t) ** 2, 2 * (1 - t) * t, t * t
+        out.append((a * p0[0] + b * p1[0] + c * p2[0], a * p0[1] + b * p1[1] + c * p2[1]))
+    return out
+
+
+def _path_points(obj: dict) -> list[tuple[float, float]]:
+    """Flatten a fabric freedraw path (M/L/Q commands) to canvas coordinates."""
+    pts, cur = [], (0.0, 0.0)
+    for cmd in obj.get("path") or []:
+        op, args = cmd[0].upper(), [float(v) for v in cmd[1:]]
+        if op in ("M", "L") and len(args) >= 2:
+            cur = (args[0], args[1])
+            pts.append(cur)
+        elif op == "Q" and len(args) >= 4:
+            pts.extend(_quad(cur, (args[0], args[1]), (args[2], args[3])))
+            cur = (args[2], args[3])
+    # fabric stores absolute points; left/top only differ from them if the stroke was moved
+    sw = float(obj.get("strokeWidth") or 0)
+    off = obj.get("pathOffset") or {}
+    dx = dy = 0.0
+    if off:
+        dx = float(obj.get("left", 0)) + float(obj.get("width", 0)) / 2 + sw / 2 - float(off.get("x") or 0)
+        dy = float(obj.get("top", 0)) + float(obj.get("height", 0)) / 2 + sw / 2 - float(off.get("y") or 0)
+    return [(x + dx, y + dy) for x, y in pts]
+
+
+def _color(value: str | None, fallback=(17, 17, 17, 255)):
+    try:
+        return ImageColor.getcolor(value, "RGBA") if value else fallback
+    except ValueError:
+        return fallback
+
+
+def rasterize(json_data: dict | None, width: int, height: int, background: str = "#f8f6ff") -> Image.Image:
+    """Draw the canvas strokes onto a background-coloured RGBA image."""
+    img = Image.new("RGBA", (width, height), _color(background, (255, 255, 255, 255)))
+    draw = ImageDraw.Draw(img)
+    for obj in (json_data or {}).get("objects") or []:
+        if obj.get("type") != "path":
+            continue
+        pts = _path_points(obj)
+        if not pts:
+            continue
+        color = _color(obj.get("stroke"))
+        w = max(1, int(round(float(obj.get("strokeWidth") or 1))))
+        if len(pts) > 1:
+            draw.line(pts, fill=color, width=w, joint="curve")
+        r = w / 2
+        for x, y in (pts[0], pts[-1]):  # round caps
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    return img
+
+
+def sparkle(img: Image.Image) -> Image.Image:
+    """Soft blur plus small warm glints on inked pixels."""
+    base = img.convert("RGBA")
+    blur = base.filter(ImageFilter.GaussianBlur(1.6))
+    base = Image.blend(base, blur, 0.25)
+    gray = np.array(base.convert("L"))
+    ys, xs = np.where(gray < 235)
+    overlay = Image.new("RGBA", base.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    if len(xs) > 0:
+        n = min(70, max(24, len(xs) // 140))
+        for _ in range(n):
+            k = random.randrange(len(xs))
+            x, y = int(xs[k]), int(ys[k])
+            draw.ellipse((x - 1, y - 1, x + 1, y + 1), fill=(255, 245, 190, 180))
+    return Image.alpha_composite(base, overlay)
+
+
+def to_png(json_data: dict | None, width: int, height: int, background: str = "#f8f6ff",
+           with_sparkle: bool = False) -> bytes:
+    img = rasterize(json_data, width, height, background)
+    if with_sparkle:
+        img = sparkle(img)
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
@@ -0,0 +1,310 @@
+# utils/importer.py
+"""
+Bulk import of mood history from CSV / XLSX (other journaling apps, or the
+moods_*.xlsx export from the MoodTracker tab).
+
+Rows are streamed (csv.DictReader / openpyxl read-only), validated, and their
+moods mapped onto utils/moods.py: exact labels, emoji, names ("sad", "Stressed")
+or 1-5 ratings. A row is a duplicate when its date + mood + note hash is
+already stored for the user or earlier in the file. New moods get
+deterministic ids ({user_id}_{hash}), so re-running an import is idempotent.
+Writes go through Firestore's BulkWriter when the client has one, otherwise
+WriteBatch commits of 500. At the end the importer rebuilds daily_reports
+(and mood buckets) for the days it touched, once.
+
+    python -m utils.importer --user UID moods.csv [--dry-run]
+"""
+import io, os, sys, csv, hashlib, argparse, datetime
+
+from utils import moods, buckets, sentiment, metrics
+from utils.storage import FieldFilter, SERVER_TIMESTAMP
+
+try:
+    import openpyxl
+except Exception:
+    openpyxl = None  # only needed for .xlsx
+
+BATCH_SIZE = 500
+MAX_ERRORS = 20  # rejected rows reported back (all are counted)
+
+DATE_COLUMNS = ("date", "day", "created_at", "timestamp", "datetime", "entry_date")
+MOOD_COLUMNS = ("mood", "feeling", "rating", "score")
+NOTE_COLUMNS = ("note", "notes", "journal", "entry", "text", "comment")
+REFLECTION_COLUMNS = ("reflection",)
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%d/%m/%Y", "%d.%m.%Y", "%d-%m-%Y")
+
+# free-text mood names -> label (besides the label's own word, e.g. "happy")
+SYNONYMS = {
+    "great": "😊 Happy", "good": "😊 Happy", "joyful": "😊 Happy", "glad": "😊 Happy",
+    "thrilled": "🎉 Excited", "hyped": "🎉 Excited",
+    "relaxed": "😌 Calm", "peaceful": "😌 Calm", "content": "😌 Calm",
+    "fine": "🙂 Okay", "meh": "🙂 Okay", "neutral": "🙂 Okay", "ok": "🙂 Okay", "alright": "🙂 Okay",
+    "stressed": "😟 Anxious", "worried": "😟 Anxious", "nervous": "😟 Anxious", "anxiety": "😟 Anxious",
+    "down": "😢 Sad", "depressed": "😢 Sad", "lonely": "😢 Sad", "upset": "😢 Sad", "bad": "😢 Sad",
+    "mad": "😠 Angry", "frustrated": "😠 Angry", "annoyed": "😠 Angry", "irritated": "😠 Angry",
+    "exhausted": "😴 Tired", "sleepy": "😴 Tired", "drained": "😴 Tired",
+    "sick": "🤒 Unwell", "ill": "🤒 Unwell",
+    "grateful": "🙏 Gratitude", "thankful": "🙏 Gratitude",
+}
+RATINGS = {5: "😊 Happy", 4: "🙂 Okay", 3: "🙂 Okay", 2: "😟 Anxious", 1: "😢 Sad"}
+
+_BY_NAME = {}
+for _label, _ in moods.MOODS:
+    emoji, _, name = _label.partition(" ")
+    _BY_NAME[emoji] = _label
+    _BY_NAME[name.lower()] = _label
+_BY_NAME.update(SYNONYMS)
+
+
+# -----------------------------
+# Parsing / validation
+# -----------------------------
+def map_mood(value) -> str | None:
+    """Known label for an exported label, emoji, mood name or 1-5 rating; None if unknown."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return RATINGS.get(int(round(value))) if value == value else None
+    text = str(value).strip()
+    if text in moods.MOOD_CODES:
+        return text
+    if text.replace(".", "", 1).isdigit():
+        return RATINGS.get(int(round(float(text))))
+    words = text.lower().strip(".!").split()
+    for key in [text.lower()] + words:  # "😊 happy", "😊", "happy"
+        if key in _BY_NAME:
+            return _BY_NAME[key]
+    return None
+
+
+def parse_date(value) -> str | None:
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    text = str(value or "").strip()
+    if not text:
+        return None
+    try:
+        return datetime.date.fromisoformat(text[:10]).isoformat()
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text.split()[0], fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def _pick(row: dict, names) -> object:
+    for n in names:
+        if n in row and row[n] not in (None, ""):
+            return row[n]
+    return None
+
+
+def entry_hash(date: str, mood: str, note: str) -> str:
+    return hashlib.sha1(f"{date}|{mood}|{(note or '').strip()}".encode("utf-8")).hexdigest()[:16]
+
+
+def read_rows(fileobj, filename: str):
+    """Yield {column (lower-case): value} dicts from a CSV or XLSX file object or path."""
+    if isinstance(fileobj, (str, os.PathLike)):
+        with open(fileobj, "rb") as f:
+            yield from read_rows(f, filename or str(fileobj))
+        return
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        if openpyxl is None:
+            raise RuntimeError("Reading .xlsx needs openpyxl (pip install openpyxl).")
+        wb = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = [str(h or "").strip().lower() for h in next(rows, [])]
+            for values in rows:
+                yield dict(zip(header, values))
+        finally:
+            wb.close()
+        return
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    try:
+        for row in csv.DictReader(text):
+            yield {str(k or "").strip().lower(): v for k, v in row.items()}
+    finally:
+        text.detach()
+
+
+def validate(rows, today: datetime.date | None = None):
+    """Yield (line, entry or None, error) with entry = {date, mood, note, reflection}."""
+    today = (today or datetime.date.today()).isoformat()
+    for line, row in enumerate(rows, start=2):  # line 1 is the header
+        date = parse_date(_pick(row, DATE_COLUMNS))
+        raw_mood = _pick(row, MOOD_COLUMNS)
+        mood = map_mood(raw_mood)
+        if date is None:
+            yield line, None, "missing or unreadable date"
+        elif date > today:
+            yield line, None, f"date {date} is in the future"
+        elif mood is None:
+            yield line, None, f"unknown mood {raw_mood!r}"
+        else:
+            note = str(_pick(row, NOTE_COLUMNS) or "").strip()
+            reflection = str(_pick(row, REFLECTION_COLUMNS) or "").strip()
+            yield line, {"date": date, "mood": mood, "note": note, "reflection": reflection}, None
+
+
+# -----------------------------
+# Writes
+# -----------------------------
+class _Writer:
+    """BulkWriter when the client has one, else WriteBatch commits of BATCH_SIZE."""
+
+    def __init__(self, db):
+        self.db, self.written = db, 0
+        self._bulk = db.bulk_writer() if hasattr(db, "bulk_writer") else None
+        self._batch, self._pending = (None, 0) if self._bulk is not None else (db.batch(), 0)
+
+    def set(self, ref, doc, merge=False):
+        self.written += 1
+        if self._bulk is not None:
+            self._bulk.set(ref, doc, merge=merge)
+            return
+        self._batch.set(ref, doc, merge=merge)
+        self._pending += 1
+        if self._pending >= BATCH_SIZE:
+            self._batch.commit()
+            self._batch, self._pending = self.db.batch(), 0
+
+    def close(self):
+        if self._bulk is not None:
+            self._bulk.close()
+        elif self._pending:
+            self._batch.commit()
+            self._batch, self._pending = self.db.batch(), 0
+
+
+def _existing(db, user_id: str, lo: str, hi: str) -> list:
+    q = (db.collection("moods")
+           .where(filter=FieldFilter("user_id", "==", user_id))
+           .where(filter=FieldFilter("date", ">=", lo))
+           .where(filter=FieldFilter("date", "<=", hi)))
+    rows = [{**d.to_dict(), "id": d.id} for d in q.stream()]
+    metrics.add(docs_read=len(rows))
+    return rows
+
+
+def import_moods(user_id: str, rows, db=None, dry_run: bool = False, today: datetime.date | None = None) -> dict:
+    """Validate, dedupe and bulk-write mood rows for one user. Returns a summary."""
+    from utils.db import _client, daily_report_doc
+
+    db = db or _client()
+    stats = {"rows": 0, "imported": 0, "duplicates": 0, "rejected": 0, "errors": [], "days": 0}
+    with metrics.track("job", "import_moods") as rec:
+        entries = []
+        for line, entry, error in validate(rows, today):
+            stats["rows"] += 1
+            if error:
+                stats["rejected"] += 1
+                if len(stats["errors"]) < MAX_ERRORS:
+                    stats["errors"].append(f"line {line}: {error}")
+            else:
+                entries.append(entry)
+        if not entries:
+            return stats
+
+        lo, hi = min(e["date"] for e in entries), max(e["date"] for e in entries)
+        existing = _existing(db, user_id, lo, hi)  # one range query instead of one per row
+        seen = {entry_hash(r.get("date", ""), r.get("mood", ""), r.get("note", "")) for r in existing}
+        new = []
+        for e in entries:
+            h = entry_hash(e["date"], e["mood"], e["note"])
+            if h in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(h)
+            new.append((h, e))
+        stats["imported"] = len(new)
+        if dry_run or not new:
+            return stats
+
+        writer = _Writer(db)
+        docs = []
+        for i in range(0, len(new), BATCH_SIZE):
+            chunk = new[i:i + BATCH_SIZE]
+            scores, emotions = sentiment.score_batch([e["note"] for _, e in chunk])
+            for (h, e), s, emo in zip(chunk, scores, emotions):
+                doc = {"user_id": user_id, "mood": e["mood"], "note": e["note"], "reflection": e["reflection"],
+                       "reflection_status": "done", "date": e["date"], "imported": True, "ts": SERVER_TIMESTAMP}
+                if e["note"] and s == s:  # NaN: nothing scoreable
+                    doc.update(sentiment=round(float(s), 3), emotion=emo)
+                docs.append({**doc, "id": f"{user_id}_{h}"})
+
+        shards = {}  # base bucket id -> shard count opened by this import
+        if buckets.ENABLED:
+            by_month = {}
+            for d in docs:
+                by_month.setdefault(d["date"][:7], []).append(d)
+            for month, month_docs in by_month.items():
+                ids, opened = buckets.place(db, user_id, month, len(month_docs))
+                for d, bid in zip(month_docs, ids):
+                    d["bucket"] = bid
+                if opened:
+                    shards[buckets.shard_id(user_id, month)] = (month, opened)
+        for d in docs:
+            writer.set(db.collection("moods").document(d["id"]), {k: v for k, v in d.items() if k != "id"})
+
+        # affected days: existing + new rows, one report per day, written once
+        by_day = {}
+        for r in existing + docs:
+            by_day.setdefault(r["date"], []).append(r)
+        touched = sorted({d["date"] for d in docs})
+        for day in touched:
+            writer.set(db.collection("daily_reports").document(f"{user_id}_{day}"),
+                       daily_report_doc(user_id, day, by_day[day]), merge=True)
+        if buckets.ENABLED:
+            by_bucket = {}
+            for d in docs:
+                by_bucket.setdefault(d["bucket"], {})[d["id"]] = buckets.entry(d)
+            for bid, bucket_entries in by_bucket.items():
+                month = next(iter(bucket_entries.values()))["d"][:7]
+                writer.set(db.collection(buckets.COLLECTION).document(bid),
+                           buckets.bucket_doc(user_id, month, bucket_entries), merge=True)
+            for bid, (month, n) in shards.items():
+                writer.set(db.collection(buckets.COLLECTION).document(bid),
+                           buckets.bucket_doc(user_id, month, None, shards=n), merge=True)
+        writer.close()
+        rec["docs_written"] = writer.written
+        stats["days"] = len(touched)
+
+    from utils import insights
+    from utils.db import get_insights_snapshot
+    window_start = (today or datetime.date.today()) - datetime.timedelta(days=insights.WINDOW_DAYS)
+    if touched[-1] >= window_start.isoformat() and get_insights_snapshot(user_id):
+        try:
+            insights.run(db, user_id=user_id)  # the snapshot only re-reads days after its as_of
+        except Exception:
+            pass  # nightly job catches up
+    return stats
+
+
+def import_file(user_id: str, fileobj, filename: str, db=None, dry_run: bool = False) -> dict:
+    return import_moods(user_id, read_rows(fileobj, filename), db=db, dry_run=dry_run)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Import mood history from CSV / XLSX")
+    p.add_argument("path")
+    p.add_argument("--user", required=True, help="user id to import into")
+    p.add_argument("--dry-run", action="store_true", help="validate and dedupe only")
+    args = p.parse_args(argv)
+
+    stats = import_file(args.user, args.path, args.path, dry_run=args.dry_run)
+    for line in stats["errors"]:
+        print("  " + line)
+    print(f"{stats['rows']} rows: {stats['imported']} {'to import' if args.dry_run else 'imported'}, "
+          f"{stats['duplicates']} duplicates, {stats['rejected']} rejected, {stats['days']} days rebuilt")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
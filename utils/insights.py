@@ -0,0 +1,207 @@
+# utils/insights.py
+"""
+Insights tab numbers from per-day aggregates instead of raw moods.
+
+A nightly batch job folds every user's last WINDOW_DAYS of moods into one
+insights/{user_id} document ({"days": {date: {"s": score sum, "n": entries,
+"m": {mood: count}, "t": note sentiment sum, "tn": scored notes}}, "as_of": last
+day included}); the tab reads that single
+document, adds the moods logged since `as_of` (normally just today) and derives
+the KPIs, weekly trend and weekday profile from ~30 small dicts.
+
+    python -m utils.insights              # all users (cron: 0 3 * * *)
+    python -m utils.insights --user UID
+"""
+import sys, argparse, datetime
+from collections import Counter
+
+from utils import moods, sentiment
+from utils.storage import FieldFilter
+
+COLLECTION = "insights"
+WINDOW_DAYS = 30
+BATCH_SIZE = 500
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+# -----------------------------
+# Aggregation
+# -----------------------------
+def days_from_rows(rows: list[dict]) -> dict:
+    """{date: {"s", "n", "m", "t", "tn"}} from mood rows (small per-user delta, plain Python)."""
+    sents = sentiment.row_sentiments(rows)  # scores notes stored before sentiment existed
+    days = {}
+    for r, t in zip(rows, sents):
+        d = str(r.get("date") or "")[:10]
+        if len(d) != 10:
+            continue
+        day = days.setdefault(d, {"s": 0, "n": 0, "m": {}})
+        label = r.get("mood") or ""
+        day["s"] += moods.score(label)
+        day["n"] += 1
+        day["m"][label] = day["m"].get(label, 0) + 1
+        if t is not None:
+            day["t"] = day.get("t", 0.0) + t
+            day["tn"] = day.get("tn", 0) + 1
+    return days
+
+
+def merge_days(base: dict, delta: dict) -> dict:
+    out = {d: {**v, "m": dict(v.get("m") or {})} for d, v in (base or {}).items()}
+    for d, v in delta.items():
+        day = out.setdefault(d, {"s": 0, "n": 0, "m": {}})
+        day["s"] += v["s"]
+        day["n"] += v["n"]
+        if v.get("tn"):
+            day["t"] = day.get("t", 0.0) + v["t"]
+            day["tn"] = day.get("tn", 0) + v["tn"]
+        for label, n in (v.get("m") or {}).items():
+            day["m"][label] = day["m"].get(label, 0) + n
+    return out
+
+
+def build_snapshots(df, as_of: datetime.date) -> dict:
+    """Vectorized over all users: DataFrame(user_id, date, mood[, note, sentiment]) -> {user_id: snapshot doc}."""
+    lo = (as_of - datetime.timedelta(days=WINDOW_DAYS - 1)).isoformat()
+    for col in ("note", "sentiment"):
+        if col not in df.columns:
+            df = df.assign(**{col: None})
+    df = df[["user_id", "date", "mood", "note", "sentiment"]].dropna(subset=["user_id", "date"]).copy()
+    df["date"] = df["date"].astype(str).str.slice(0, 10)
+    df = df[(df["date"] >= lo) & (df["date"] <= as_of.isoformat())]
+    if df.empty:
+        return {}
+    df["mood"] = df["mood"].fillna("")
+    df["score"] = df["mood"].map(moods.MOOD_SCORES).fillna(moods.DEFAULT_SCORE)
+    df["sentiment"] = df["sentiment"].astype(float)
+    unscored = df["sentiment"].isna() & df["note"].fillna("").str.strip().ne("")
+    if unscored.any():
+        df.loc[unscored, "sentiment"] = sentiment.score_batch(df.loc[unscored, "note"].tolist())[0]
+
+    per_day = df.groupby(["user_id", "date"])["score"].agg(["sum", "count"])
+    per_mood = df.groupby(["user_id", "date", "mood"]).size()
+    per_sent = df.dropna(subset=["sentiment"]).groupby(["user_id", "date"])["sentiment"].agg(["sum", "count"])
+
+    snaps = {}
+    for (uid, date), (s, n) in zip(per_day.index, per_day.itertuples(index=False)):
+        snap = snaps.setdefault(uid, {"user_id": uid, "as_of": as_of.isoformat(),
+                                      "window_days": WINDOW_DAYS, "days": {}})
+        snap["days"][date] = {"s": float(s), "n": int(n), "m": {}}
+    for (uid, date, label), n in per_mood.items():
+        snaps[uid]["days"][date]["m"][label] = int(n)
+    for (uid, date), (t, tn) in zip(per_sent.index, per_sent.itertuples(index=False)):
+        snaps[uid]["days"][date].update({"t": round(float(t), 4), "tn": int(tn)})
+    return snaps
+
+
+# -----------------------------
+# Derived numbers for the tab
+# -----------------------------
+def summarize(days: dict, today: datetime.date | None = None) -> dict | None:
+    """KPIs, weekly trend and weekday profile for the WINDOW_DAYS ending today."""
+    today = today or datetime.date.today()
+    lo = (today - datetime.timedelta(days=WINDOW_DAYS - 1)).isoformat()
+    days = {d: v for d, v in (days or {}).items() if lo <= d <= today.isoformat() and v.get("n")}
+    if not days:
+        return None
+
+    total_s = sum(v["s"] for v in days.values())
+    total_n = sum(v["n"] for v in days.values())
+    counts = Counter()
+    for v in days.values():
+        counts.update(v.get("m") or {})
+
+    streak, cur = 0, today
+    while cur.isoformat() in days:
+        streak += 1
+        cur -= datetime.timedelta(days=1)
+
+    weekly, weekday = {}, {}
+    for d, v in days.items():
+        dt = datetime.date.fromisoformat(d)
+        week = (dt - datetime.timedelta(days=dt.weekday())).isoformat()  # Monday
+        for bucket, key in ((weekly, week), (weekday, WEEKDAYS[dt.weekday()])):
+            acc = bucket.setdefault(key, [0.0, 0])
+            acc[0] += v["s"]
+            acc[1] += v["n"]
+
+    daily_avg = {d: v["s"] / v["n"] for d, v in days.items()}
+    daily_sent = {d: v["t"] / v["tn"] for d, v in days.items() if v.get("tn")}
+    return {
+        "avg": total_s / total_n,
+        "entries": total_n,
+        "most_common": counts.most_common(1)[0][0] if counts else None,
+        "streak": streak,
+        "weekly": [(w, s / n) for w, (s, n) in sorted(weekly.items())],
+        "weekday": {w: (weekday[w][0] / weekday[w][1] if w in weekday else None) for w in WEEKDAYS},
+        "daily": sorted(daily_avg.items()),
+        "sentiment": sorted(daily_sent.items()),  # note sentiment per day, -1..1
+        "pos_days": sum(1 for a in daily_avg.values() if a >= 4.5),
+        "tough_days": sum(1 for a in daily_avg.values() if a <= 2.0),
+    }
+
+
+def load_days(user_id: str, today: datetime.date | None = None) -> dict:
+    """Snapshot days plus moods logged since its as_of (1 doc + today's rows, or a full scan without one)."""
+    from utils.db import get_insights_snapshot, list_recent_moods
+
+    today = today or datetime.date.today()
+    snap = get_insights_snapshot(user_id)
+    as_of = None
+    if snap and snap.get("as_of"):
+        try:
+            as_of = datetime.date.fromisoformat(snap["as_of"])
+        except ValueError:
+            as_of = None
+    if as_of is None or (today - as_of).days >= WINDOW_DAYS:
+        return days_from_rows(list_recent_moods(user_id, days=WINDOW_DAYS - 1))
+    delta = list_recent_moods(user_id, days=max(0, (today - as_of).days - 1))  # since as_of + 1
+    delta = [r for r in delta if str(r.get("date") or "") > as_of.isoformat()]
+    return merge_days(snap.get("days") or {}, days_from_rows(delta))
+
+
+# -----------------------------
+# Batch job
+# -----------------------------
+def run(db, as_of: datetime.date | None = None, user_id: str | None = None) -> int:
+    """Recompute snapshots (through as_of, default yesterday). Returns documents written."""
+    import pandas as pd
+
+    as_of = as_of or (datetime.date.today() - datetime.timedelta(days=1))
+    lo = (as_of - datetime.timedelta(days=WINDOW_DAYS - 1)).isoformat()
+    q = db.collection("moods").where(filter=FieldFilter("date", ">=", lo))
+    if user_id:
+        q = q.where(filter=FieldFilter("user_id", "==", user_id))
+    rows = [d.to_dict() or {} for d in q.stream()]
+    df = pd.DataFrame(rows, columns=["user_id", "date", "mood", "note", "sentiment"])
+    snaps = build_snapshots(df, as_of)
+    if user_id and user_id not in snaps:
+        snaps[user_id] = {"user_id": user_id, "as_of": as_of.isoformat(), "window_days": WINDOW_DAYS, "days": {}}
+
+    batch, pending = db.batch(), 0
+    for uid, doc in snaps.items():
+        batch.set(db.collection(COLLECTION).document(uid), doc)  # full overwrite: old days drop out
+        pending += 1
+        if pending >= BATCH_SIZE:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+    return len(snaps)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Nightly insights snapshots")
+    p.add_argument("--user", default=None, help="only this user id")
+    p.add_argument("--as-of", default=None, help="last day to include (YYYY-MM-DD, default yesterday)")
+    args = p.parse_args(argv)
+
+    from utils.db import _client
+    as_of = datetime.date.fromisoformat(args.as_of) if args.as_of else None
+    n = run(_client(), as_of=as_of, user_id=args.user)
+    print(f"Wrote {n} insights snapshots")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+# utils/jobs.py
+"""
+Process-wide background worker pool for slow, non-critical work (e.g. mood
+reflections). Sessions keep only the job id and poll() it on later reruns.
+"""
+import os, time, uuid, threading
+from concurrent.futures import ThreadPoolExecutor
+
+WORKERS = int(os.getenv("SERENITY_JOB_WORKERS", "4"))
+KEEP_RESULTS_S = 3600
+
+_pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="serenity-job")
+_lock = threading.Lock()
+_jobs = {}  # job_id -> (future, submitted_at)
+
+
+def _prune(now: float):
+    for job_id in [j for j, (f, t) in _jobs.items() if f.done() and now - t > KEEP_RESULTS_S]:
+        del _jobs[job_id]
+
+
+def submit(fn, *args, **kwargs) -> str:
+    """Run fn(*args, **kwargs) on the pool. Returns a job id for poll()."""
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with _lock:
+        _prune(now)
+        _jobs[job_id] = (_pool.submit(fn, *args, **kwargs), now)
+    return job_id
+
+
+def poll(job_id: str) -> dict:
+    """{"state": "pending" | "done" | "failed" | "unknown", "result": ..., "error": str}."""
+    with _lock:
+        entry = _jobs.get(job_id)
+    if entry is None:
+        return {"state": "unknown"}
+    fut, _ = entry
+    if not fut.done():
+        return {"state": "pending"}
+    err = fut.exception()
+    if err is not None:
+        return {"state": "failed", "error": str(err)}
+    return {"state": "done", "result": fut.result()}
@@ -0,0 +1,245 @@
+# utils/letters.py
+"""
+Letter delivery scheduler.
+
+Once per SERENITY_LETTER_SCAN_S, one query over the (notified, deliver_on)
+composite index on `letters` picks up every letter (all users) that became due
+and hasn't been processed yet (notified == False). For each batch of up to 500:
+  - hands a reminder to the configured sender (log / smtp / your own),
+  - flags the letters whose reminder went out (notified = True, notified_at);
+    failed sends stay unflagged and are retried next scan, up to MAX_SEND_ATTEMPTS,
+  - sets letter_flags/{user_id}.has_due = True, the cheap (cached) doc the UI reads.
+store_letter also sets has_due for a letter due today, and next_due for a
+future one, so the UI doesn't wait for a scan to see it.
+Each scan also stamps letter_flags/_scheduler; the UI only trusts has_due=False
+while that heartbeat is fresh (see scheduler_alive()).
+
+Letters written before the scheduler existed have no `notified` field, so the
+first scan backfills it once (or run `python -m utils.letters --backfill`).
+
+Run it inside the Streamlit process (SERENITY_LETTER_SCHEDULER=1) or on its own:
+
+    python -m utils.letters            # loop forever
+    python -m utils.letters --once     # single scan (cron)
+
+Local SMTP stand-in for the email sender:
+    python -m aiosmtpd -n -l localhost:1025   # then SERENITY_LETTER_SENDER=smtp
+"""
+import os, sys, time, smtplib, logging, argparse, datetime, threading
+from email.message import EmailMessage
+
+from utils import metrics, cache
+from utils.storage import FieldFilter, SERVER_TIMESTAMP
+
+SCHEDULER = os.getenv("SERENITY_LETTER_SCHEDULER", "0") == "1"
+INTERVAL_S = float(os.getenv("SERENITY_LETTER_SCAN_S", "300"))
+SENDER = os.getenv("SERENITY_LETTER_SENDER", "log")  # log | smtp | none | registered name
+FLAGS = "letter_flags"
+HEARTBEAT_ID = "_scheduler"  # letter_flags/_scheduler: {"last_scan", "interval_s"}
+BACKFILL_MARKER = "_backfill_notified"
+BATCH_SIZE = 500
+MAX_SEND_ATTEMPTS = int(os.getenv("SERENITY_LETTER_SEND_ATTEMPTS", "5"))
+
+SMTP_HOST = os.getenv("SERENITY_SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SERENITY_SMTP_PORT", "1025"))
+SMTP_USER = os.getenv("SERENITY_SMTP_USER")
+SMTP_PASSWORD = os.getenv("SERENITY_SMTP_PASSWORD")
+SMTP_FROM = os.getenv("SERENITY_SMTP_FROM", "serenity@localhost")
+SMTP_TLS = os.getenv("SERENITY_SMTP_TLS", "0") == "1"
+
+SUBJECT = "💌 A letter from your past self is ready"
+BODY = ("Hi! A letter you wrote to your future self is ready to read in Serenity.\n"
+        "Open the Letters tab to read it. Be gentle with yourself today. 💙\n")
+
+log = logging.getLogger("serenity.letters")
+_started = False
+_start_lock = threading.Lock()
+
+
+# -----------------------------
+# Senders: fn(user_id, letters) where letters = [{"id", "deliver_on", "notify_email", ...}]
+# -----------------------------
+def _log_sender(user_id: str, letters: list):
+    log.info("%d letter(s) ready for %s", len(letters), user_id)
+
+
+def _smtp_sender(user_id: str, letters: list):
+    to = sorted({l["notify_email"] for l in letters if l.get("notify_email")})
+    if not to:
+        return
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=20) as smtp:
+        if SMTP_TLS:
+            smtp.starttls()
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASSWORD or "")
+        for addr in to:
+            msg = EmailMessage()
+            msg["From"], msg["To"], msg["Subject"] = SMTP_FROM, addr, SUBJECT
+            msg.set_content(BODY)  # never the letter itself
+            smtp.send_message(msg)
+
+
+_SENDERS = {
+    "log": _log_sender,
+    "smtp": _smtp_sender,
+    "none": lambda user_id, letters: None,
+}
+
+
+def register_sender(name: str, fn):
+    """Plug in another channel (push, SMS, ...): fn(user_id, letters)."""
+    _SENDERS[name] = fn
+
+
+# -----------------------------
+# Scan
+# -----------------------------
+def backfill_notified(db) -> int:
+    """Give legacy letters a `notified` field so the scan query can see them. Idempotent; returns docs fixed."""
+    marker = db.collection(FLAGS).document(BACKFILL_MARKER)
+    if marker.get().exists:
+        return 0
+    n = 0
+    with metrics.track("job", "letters_backfill") as rec:
+        batch, pending = db.batch(), 0
+        for d in db.collection("letters").stream():
+            rec["docs_read"] = rec.get("docs_read", 0) + 1
+            data = d.to_dict()
+            if "notified" in data:
+                continue
+            # already read -> nothing to remind about
+            batch.update(db.collection("letters").document(d.id), {"notified": bool(data.get("delivered"))})
+            n += 1
+            pending += 1
+            if pending >= BATCH_SIZE:
+                batch.commit()
+                batch, pending = db.batch(), 0
+        batch.set(marker, {"done": True, "letters": n, "updated": SERVER_TIMESTAMP})
+        batch.commit()
+        rec["docs_written"] = n + 1
+    return n
+
+
+def scan_once(db, today: datetime.date | None = None, sender: str | None = None) -> dict:
+    """Notify about newly due letters for all users, then flag them. Returns counters."""
+    today = (today or datetime.date.today()).isoformat()
+    send = _SENDERS.get(sender or SENDER, _log_sender)
+    stats = {"letters": 0, "users": 0, "send_errors": 0}
+    with metrics.track("job", "letters_scan") as rec:
+        q = (db.collection("letters")
+               .where(filter=FieldFilter("notified", "==", False))
+               .where(filter=FieldFilter("deliver_on", "<=", today)))
+        due = [{**d.to_dict(), "id": d.id} for d in q.stream()]
+        rec["docs_read"] = len(due)
+        due = [l for l in due if not l.get("delivered") and l.get("user_id")]
+
+        for i in range(0, len(due), BATCH_SIZE):
+            chunk = due[i:i + BATCH_SIZE]
+            by_user = {}
+            for l in chunk:
+                by_user.setdefault(l["user_id"], []).append(l)
+
+            # send first: a reminder is only marked sent once it actually went out
+            failed = set()
+            for uid, letters in by_user.items():
+                try:
+                    send(uid, letters)
+                except Exception as e:
+                    failed.add(uid)
+                    stats["send_errors"] += 1
+                    metrics.count("letters", "send", ok=False, error=type(e).__name__)
+
+            batch = db.batch()
+            for l in chunk:
+                ref = db.collection("letters").document(l["id"])
+                if l["user_id"] not in failed:
+                    batch.update(ref, {"notified": True, "notified_at": SERVER_TIMESTAMP})
+                    continue
+                attempts = int(l.get("notify_attempts") or 0) + 1
+                give_up = attempts >= MAX_SEND_ATTEMPTS
+                batch.update(ref, {"notify_attempts": attempts, "notified": give_up,
+                                   **({"notify_failed": True} if give_up else {})})
+            for uid in by_user:
+                batch.set(db.collection(FLAGS).document(uid),
+                          {"user_id": uid, "has_due": True, "updated": SERVER_TIMESTAMP}, merge=True)
+            batch.commit()
+            for uid in by_user:
+                cache.delete(cache.user_ns(uid, "letters"), "flag")  # see utils/db.py letters_flag
+            rec["docs_written"] = rec.get("docs_written", 0) + len(chunk) + len(by_user)
+            stats["letters"] += len(chunk)
+            stats["users"] += len(by_user)
+
+        db.collection(FLAGS).document(HEARTBEAT_ID).set(
+            {"last_scan": time.time(), "interval_s": INTERVAL_S, "updated": SERVER_TIMESTAMP})
+        rec["docs_written"] = rec.get("docs_written", 0) + 1
+    return stats
+
+
+def scheduler_alive(db=None) -> bool:
+    """True if some scheduler scanned recently enough for has_due=False to be trusted (cached 60 s)."""
+    beat = cache.get("letters", "heartbeat")
+    if beat is None:
+        if db is None:
+            from utils.db import _client
+            db = _client()
+        snap = db.collection(FLAGS).document(HEARTBEAT_ID).get()
+        beat = snap.to_dict() if snap.exists else {}
+        beat = {"last_scan": beat.get("last_scan", 0), "interval_s": beat.get("interval_s", INTERVAL_S)}
+        cache.set("letters", "heartbeat", beat, ttl=60)
+    return time.time() - float(beat["last_scan"]) < 2 * float(beat["interval_s"]) + 60
+
+
+def _run(client_factory, interval_s: float):
+    try:
+        backfill_notified(client_factory())
+    except Exception:
+        pass  # retried on the next start; shows up in metrics
+    while True:
+        try:
+            scan_once(client_factory())
+        except Exception:
+            pass  # next interval retries; failures show up in metrics
+        time.sleep(interval_s)
+
+
+def start(client_factory=None, interval_s: float | None = None):
+    """Background scanner thread, once per process (no-op unless SERENITY_LETTER_SCHEDULER=1)."""
+    global _started
+    if not SCHEDULER:
+        return
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    if client_factory is None:
+        from utils.db import _client as client_factory
+    threading.Thread(target=_run, args=(client_factory, interval_s or INTERVAL_S),
+                     name="letter-scheduler", daemon=True).start()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Letter delivery scheduler")
+    p.add_argument("--once", action="store_true", help="single scan, then exit")
+    p.add_argument("--interval", type=float, default=INTERVAL_S, help="seconds between scans")
+    p.add_argument("--sender", default=None, help="log | smtp | none")
+    p.add_argument("--backfill", action="store_true", help="add notified=False to legacy letters, then exit")
+    args = p.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="[letters] %(message)s")
+
+    from utils.db import _client
+    n = backfill_notified(_client())
+    if n or args.backfill:
+        log.info("backfilled notified on %d legacy letter(s)", n)
+    if args.backfill:
+        return 0
+    while True:
+        stats = scan_once(_client(), sender=args.sender)
+        log.info("processed %d letter(s) for %d user(s)%s", stats["letters"], stats["users"],
+                 f", {stats['send_errors']} send error(s)" if stats["send_errors"] else "")
+        if args.once:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+# utils/live.py
+"""
+Opt-in realtime views (SERENITY_LIVE_VIEWS=1).
+
+While a user has an open session, one on_snapshot listener per collection
+(moods / letters / memories / schedules) keeps an in-process copy of that user's
+recent documents, and utils/db.py serves reads from it instead of re-querying on
+every rerun. Changes made elsewhere (another device, the letter scheduler) land
+through the listener without polling.
+
+Listeners are reference-counted per user: each session holds a LiveHandle in
+st.session_state, and the user's listeners detach when the last handle goes
+(explicit close() or garbage collection of the session). At most
+SERENITY_LIVE_MAX_USERS users are watched per process; beyond that reads fall
+back to plain queries.
+
+A view whose listener fails (callback error, or the Firestore watch stream
+closing) is dropped, so reads go back to queries instead of a stale copy.
+renew() re-attaches such a session (or one that got no view) with exponential
+backoff, starting at SERENITY_LIVE_RETRY_S.
+"""
+import os, time, datetime, threading, weakref
+
+from utils import metrics
+from utils.storage import FieldFilter
+
+ENABLED = os.getenv("SERENITY_LIVE_VIEWS", "0") == "1"
+MAX_USERS = int(os.getenv("SERENITY_LIVE_MAX_USERS", "200"))
+MOOD_DAYS = int(os.getenv("SERENITY_LIVE_MOOD_DAYS", "90"))  # window kept for moods
+RETRY_S = float(os.getenv("SERENITY_LIVE_RETRY_S", "30"))  # first re-attach delay, doubling per failure
+RETRY_MAX_S = 600
+
+
+def _queries(db, user_id: str, since: str) -> dict:
+    mine = FieldFilter("user_id", "==", user_id)
+    return {
+        "moods": db.collection("moods").where(filter=mine).where(filter=FieldFilter("date", ">=", since)),
+        "letters": db.collection("letters").where(filter=mine).where(filter=FieldFilter("delivered", "==", False)),
+        "memories": db.collection("memories").where(filter=mine),
+        "schedules": db.collection("schedules").where(filter=mine),
+    }
+
+
+class UserView:
+    """Materialized documents for one user, kept current by snapshot listeners."""
+
+    def __init__(self, user_id: str, mood_since: str):
+        self.user_id = user_id
+        self.mood_since = mood_since  # moods older than this are not in the view
+        self.refs = 0
+        self._lock = threading.Lock()
+        self._docs = {}      # collection -> {doc id: dict}
+        self._ready = set()  # collections that received their first snapshot
+        self._watches = []
+        self.broken = False
+
+    def _on_snapshot(self, collection):
+        def callback(docs, changes, read_time):
+            try:
+                with metrics.track("firestore", f"snapshot:{collection}") as rec:
+                    rec["docs_read"] = len(changes)
+                    with self._lock:
+                        current = self._docs.setdefault(collection, {})
+                        for ch in changes:
+                            if ch.type.name == "REMOVED":
+                                current.pop(ch.document.id, None)
+                            else:
+                                current[ch.document.id] = {**ch.document.to_dict(), "id": ch.document.id}
+                        self._ready.add(collection)
+            except Exception as e:
+                _drop(self, f"{collection}: {type(e).__name__}")
+        return callback
+
+    def healthy(self) -> bool:
+        # google's Watch exposes is_active; it goes False when the stream closed on an error
+        return not self.broken and all(getattr(w, "is_active", True) for w in self._watches)
+
+    def attach(self, db):
+        for collection, q in _queries(db, self.user_id, self.mood_since).items():
+            self._watches.append(q.on_snapshot(self._on_snapshot(collection)))
+
+    def detach(self):
+        for w in self._watches:
+            try:
+                w.unsubscribe()
+            except Exception:
+                pass
+        self._watches = []
+
+    def rows(self, collection: str) -> list | None:
+        """Copies of the cached docs, or None until the first snapshot arrived (or the view broke)."""
+        with self._lock:
+            if self.broken or collection not in self._ready:
+                return None
+            return [dict(d) for d in self._docs.get(collection, {}).values()]
+
+
+_lock = threading.Lock()
+_views = {}  # user_id -> UserView
+
+
+def _release(user_id: str, view: UserView):
+    with _lock:
+        if _views.get(user_id) is not view:  # already dropped (broken listener)
+            return
+        view.refs -= 1
+        if view.refs > 0:
+            return
+        _views.pop(user_id, None)
+        metrics.set_gauge("live_views", float(len(_views)))
+    view.detach()
+
+
+def _drop(view: UserView, reason: str):
+    """Listener failed: forget the view so reads fall back to queries; the next attach() starts fresh."""
+    with _lock:
+        if view.broken:
+            return
+        view.broken = True
+        if _views.get(view.user_id) is view:
+            _views.pop(view.user_id, None)
+        metrics.set_gauge("live_views", float(len(_views)))
+    metrics.count("live_error", "listener", ok=False, error=reason)
+    threading.Thread(target=view.detach, daemon=True).start()  # may be on the listener's own thread
+
+
+class LiveHandle:
+    """One session's claim on a user's view; keep it in st.session_state."""
+
+    def __init__(self, user_id: str, view: UserView, failures: int = 0):
+        self.user_id = user_id
+        self.failures = failures  # consecutive broken / failed attaches before this one
+        self._view = view
+        self._finalizer = weakref.finalize(self, _release, user_id, view)
+
+    @property
+    def closed(self) -> bool:
+        return self._view.broken or not self._finalizer.alive
+
+    def close(self):
+        self._finalizer()
+
+
+class NoLive:
+    """Placeholder when there is no view (disabled, full, listener failed); renew() retries after retry_at."""
+
+    closed = True
+
+    def __init__(self, user_id: str, failures: int = 0):
+        self.user_id = user_id
+        self.failures = failures
+        self.retry_at = time.monotonic() + min(RETRY_MAX_S, RETRY_S * 2 ** min(failures, 16))
+
+    def close(self):
+        pass
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def attach(user_id: str, client_factory) -> LiveHandle | None:
+    """Start (or share) listeners for user_id. None when disabled or over MAX_USERS."""
+    if not ENABLED or not user_id:
+        return None
+    with _lock:
+        view = _views.get(user_id)
+        if view is None:
+            if len(_views) >= MAX_USERS:
+                return None
+            since = (datetime.date.today() - datetime.timedelta(days=MOOD_DAYS)).isoformat()
+            view = _views[user_id] = UserView(user_id, since)
+            fresh = True
+        else:
+            fresh = False
+        view.refs += 1
+        metrics.set_gauge("live_views", float(len(_views)))
+    if fresh:
+        try:
+            view.attach(client_factory())
+        except Exception:
+            _release(user_id, view)
+            return None
+    return LiveHandle(user_id, view)
+
+
+def renew(user_id: str, handle, client_factory):
+    """This session's handle for user_id: keep a working one, back off after a broken one,
+    and re-attach once a NoLive placeholder's delay is up. Returns a LiveHandle or NoLive."""
+    same = handle is not None and handle.user_id == user_id
+    if same and not handle.closed:
+        return handle
+    if same and isinstance(handle, NoLive) and time.monotonic() < handle.retry_at:
+        return handle
+    if handle is not None:
+        handle.close()
+    if same and isinstance(handle, LiveHandle):  # its view broke: wait before paying for a new snapshot
+        return NoLive(user_id, handle.failures)
+    failures = handle.failures + 1 if same else 0
+    h = attach(user_id, client_factory)
+    if h is None:
+        return NoLive(user_id, failures)
+    h.failures = failures
+    return h
+
+
+def view(user_id: str) -> UserView | None:
+    if not ENABLED:
+        return None
+    with _lock:
+        v = _views.get(user_id)
+    if v is not None and not v.healthy():
+        _drop(v, "watch closed")
+        return None
+    return v
+
+
+def active_users() -> int:
+    with _lock:
+        return len(_views)
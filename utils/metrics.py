@@ -0,0 +1,238 @@
+# utils/metrics.py
+"""
+Lightweight hot-path instrumentation for Gemini and Firestore calls.
+
+    with track("llm", "gemini_reply") as rec:
+        ...
+        rec["prompt_tokens"] = 123
+
+    @timed("firestore")
+    def list_recent_moods(...): ...
+
+Every call lands in a ring buffer (for percentiles / the diagnostics panel) and
+in cumulative Prometheus-style histograms and counters (prometheus_text()).
+"""
+import os, time, threading, contextlib, functools
+from collections import deque, defaultdict
+
+RING_SIZE = int(os.getenv("SERENITY_METRICS_RING", "2048"))
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+COUNTER_FIELDS = ("prompt_tokens", "response_tokens", "docs_read", "docs_written", "retries")
+
+_lock = threading.Lock()
+_local = threading.local()
+_ring = deque(maxlen=RING_SIZE)
+_hist = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))  # (kind, name) -> bucket counts (+Inf last)
+_sum_ms = defaultdict(float)
+_counts = defaultdict(int)
+_errors = defaultdict(int)
+_counters = defaultdict(int)  # (kind, name, field) -> total
+_gauges = {}
+_exporter = None
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def _observe(rec: dict):
+    key = (rec["kind"], rec["name"])
+    ms = rec["ms"]
+    with _lock:
+        _ring.append(rec)
+        buckets = _hist[key]
+        for i, edge in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= edge:
+                buckets[i] += 1
+                break
+        else:
+            buckets[-1] += 1
+        _sum_ms[key] += ms
+        _counts[key] += 1
+        if not rec["ok"]:
+            _errors[key] += 1
+        for f in COUNTER_FIELDS:
+            if rec.get(f):
+                _counters[key + (f,)] += rec[f]
+
+
+# -----------------------------
+# Recording
+# -----------------------------
+@contextlib.contextmanager
+def track(kind: str, name: str, **fields):
+    """Time a call; the yielded dict can be filled with tokens / doc counts / model."""
+    rec = {"kind": kind, "name": name, "ts": time.time(), "ok": True, **fields}
+    stack = _stack()
+    stack.append(rec)
+    t0 = time.perf_counter()
+    try:
+        yield rec
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            rec["ok"] = False
+            rec["error"] = type(e).__name__
+        raise
+    finally:
+        rec["ms"] = (time.perf_counter() - t0) * 1000.0
+        stack.pop()
+        _observe(rec)
+
+
+def timed(kind: str, name: str | None = None):
+    """Decorator form of track()."""
+    def deco(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with track(kind, label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def count(kind: str, name: str, ok: bool = True, error: str | None = None, **fields):
+    """Record a zero-duration event (e.g. a swallowed error) without timing a block."""
+    rec = {"kind": kind, "name": name, "ts": time.time(), "ok": ok, "ms": 0.0, **fields}
+    if error:
+        rec["error"] = error
+    _observe(rec)
+
+
+def add(**fields):
+    """Add to counters of the innermost active track() on this thread (e.g. docs_read=12)."""
+    stack = _stack()
+    if not stack:
+        return
+    rec = stack[-1]
+    for k, v in fields.items():
+        rec[k] = rec.get(k, 0) + v
+
+
+def note(**fields):
+    """Set attributes (e.g. model=...) on the innermost active track()."""
+    stack = _stack()
+    if stack:
+        stack[-1].update(fields)
+
+
+def set_gauge(name: str, value: float):
+    with _lock:
+        _gauges[name] = value
+
+
+# -----------------------------
+# Reading
+# -----------------------------
+def recent(limit: int | None = None) -> list[dict]:
+    with _lock:
+        rows = list(_ring)
+    return rows[-limit:] if limit else rows
+
+
+def totals() -> dict:
+    """Monotonic totals: {"calls": {kind: n}, "docs_read": n, "docs_written": n, "llm_calls": n, ...}."""
+    with _lock:
+        out = {"calls": defaultdict(int)}
+        for (kind, _), n in _counts.items():
+            out["calls"][kind] += n
+        for (kind, _, field), n in _counters.items():
+            out[field] = out.get(field, 0) + n
+    out["calls"] = dict(out["calls"])
+    out["llm_calls"] = out["calls"].get("llm", 0)
+    out.setdefault("docs_read", 0)
+    out.setdefault("docs_written", 0)
+    return out
+
+
+def summary() -> list[dict]:
+    """Per (kind, name) stats from the ring buffer: count, p50/p95 ms, errors, tokens, docs."""
+    groups = defaultdict(list)
+    for r in recent():
+        groups[(r["kind"], r["name"])].append(r)
+    out = []
+    for (kind, name), rows in sorted(groups.items()):
+        ms = sorted(r["ms"] for r in rows)
+        row = {
+            "kind": kind, "name": name, "count": len(rows),
+            "p50_ms": round(ms[len(ms) // 2], 1),
+            "p95_ms": round(ms[min(len(ms) - 1, int(0.95 * (len(ms) - 1) + 0.5))], 1),
+            "errors": sum(1 for r in rows if not r["ok"]),
+        }
+        for f in COUNTER_FIELDS:
+            row[f] = sum(r.get(f, 0) for r in rows)
+        models = sorted({r["model"] for r in rows if r.get("model")})
+        if models:
+            row["models"] = ", ".join(models)
+        out.append(row)
+    return out
+
+
+def _labels(kind, name):
+    return f'kind="{kind}",call="{name}"'
+
+
+def prometheus_text() -> str:
+    """Prometheus text exposition format (v0.0.4)."""
+    lines = [
+        "# HELP serenity_call_latency_ms Latency of Gemini / Firestore calls.",
+        "# TYPE serenity_call_latency_ms histogram",
+    ]
+    with _lock:
+        for (kind, name), buckets in sorted(_hist.items()):
+            cum = 0
+            base = _labels(kind, name)
+            for edge, n in zip(LATENCY_BUCKETS_MS, buckets):
+                cum += n
+                lines.append("serenity_call_latency_ms_bucket{%s,le=\"%s\"} %d" % (base, edge, cum))
+            cum += buckets[-1]
+            lines.append("serenity_call_latency_ms_bucket{%s,le=\"+Inf\"} %d" % (base, cum))
+            lines.append(f"serenity_call_latency_ms_sum{{{_labels(kind, name)}}} {_sum_ms[(kind, name)]:.3f}")
+            lines.append(f"serenity_call_latency_ms_count{{{_labels(kind, name)}}} {_counts[(kind, name)]}")
+
+        lines += ["# HELP serenity_call_errors_total Failed calls.", "# TYPE serenity_call_errors_total counter"]
+        for (kind, name), n in sorted(_errors.items()):
+            lines.append(f"serenity_call_errors_total{{{_labels(kind, name)}}} {n}")
+
+        for field in COUNTER_FIELDS:
+            metric = f"serenity_{field}_total"
+            lines += [f"# TYPE {metric} counter"]
+            for (kind, name, f), n in sorted(_counters.items()):
+                if f == field:
+                    lines.append(f"{metric}{{{_labels(kind, name)}}} {n}")
+
+        for gname, value in sorted(_gauges.items()):
+            lines += [f"# TYPE serenity_{gname} gauge", f"serenity_{gname} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def start_http_exporter(port: int | None = None):
+    """Serve /metrics on SERENITY_METRICS_PORT (once per process) for Prometheus scraping.
+
+    Binds SERENITY_BIND_HOST (127.0.0.1 unless set, e.g. 0.0.0.0 for an external scraper)."""
+    global _exporter
+    port = port or int(os.getenv("SERENITY_METRICS_PORT", "0") or 0)
+    if not port or _exporter is not None:
+        return
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200 if self.path.startswith("/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        _exporter = ThreadingHTTPServer((os.getenv("SERENITY_BIND_HOST", "127.0.0.1"), port), _Handler)
+    except OSError:
+        return  # another Streamlit worker already owns the port
+    threading.Thread(target=_exporter.serve_forever, name="metrics-exporter", daemon=True).start()
@@ -0,0 +1,22 @@
+# utils/moods.py
+"""The fixed mood vocabulary shared by the tracker, reports and storage."""
+
+# (label, score 1-5). Order is the storage code used in mood buckets: append only.
+MOODS = [
+    ("😊 Happy", 5), ("🎉 Excited", 5), ("😌 Calm", 5), ("🙂 Okay", 4),
+    ("😟 Anxious", 2), ("😢 Sad", 1), ("😠 Angry", 1), ("😴 Tired", 2), ("🤒 Unwell", 1),
+    ("⭐ Good Deed", 5), ("🙏 Gratitude", 5),
+]
+DEFAULT_SCORE = 3  # unknown / legacy labels
+
+MOOD_SCORES = dict(MOODS)
+MOOD_CODES = {label: i for i, (label, _) in enumerate(MOODS)}
+GOOD_DEEDS = ("⭐ Good Deed", "🙏 Gratitude")
+
+
+def score(label: str | None) -> int:
+    return MOOD_SCORES.get(label or "", DEFAULT_SCORE)
+
+
+def label(code: int | None) -> str | None:
+    return MOODS[code][0] if code is not None and 0 <= code < len(MOODS) else None
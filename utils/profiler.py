@@ -0,0 +1,151 @@
+# utils/profiler.py
+"""
+Opt-in per-rerun profiler (SERENITY_PROFILE=1).
+
+app.py calls begin_rerun() at the top, wraps each tab / helper in span(name),
+and calls end_rerun() at the bottom. Span timings are aggregated across all
+sessions in this process. With SERENITY_PROFILE_CAPTURE=cprofile|pyinstrument
+the slowest N reruns are also written to SERENITY_PROFILE_DIR.
+"""
+import os, time, heapq, threading, contextlib
+from collections import defaultdict, deque
+
+try:
+    from pyinstrument import Profiler as _Pyinstrument
+except Exception:
+    _Pyinstrument = None
+
+ENABLED = os.getenv("SERENITY_PROFILE", "0") == "1"
+CAPTURE = os.getenv("SERENITY_PROFILE_CAPTURE", "off").lower()  # off | cprofile | pyinstrument
+PROFILE_DIR = os.getenv("SERENITY_PROFILE_DIR", os.path.join(".cache", "profiles"))
+KEEP_SLOWEST = int(os.getenv("SERENITY_PROFILE_KEEP", "10"))
+SAMPLES = 512  # per span, for percentiles
+
+_lock = threading.Lock()
+_local = threading.local()
+_agg = defaultdict(lambda: deque(maxlen=SAMPLES))  # span name -> recent ms
+_slowest = []  # min-heap of (ms, path)
+_last = {}
+
+
+class _Rerun:
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.spans = defaultdict(float)
+        self.stack = []
+        self.prof = None
+        if CAPTURE == "cprofile":
+            import cProfile
+            self.prof = cProfile.Profile()
+            self.prof.enable()
+        elif CAPTURE == "pyinstrument" and _Pyinstrument is not None:
+            self.prof = _Pyinstrument(async_mode="disabled")
+            self.prof.start()
+
+    def stop_capture(self):
+        if self.prof is None:
+            return
+        if CAPTURE == "cprofile":
+            self.prof.disable()
+        else:
+            self.prof.stop()
+
+
+def _write_capture(run: _Rerun, total_ms: float):
+    """Keep the profile only if it's among the slowest KEEP_SLOWEST reruns seen."""
+    with _lock:
+        if len(_slowest) >= KEEP_SLOWEST and total_ms <= _slowest[0][0]:
+            return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        if CAPTURE == "cprofile":
+            path = os.path.join(PROFILE_DIR, f"rerun_{int(total_ms)}ms_{stamp}_{id(run) & 0xffff}.prof")
+            run.prof.dump_stats(path)
+        else:
+            path = os.path.join(PROFILE_DIR, f"rerun_{int(total_ms)}ms_{stamp}_{id(run) & 0xffff}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(run.prof.output_html())
+        heapq.heappush(_slowest, (total_ms, path))
+        while len(_slowest) > KEEP_SLOWEST:
+            _, old = heapq.heappop(_slowest)
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def begin_rerun():
+    if not ENABLED:
+        return
+    if getattr(_local, "run", None) is not None:
+        end_rerun()  # previous rerun never reached the bottom of app.py
+    _local.run = _Rerun()
+
+
+def end_rerun():
+    run = getattr(_local, "run", None)
+    if run is None:
+        return
+    _local.run = None
+    run.stop_capture()
+    total_ms = (time.perf_counter() - run.t0) * 1000.0
+    spans = dict(run.spans, **{"(rerun total)": total_ms})
+    with _lock:
+        for name, ms in spans.items():
+            _agg[name].append(ms)
+        _last.clear()
+        _last.update(spans)
+    if run.prof is not None:
+        try:
+            _write_capture(run, total_ms)
+        except Exception:
+            pass
+
+
+@contextlib.contextmanager
+def span(name: str):
+    """Time a block of the current rerun. st.stop()/st.rerun() inside a span still closes the rerun."""
+    run = getattr(_local, "run", None)
+    if run is None:
+        yield
+        return
+    path = "/".join(run.stack + [name])
+    run.stack.append(name)
+    stopped = False
+    t0 = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        stopped = type(e).__name__ in ("StopException", "RerunException")
+        raise
+    finally:
+        run.spans[path] += (time.perf_counter() - t0) * 1000.0
+        run.stack.pop()
+        if stopped and not run.stack:
+            end_rerun()
+
+
+def last_rerun() -> dict:
+    """Span -> ms of the most recently finished rerun in this process."""
+    with _lock:
+        return dict(_last)
+
+
+def summary() -> list[dict]:
+    """Per-span count / p50 / p95 / mean across every session in this process."""
+    with _lock:
+        items = {k: sorted(v) for k, v in _agg.items()}
+    out = []
+    for name, ms in sorted(items.items()):
+        if not ms:
+            continue
+        out.append({
+            "span": name, "count": len(ms),
+            "p50_ms": round(ms[len(ms) // 2], 1),
+            "p95_ms": round(ms[min(len(ms) - 1, int(0.95 * (len(ms) - 1) + 0.5))], 1),
+            "mean_ms": round(sum(ms) / len(ms), 1),
+        })
+    return out
@@ -0,0 +1,169 @@
+# utils/quota.py
+"""
+Admission control for Gemini calls: a global token bucket (the shared API key)
+plus one bucket per user, with priority lanes.
+
+Each priority may only draw the global bucket down to its reserve, so cosmetic
+work (affirmations, audio) runs out first and crisis classification is never
+queued behind it. Crisis checks are always admitted (they can push the global
+bucket into debt, which makes everything else back off) and are never charged to
+the user's bucket: every chat Send runs one, and it must not halve the user's budget.
+
+With a shared cache (SERENITY_CACHE=redis) the buckets are replaced by per-minute
+window counters in the cache, so every replica draws from the same budget.
+"""
+import os, time, threading
+
+from utils import cache
+
+CRISIS, CHAT, REFLECTION, LOW = 0, 1, 2, 3
+
+TASK_PRIORITY = {
+    "classify_crisis": CRISIS,
+    "gemini_reply": CHAT,
+    "reflect_mood": REFLECTION,
+    "understand_audio": LOW,
+    "generate_affirmation": LOW,
+}
+
+# fraction of global capacity each lane must leave untouched
+RESERVE = {CRISIS: 0.0, CHAT: 0.1, REFLECTION: 0.3, LOW: 0.5}
+# how long a lane may queue for budget before degrading
+MAX_WAIT_S = {CRISIS: 0.0, CHAT: 8.0, REFLECTION: 15.0, LOW: 0.0}
+
+GLOBAL_RPM = float(os.getenv("SERENITY_LLM_RPM", "10"))
+USER_RPM = float(os.getenv("SERENITY_LLM_USER_RPM", "8"))
+
+
+class QuotaExceeded(Exception):
+    """No budget for this request within its lane's wait limit."""
+
+
+class TokenBucket:
+    def __init__(self, rate_per_min: float, capacity: float | None = None, clock=time.monotonic):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_min)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._ts = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._ts) * self.rate)
+        self._ts = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def take(self, n: float = 1.0, floor: float = 0.0, force: bool = False) -> bool:
+        """Take n tokens if that leaves at least `floor`; force=True always takes (may go negative)."""
+        self._refill()
+        if force or self.tokens - n >= floor:
+            self.tokens -= n
+            return True
+        return False
+
+    def wait_time(self, n: float = 1.0, floor: float = 0.0) -> float:
+        self._refill()
+        short = n + floor - self.tokens
+        return 0.0 if short <= 0 else short / self.rate
+
+
+_lock = threading.Condition()
+_global = TokenBucket(GLOBAL_RPM)
+_users: dict = {}
+
+
+def _user_bucket(user_id: str) -> TokenBucket:
+    b = _users.get(user_id)
+    if b is None:
+        b = _users[user_id] = TokenBucket(USER_RPM)
+        if len(_users) > 10000:  # drop idle (full) buckets
+            for uid in [u for u, ub in _users.items() if ub.available() >= ub.capacity][:5000]:
+                _users.pop(uid, None)
+    return b
+
+
+def priority_of(task: str) -> int:
+    return TASK_PRIORITY.get(task, LOW)
+
+
+# -----------------------------
+# Shared (multi-replica) windows
+# -----------------------------
+WINDOW_S = 60
+
+
+def _window_take(prio: int, user_id: str | None) -> float | None:
+    """0.0 if admitted, else seconds until the next window; None if the cache is unavailable."""
+    now = time.time()
+    window = int(now // WINDOW_S)
+    ttl = 2 * WINDOW_S
+    user_key = (cache.user_ns(user_id, "quota"), window) if user_id else None
+    g = cache.incr("quota", f"global:{window}", 1, ttl)
+    if g is None:
+        return None
+    if prio == CRISIS:
+        return 0.0
+    wait = WINDOW_S - now % WINDOW_S
+    if g > GLOBAL_RPM * (1.0 - RESERVE[prio]):
+        cache.incr("quota", f"global:{window}", -1, ttl)
+        return wait
+    if user_key:
+        u = cache.incr(*user_key, 1, ttl)
+        if u is not None and u > USER_RPM:
+            cache.incr(*user_key, -1, ttl)
+            cache.incr("quota", f"global:{window}", -1, ttl)
+            return wait
+    return 0.0
+
+
+def _acquire_shared(task: str, prio: int, user_id: str | None, deadline: float) -> bool:
+    """Admit through the shared windows. False means fall back to the local buckets."""
+    while True:
+        wait = _window_take(prio, user_id)
+        if wait is None:
+            return False
+        if wait == 0.0:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or wait > remaining:
+            raise QuotaExceeded(f"LLM budget exhausted for {task}")
+        time.sleep(min(wait, remaining))
+
+
+def acquire(task: str, user_id: str | None = None, max_wait: float | None = None):
+    """Block until the request is admitted, or raise QuotaExceeded."""
+    prio = priority_of(task)
+    deadline = time.monotonic() + (MAX_WAIT_S[prio] if max_wait is None else max_wait)
+    if cache.shared() and _acquire_shared(task, prio, user_id, deadline):
+        return
+    if prio == CRISIS:
+        with _lock:
+            _global.take(force=True)
+        return
+
+    floor = RESERVE[prio] * _global.capacity
+    with _lock:
+        while True:
+            ub = _user_bucket(user_id) if user_id else None
+            if (ub is None or ub.available() >= 1.0) and _global.available() - 1.0 >= floor:
+                _global.take(floor=floor)
+                if ub is not None:
+                    ub.take()
+                return
+            wait = max(_global.wait_time(floor=floor), ub.wait_time() if ub is not None else 0.0)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or wait > remaining:
+                raise QuotaExceeded(f"LLM budget exhausted for {task}")
+            _lock.wait(timeout=min(wait, remaining))
+
+
+def status() -> dict:
+    with _lock:
+        out = {"global_tokens": round(_global.available(), 2), "global_capacity": _global.capacity,
+               "tracked_users": len(_users)}
+    if cache.shared():
+        out["shared_window_used"] = cache.get("quota", f"global:{int(time.time() // WINDOW_S)}", 0)
+    return out
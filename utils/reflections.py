@@ -0,0 +1,83 @@
+# utils/reflections.py
+"""
+Mood reflections generated in the background (utils/jobs.py) and patched onto
+the saved mood doc.
+
+A job lives only in this process: if the server restarts mid-job the doc stays
+reflection_status "pending". resume() (called once per session from the Mood
+tab) re-queues today's stale ones and marks older ones failed.
+"""
+import os, datetime, threading
+
+from utils import jobs
+from utils.ai import reflect_mood
+from utils.db import update_mood_reflection, list_recent_moods, hydrate_moods
+
+STALE_S = float(os.getenv("SERENITY_REFLECTION_STALE_S", "300"))  # pending longer than this lost its job
+RESUME_DAYS = 14
+
+_lock = threading.Lock()
+_running = set()  # mood doc ids with a job in this process
+
+
+def _reflect_and_patch(user_id: str, mood_doc_id: str, context: str) -> str:
+    try:
+        # strict: a canned "degraded" sentence must not be stored as this mood's reflection
+        text = reflect_mood(context, user_id=user_id, strict=True)
+    except Exception:
+        # Gemini down / quota: the mood is already saved, just mark the reflection
+        update_mood_reflection(mood_doc_id, "", user_id=user_id, status="failed")
+        raise
+    finally:
+        with _lock:
+            _running.discard(mood_doc_id)
+    update_mood_reflection(mood_doc_id, text, user_id=user_id)
+    return text
+
+
+def _age_s(ts) -> float | None:
+    if isinstance(ts, str):  # bucket rows carry ISO strings
+        try:
+            ts = datetime.datetime.fromisoformat(ts)
+        except ValueError:
+            return None
+    if not isinstance(ts, datetime.datetime):
+        return None
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=datetime.timezone.utc)
+    return (datetime.datetime.now(datetime.timezone.utc) - ts).total_seconds()
+
+
+def start(user_id: str, mood_doc_id: str, context: str) -> str:
+    """Generate the reflection for an already-saved mood in the background. Returns a job id."""
+    with _lock:
+        _running.add(mood_doc_id)
+    return jobs.submit(_reflect_and_patch, user_id, mood_doc_id, context)
+
+
+def poll(job_id: str) -> dict:
+    return jobs.poll(job_id)
+
+
+def resume(user_id: str) -> str | None:
+    """Re-queue today's reflections stuck in "pending" (job lost to a restart), fail older ones.
+
+    Returns the job id for the newest re-queued mood, or None."""
+    today = datetime.date.today().isoformat()
+    stale = []
+    for r in list_recent_moods(user_id, days=RESUME_DAYS):
+        if r.get("reflection_status") != "pending" or not r.get("id"):
+            continue
+        with _lock:
+            if r["id"] in _running:
+                continue
+        age = _age_s(r.get("ts"))
+        if age is None or age >= STALE_S:  # younger: probably still running on another replica
+            stale.append(r)
+    for r in stale:
+        if r.get("date") != today:
+            update_mood_reflection(r["id"], "", user_id=user_id, status="failed")
+    job_id = None
+    for r in hydrate_moods([r for r in stale if r.get("date") == today]):  # the note is part of the prompt
+        job_id = start(user_id, r["id"], f"{r.get('mood', '')} {r.get('note', '')}")
+    return job_id
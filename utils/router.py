@@ -0,0 +1,85 @@
+# utils/router.py
+"""
+Per-task Gemini model routing.
+
+Each request type has an ordered list of model tiers. Lightweight tasks try the
+fast tier first (small output budget); crisis and chat stay on the strong tier.
+With SERENITY_ROUTE_BY_LATENCY=1 a tier whose recent latency (EWMA) is over its
+task's slow threshold is skipped in favour of a faster candidate; once every
+PROBE_S one call tries a demoted tier first again, so a single slow spell
+doesn't demote it for good. Every candidate that has a fallback after it gets a
+request timeout (timeout_s, TIMEOUT_FACTOR x the slow threshold); callers fall
+through to the next tier on errors and timeouts.
+"""
+import os, time, threading
+
+STRONG_MODEL = os.getenv("SERENITY_STRONG_MODEL", "gemini-2.5-flash")
+FAST_MODEL = os.getenv("SERENITY_FAST_MODEL", "gemini-2.5-flash-lite")
+
+MODEL_TIERS = {
+    "strong": {"model": STRONG_MODEL, "max_output_tokens": None},
+    "fast": {"model": FAST_MODEL, "max_output_tokens": 96},
+}
+
+# task -> ordered tiers (override with SERENITY_ROUTE_<TASK>=fast,strong)
+TASK_ROUTES = {
+    "classify_crisis": ["strong"],
+    "gemini_reply": ["strong"],
+    "understand_audio": ["strong"],
+    "reflect_mood": ["fast", "strong"],
+    "generate_affirmation": ["fast", "strong"],
+    "affirmation_pool": ["strong"],  # offline bulk job
+}
+# a tier slower than this (EWMA ms) is skipped when latency routing is on
+SLOW_MS = {"reflect_mood": 2500, "generate_affirmation": 2000}
+DEFAULT_SLOW_MS = 6000
+
+ROUTE_BY_LATENCY = os.getenv("SERENITY_ROUTE_BY_LATENCY", "0") == "1"
+EWMA_ALPHA = 0.2
+PROBE_S = float(os.getenv("SERENITY_ROUTE_PROBE_S", "30"))
+TIMEOUT_FACTOR = 2.0
+
+_lock = threading.Lock()
+_ewma_ms: dict = {}  # model -> smoothed latency
+_probed: dict = {}   # model -> monotonic time of the last probe / observation
+
+
+def _tiers_for(task: str) -> list[str]:
+    env = os.getenv(f"SERENITY_ROUTE_{task.upper()}")
+    tiers = [t.strip() for t in env.split(",")] if env else TASK_ROUTES.get(task, ["strong"])
+    return [t for t in tiers if t in MODEL_TIERS] or ["strong"]
+
+
+def candidates(task: str) -> list[dict]:
+    """Ordered [{"tier", "model", "max_output_tokens", "timeout_s"}] to try for a task."""
+    out = [{"tier": t, **MODEL_TIERS[t]} for t in _tiers_for(task)]
+    slow = SLOW_MS.get(task, DEFAULT_SLOW_MS)
+    if ROUTE_BY_LATENCY and len(out) > 1:
+        now = time.monotonic()
+        with _lock:
+            lat = {c["model"]: _ewma_ms.get(c["model"], 0.0) for c in out}
+            fast_enough = [c for c in out if lat[c["model"]] <= slow]
+            too_slow = sorted((c for c in out if lat[c["model"]] > slow), key=lambda c: lat[c["model"]])
+            probe = next((c for c in too_slow if now - _probed.get(c["model"], 0.0) >= PROBE_S), None)
+            if probe is not None:  # one caller per PROBE_S re-measures a demoted tier
+                _probed[probe["model"]] = now
+                too_slow.remove(probe)
+                fast_enough.insert(0, probe)
+        out = fast_enough + too_slow
+    for c in out[:-1]:
+        c["timeout_s"] = slow * TIMEOUT_FACTOR / 1000.0
+    out[-1]["timeout_s"] = None  # last resort: let it finish
+    return out
+
+
+def observe(model: str, ms: float):
+    """Feed a measured call latency (or how long it ran before timing out) into the model's EWMA."""
+    with _lock:
+        prev = _ewma_ms.get(model)
+        _ewma_ms[model] = ms if prev is None else (1 - EWMA_ALPHA) * prev + EWMA_ALPHA * ms
+        _probed[model] = time.monotonic()
+
+
+def latency_snapshot() -> dict:
+    with _lock:
+        return {m: round(v, 1) for m, v in _ewma_ms.items()}
@@ -0,0 +1,236 @@
+# utils/sentiment.py
+"""
+Local, CPU-only sentiment + emotion scoring for mood notes (no LLM calls).
+
+A small wellness-oriented valence lexicon (VADER-style, -4..+4) with negation
+("not", "never", "...n't" flip the next 3 words of the same clause) and
+intensifiers ("very", "so", "kinda"). Notes are tokenized in Python; lookups, negation windows,
+per-note sums and emotion tallies are numpy array ops over the whole batch.
+
+    sentiment  -1.0 (very negative) .. +1.0 (very positive), None for an empty note
+    emotion    dominant lexicon emotion (joy, calm, gratitude, sadness, anxiety,
+               anger, tiredness) or None
+
+    python -m utils.sentiment backfill [--user UID]   # score stored notes that lack a sentiment
+"""
+import re, sys, argparse
+
+import numpy as np
+
+from utils.storage import FieldFilter
+
+BATCH_SIZE = 500
+NEGATION_WINDOW = 3
+NEGATION_SCALE = -0.74
+ALPHA = 15.0  # compound normalization: x / sqrt(x^2 + ALPHA)
+
+EMOTIONS = ["joy", "calm", "gratitude", "sadness", "anxiety", "anger", "tiredness"]
+
+# emotion (or None = valence only) -> {word: valence}
+_LEXICON = {
+    "joy": {
+        "happy": 2.7, "happier": 2.4, "glad": 2.0, "joy": 2.8, "joyful": 2.9, "excited": 2.2, "exciting": 2.2,
+        "fun": 2.3, "great": 3.1, "amazing": 2.8, "awesome": 3.1, "wonderful": 2.7, "fantastic": 2.6,
+        "love": 3.2, "loved": 2.9, "loving": 2.9, "proud": 2.1, "yay": 2.4, "smile": 1.5, "smiled": 1.5,
+        "laugh": 2.0, "laughed": 2.0, "celebrate": 2.7, "win": 2.8, "won": 2.7, "best": 3.2, "enjoyed": 2.3,
+        "enjoy": 2.2, "cheerful": 2.5, "delighted": 2.9, "thrilled": 2.6, "confident": 2.2, "hopeful": 2.3,
+    },
+    "calm": {
+        "calm": 1.3, "peaceful": 2.2, "relaxed": 2.2, "relaxing": 2.2, "rested": 1.6, "okay": 0.9, "ok": 0.9,
+        "fine": 0.8, "better": 1.9, "safe": 1.9, "steady": 1.2, "balanced": 1.5, "content": 1.5,
+        "comfortable": 1.5, "relieved": 1.6, "relief": 1.6, "chill": 1.2, "quiet": 0.5, "meditated": 1.2,
+    },
+    "gratitude": {
+        "grateful": 2.4, "thankful": 2.2, "thanks": 1.9, "thank": 1.5, "appreciate": 1.9,
+        "appreciated": 2.1, "blessed": 2.5, "lucky": 2.0, "kind": 2.0, "kindness": 2.3, "helped": 1.5,
+        "support": 1.7, "supported": 1.8, "supportive": 1.9, "friend": 1.7, "friends": 1.8,
+    },
+    "sadness": {
+        "sad": -2.1, "sadness": -1.9, "unhappy": -1.8, "cry": -2.1, "cried": -2.1, "crying": -2.1,
+        "lonely": -1.8, "alone": -1.0, "miss": -1.1, "missed": -1.2, "hurt": -2.4, "hurts": -2.4,
+        "depressed": -2.3, "down": -1.0, "empty": -1.5, "hopeless": -2.8, "worthless": -2.9,
+        "heartbroken": -2.9, "lost": -1.3, "grief": -2.2, "disappointed": -1.9, "rejected": -2.0,
+        "failed": -2.3, "fail": -2.1, "failure": -2.4, "left": -0.4, "ignored": -1.5, "useless": -2.2,
+    },
+    "anxiety": {
+        "anxious": -1.0, "anxiety": -1.7, "worried": -1.9, "worry": -1.9, "worrying": -1.8,
+        "nervous": -1.4, "scared": -1.9, "afraid": -1.9, "fear": -2.2, "panic": -2.3, "panicked": -2.3,
+        "stressed": -1.8, "stress": -1.8, "stressful": -1.8, "overwhelmed": -1.7, "overthinking": -1.5,
+        "pressure": -1.2, "tense": -1.4, "uneasy": -1.6, "exam": -0.4, "exams": -0.4, "deadline": -0.6,
+        "deadlines": -0.6, "restless": -1.1, "insecure": -1.8,
+    },
+    "anger": {
+        "angry": -2.3, "mad": -2.2, "furious": -2.9, "annoyed": -1.6, "annoying": -1.7, "irritated": -1.8,
+        "frustrated": -2.0, "frustrating": -1.9, "hate": -2.7, "hated": -2.7, "unfair": -2.1,
+        "fight": -1.6, "fought": -1.6, "argued": -1.5, "argument": -1.5, "yelled": -1.9, "rude": -2.0,
+        "jealous": -2.0, "bullied": -2.6, "resent": -2.0,
+    },
+    "tiredness": {
+        "tired": -1.9, "exhausted": -2.1, "sleepy": -0.8, "drained": -1.8, "burnt": -1.8, "burnout": -2.0,
+        "fatigue": -1.6, "sick": -1.9, "ill": -1.8, "unwell": -1.7, "headache": -1.6, "pain": -2.3,
+        "insomnia": -1.8, "weak": -1.9, "bored": -1.3, "boring": -1.3,
+    },
+    None: {
+        "good": 1.9, "nice": 1.8, "well": 1.1, "productive": 1.7, "progress": 1.6, "success": 2.7,
+        "finished": 0.8, "passed": 1.4, "beautiful": 2.9, "excellent": 2.7, "perfect": 2.7, "yes": 1.2,
+        "bad": -2.5, "worse": -2.1, "worst": -3.1, "terrible": -2.5, "awful": -2.0, "horrible": -2.5,
+        "problem": -1.7, "problems": -1.7, "wrong": -2.1, "mess": -1.5, "hard": -0.4, "difficult": -1.5,
+        "tough": -0.5, "struggle": -1.9, "struggling": -2.0, "ugh": -1.8,
+    },
+}
+_NEGATORS = {"not", "no", "never", "nothing", "nobody", "none", "neither", "nor", "without", "hardly",
+             "cant", "cannot", "dont", "didnt", "wasnt", "isnt", "wont", "aint"}
+_BOOSTERS = {"very": 1.3, "really": 1.3, "so": 1.25, "extremely": 1.5, "super": 1.4, "too": 1.2,
+             "totally": 1.3, "incredibly": 1.4, "quite": 1.1, "kinda": 0.8, "slightly": 0.7,
+             "somewhat": 0.8, "little": 0.8, "bit": 0.8}
+
+_TOKEN = re.compile(r"[a-z]+(?:'[a-z]+)?|[.,;:!?]")
+
+# vocabulary: lexicon words, then negators/boosters (valence 0); two extra slots: unknown word, clause break
+_WORDS = [w for words in _LEXICON.values() for w in words]
+_INDEX = {w: i for i, w in enumerate(_WORDS)}
+for _w in sorted((_NEGATORS | set(_BOOSTERS)) - _INDEX.keys()):
+    _INDEX[_w] = len(_INDEX)
+_VALENCE = np.zeros(len(_INDEX) + 2, dtype=np.float32)
+_IS_NEG = np.zeros(len(_INDEX) + 2, dtype=bool)
+_BOOST = np.ones(len(_INDEX) + 2, dtype=np.float32)
+_EMOTION = np.full(len(_INDEX) + 2, -1, dtype=np.int8)
+for _emo, _words in _LEXICON.items():
+    for _w, _v in _words.items():
+        _VALENCE[_INDEX[_w]] = _v
+        if _emo is not None:
+            _EMOTION[_INDEX[_w]] = EMOTIONS.index(_emo)
+for _w in _NEGATORS:
+    _IS_NEG[_INDEX[_w]] = True
+for _w, _b in _BOOSTERS.items():
+    _BOOST[_INDEX[_w]] = _b
+_UNKNOWN = len(_INDEX)
+_BREAK = _UNKNOWN + 1  # clause punctuation: ends a negation / intensifier scope
+
+
+def _tokens(note: str) -> list[int]:
+    out = []
+    for t in _TOKEN.findall((note or "").lower()):
+        if t in ".,;:!?":
+            out.append(_BREAK)
+            continue
+        if t.endswith("n't"):
+            t = "not"
+        out.append(_INDEX.get(t.replace("'", ""), _UNKNOWN))
+    return out
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def score_batch(notes: list[str]) -> tuple[np.ndarray, list]:
+    """(sentiment array with NaN for empty notes, emotion label or None per note)."""
+    n = len(notes)
+    encoded = [_tokens(note) for note in notes]
+    lengths = np.fromiter((len(t) for t in encoded), dtype=np.int64, count=n)
+    if n == 0 or lengths.sum() == 0:
+        return np.full(n, np.nan, dtype=np.float32), [None] * n
+    ids = np.fromiter((i for t in encoded for i in t), dtype=np.int64, count=int(lengths.sum()))
+    doc = np.repeat(np.arange(n), lengths)
+    is_break = ids == _BREAK
+    starts = np.zeros(len(ids), dtype=bool)
+    starts[np.cumsum(lengths)[:-1][lengths[1:] > 0]] = True
+    clause = np.cumsum(is_break | starts)
+
+    # negators in the previous NEGATION_WINDOW tokens (same clause) flip; an intensifier right before scales
+    negated = np.zeros(len(ids), dtype=np.int8)
+    boost = np.ones(len(ids), dtype=np.float32)
+    for k in range(1, NEGATION_WINDOW + 1):
+        same = np.zeros(len(ids), dtype=bool)
+        same[k:] = clause[k:] == clause[:-k]
+        prev_neg = np.zeros(len(ids), dtype=bool)
+        prev_neg[k:] = _IS_NEG[ids[:-k]]
+        negated += (same & prev_neg).astype(np.int8)
+        if k == 1:
+            boost[1:] = np.where(same[1:], _BOOST[ids[:-1]], 1.0)
+    flip = negated % 2 == 1
+    val = _VALENCE[ids] * boost * np.where(flip, NEGATION_SCALE, 1.0)
+
+    raw = np.bincount(doc, weights=val, minlength=n)
+    sentiment = (raw / np.sqrt(raw * raw + ALPHA)).astype(np.float32)
+    words = np.bincount(doc, weights=~is_break, minlength=n)
+    sentiment[words == 0] = np.nan
+
+    emo = _EMOTION[ids]
+    hit = (emo >= 0) & ~flip
+    tally = np.zeros((n, len(EMOTIONS)), dtype=np.float32)
+    np.add.at(tally, (doc[hit], emo[hit]), np.abs(val[hit]))
+    top = tally.argmax(axis=1)
+    emotions = [EMOTIONS[top[i]] if tally[i, top[i]] > 0 else None for i in range(n)]
+    return sentiment, emotions
+
+
+def score(note: str) -> dict:
+    """{"sentiment": float | None, "emotion": str | None} for one note."""
+    s, e = score_batch([note])
+    return {"sentiment": None if np.isnan(s[0]) else round(float(s[0]), 3), "emotion": e[0]}
+
+
+def fields(note: str) -> dict:
+    """Mood-document fields for a note ({} when there is nothing to score)."""
+    if not (note or "").strip():
+        return {}
+    return score(note)
+
+
+def row_sentiments(rows: list[dict]) -> list:
+    """Stored sentiment per mood row; rows with a note but no score are scored in one batch."""
+    out = [r.get("sentiment") for r in rows]
+    todo = [i for i, r in enumerate(rows) if out[i] is None and (r.get("note") or "").strip()]
+    if todo:
+        s, _ = score_batch([rows[i]["note"] for i in todo])
+        for i, si in zip(todo, s):
+            out[i] = None if np.isnan(si) else round(float(si), 3)
+    return out
+
+
+# -----------------------------
+# Backfill
+# -----------------------------
+def backfill(db, user_id: str | None = None) -> int:
+    """Store sentiment/emotion on moods that have a note but no score. Returns documents updated."""
+    q = db.collection("moods")
+    if user_id:
+        q = q.where(filter=FieldFilter("user_id", "==", user_id))
+    docs = [(d.id, d.to_dict() or {}) for d in q.stream()]
+    todo = [(doc_id, m) for doc_id, m in docs if m.get("sentiment") is None and (m.get("note") or "").strip()]
+    updated = 0
+    for i in range(0, len(todo), BATCH_SIZE):
+        chunk = todo[i:i + BATCH_SIZE]
+        s, e = score_batch([m["note"] for _, m in chunk])
+        batch, n = db.batch(), 0
+        for (doc_id, _), si, ei in zip(chunk, s, e):
+            if si != si:  # NaN: nothing scoreable (punctuation / emoji only)
+                continue
+            batch.update(db.collection("moods").document(doc_id),
+                         {"sentiment": round(float(si), 3), "emotion": ei})
+            n += 1
+        if n:
+            batch.commit()
+        updated += n
+    return updated
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Local note sentiment")
+    p.add_argument("command", choices=["backfill", "score"])
+    p.add_argument("--user", default=None, help="only this user id (backfill)")
+    p.add_argument("text", nargs="*", help="note to score (score)")
+    args = p.parse_args(argv)
+
+    if args.command == "score":
+        print(score(" ".join(args.text)))
+        return 0
+    from utils.db import _client
+    n = backfill(_client(), args.user)
+    print(f"Scored {n} notes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,506 @@
+# utils/storage.py
+"""
+Interchangeable storage backends behind the small slice of the Firestore client API
+that utils/db.py uses (collection / where / order_by / limit / stream / on_snapshot,
+document get / set / update, add, batch, get_all).
+
+SERENITY_STORAGE:
+  firestore  production project via firebase_admin (default)
+  emulator   Firestore emulator at FIRESTORE_EMULATOR_HOST, no credentials needed
+  sqlite     embedded SQLite file (SERENITY_SQLITE_PATH), shared across processes
+  memory     in-process SQLite, gone when the process exits
+"""
+import os, json, time, sqlite3, datetime, threading
+
+from utils.writequeue import auto_id
+
+try:
+    from firebase_admin import firestore as _fb_firestore
+    SERVER_TIMESTAMP = _fb_firestore.SERVER_TIMESTAMP
+except Exception:
+    _fb_firestore = None
+    SERVER_TIMESTAMP = object()  # local stand-in sentinel
+
+try:
+    from google.cloud.firestore_v1 import FieldFilter
+except Exception:
+    class FieldFilter:
+        """Local stand-in with the same attributes as google.cloud.firestore_v1.FieldFilter."""
+        def __init__(self, field_path, op_string, value=None):
+            self.field_path = field_path
+            self.op_string = op_string
+            self.value = value
+
+BACKEND = os.getenv("SERENITY_STORAGE", "firestore").lower()
+SQLITE_PATH = os.getenv("SERENITY_SQLITE_PATH", os.path.join(".cache", "serenity.sqlite3"))
+EMULATOR_PROJECT = os.getenv("SERENITY_EMULATOR_PROJECT", "serenity-local")
+# simulated network round trip per query / get / commit on local backends
+LATENCY_S = float(os.getenv("SERENITY_STORAGE_LATENCY_MS", "0")) / 1000.0
+
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class NotFound(Exception):
+    """Raised by update() on a missing document, like google.api_core NotFound."""
+
+
+# -----------------------------
+# (de)serialization
+# -----------------------------
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _json_default(o):
+    if isinstance(o, datetime.datetime):
+        return {"__dt__": o.isoformat()}
+    if isinstance(o, datetime.date):
+        return o.isoformat()
+    raise TypeError(f"Not JSON serializable: {type(o).__name__}")
+
+
+def _json_hook(d):
+    if len(d) == 1 and "__dt__" in d:
+        return datetime.datetime.fromisoformat(d["__dt__"])
+    return d
+
+
+def _resolve_sentinels(data: dict) -> dict:
+    out = {}
+    for k, v in data.items():
+        if v is SERVER_TIMESTAMP:
+            v = _now()
+        elif isinstance(v, dict):
+            v = _resolve_sentinels(v)
+        out[k] = v
+    return out
+
+
+def _deep_merge(base: dict, patch: dict) -> dict:
+    out = dict(base)
+    for k, v in patch.items():
+        if isinstance(v, dict) and isinstance(out.get(k), dict):
+            out[k] = _deep_merge(out[k], v)
+        else:
+            out[k] = v
+    return out
+
+
+def _apply_update(base: dict, fields: dict) -> dict:
+    """Firestore update(): dotted keys address nested map fields."""
+    out = json.loads(json.dumps(base, default=_json_default), object_hook=_json_hook)
+    for path, v in fields.items():
+        node = out
+        parts = path.split(".")
+        for p in parts[:-1]:
+            node = node.setdefault(p, {})
+        node[parts[-1]] = v
+    return out
+
+
+# -----------------------------
+# Query semantics
+# -----------------------------
+def _match(value, op, target) -> bool:
+    try:
+        if op == "==":
+            return value == target
+        if op == "!=":
+            return value is not None and value != target
+        if value is None:
+            return False
+        if op == "<":
+            return value < target
+        if op == "<=":
+            return value <= target
+        if op == ">":
+            return value > target
+        if op == ">=":
+            return value >= target
+        if op == "in":
+            return value in target
+        if op == "not-in":
+            return value not in target
+        if op == "array_contains":
+            return isinstance(value, list) and target in value
+        if op == "array_contains_any":
+            return isinstance(value, list) and any(t in value for t in target)
+    except TypeError:
+        return False  # Firestore never matches across types
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+def _get_path(doc: dict, path: str):
+    node = doc
+    for p in path.split("."):
+        if not isinstance(node, dict) or p not in node:
+            return None
+        node = node[p]
+    return node
+
+
+class LocalSnapshot:
+    def __init__(self, doc_id, data, reference=None):
+        self.id = doc_id
+        self._data = data
+        self.reference = reference
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return None if self._data is None else dict(self._data)
+
+    def get(self, field):
+        return _get_path(self._data or {}, field)
+
+
+class LocalQuery:
+    def __init__(self, client, collection, filters=(), orders=(), limit_n=None):
+        self._client = client
+        self._collection = collection
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit_n
+
+    def _copy(self, **kw):
+        q = LocalQuery(self._client, self._collection, self._filters, self._orders, self._limit)
+        for k, v in kw.items():
+            setattr(q, k, v)
+        return q
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        f = filter or FieldFilter(field_path, op_string, value)
+        return self._copy(_filters=self._filters + [(f.field_path, f.op_string, f.value)])
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(_orders=self._orders + [(field_path, direction)])
+
+    def limit(self, n):
+        return self._copy(_limit=n)
+
+    def stream(self):
+        if LATENCY_S:
+            time.sleep(LATENCY_S)
+        # user_id equality is answered by the SQL index; everything else in Python
+        user_eq = next((v for f, op, v in self._filters if f == "user_id" and op == "=="), None)
+        rows = self._client._select(self._collection, user_eq)
+        docs = [(doc_id, d) for doc_id, d in rows
+                if all(_match(_get_path(d, f), op, v) for f, op, v in self._filters)]
+        for field, direction in reversed(self._orders):
+            docs = [x for x in docs if _get_path(x[1], field) is not None]  # Firestore drops missing fields
+            docs.sort(key=lambda x: _get_path(x[1], field),
+                      reverse=(str(direction).upper().endswith("DESCENDING")))
+        if self._limit is not None:
+            docs = docs[: self._limit]
+        self._client._count_reads(len(docs))
+        for doc_id, d in docs:
+            yield LocalSnapshot(doc_id, d, LocalDocument(self._client, self._collection, doc_id))
+
+    def get(self):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        """Like Query.on_snapshot: callback(docs, changes, read_time) now, then from a background
+        thread after each commit that touched a matching user_id."""
+        return self._client._watch(self, callback)
+
+
+class _ChangeType:
+    def __init__(self, name):
+        self.name = name
+
+
+class LocalChange:
+    """Same shape as firestore DocumentChange (type.name, document)."""
+
+    def __init__(self, kind, document):
+        self.type = _ChangeType(kind)
+        self.document = document
+
+
+def _uid(d: dict):
+    uid = d.get("user_id")
+    return uid if isinstance(uid, str) else None
+
+
+class LocalWatch:
+    def __init__(self, client, query, callback):
+        self._client = client
+        self._query = query
+        self._callback = callback
+        self._seen = {}  # doc id -> data last delivered
+        self._user = next((v for f, op, v in query._filters if f == "user_id" and op == "=="), None)
+        self.is_active = True  # False once the listener failed, like a closed firestore Watch
+
+    def _affected_by(self, touched) -> bool:
+        """touched: {(collection, user_id)} written by one commit (user_id None = unknown)."""
+        c = self._query._collection
+        return ((c, None) in touched or (self._user is None and any(t[0] == c for t in touched))
+                or (c, self._user) in touched)
+
+    def _fire(self):
+        docs = list(self._query.stream())
+        now = {d.id: d.to_dict() for d in docs}
+        changes = [LocalChange("ADDED" if d.id not in self._seen else "MODIFIED", d)
+                   for d in docs if self._seen.get(d.id) != now[d.id]]
+        changes += [LocalChange("REMOVED", LocalSnapshot(doc_id, data))
+                    for doc_id, data in self._seen.items() if doc_id not in now]
+        self._seen = now
+        if changes or not docs:
+            self._callback(docs, changes, _now())
+
+    def unsubscribe(self):
+        self.is_active = False
+        self._client._unwatch(self)
+
+
+class LocalDocument:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self):
+        if LATENCY_S:
+            time.sleep(LATENCY_S)
+        data = self._client._load(self._collection, self.id)
+        self._client._count_reads(1)
+        return LocalSnapshot(self.id, data, self)
+
+    def set(self, data, merge=False):
+        self._client._apply([("set", self._collection, self.id, data, merge)])
+
+    def update(self, fields):
+        self._client._apply([("update", self._collection, self.id, fields, False)])
+
+    def delete(self):
+        self._client._apply([("delete", self._collection, self.id, None, False)])
+
+
+class LocalCollection(LocalQuery):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+
+    def document(self, doc_id=None):
+        return LocalDocument(self._client, self._collection, doc_id or auto_id())
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return _now(), ref
+
+
+class LocalBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, ref, data, merge=False):
+        self._ops.append(("set", ref._collection, ref.id, data, merge))
+
+    def update(self, ref, fields):
+        self._ops.append(("update", ref._collection, ref.id, fields, False))
+
+    def delete(self, ref):
+        self._ops.append(("delete", ref._collection, ref.id, None, False))
+
+    def commit(self):
+        self._client._apply(self._ops)
+        self._ops = []
+
+
+class LocalClient:
+    """SQLite-backed stand-in for firestore.Client (file or :memory:)."""
+
+    def __init__(self, path=":memory:"):
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS docs (
+            collection TEXT NOT NULL, id TEXT NOT NULL, user_id TEXT, data TEXT NOT NULL,
+            PRIMARY KEY (collection, id))""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS docs_user ON docs (collection, user_id)")
+        self.reads = 0
+        self.writes = 0
+        self._watches = []
+        self._dirty = []  # watches waiting for the dispatcher thread
+        self._dirty_event = threading.Event()
+        self._dispatcher = None
+
+    # Firestore-shaped surface
+    def collection(self, name):
+        return LocalCollection(self, name)
+
+    def batch(self):
+        return LocalBatch(self)
+
+    def bulk_writer(self):
+        return LocalBulkWriter(self)
+
+    def get_all(self, references):
+        """Like Client.get_all: several documents in one round trip."""
+        refs = list(references)
+        if LATENCY_S and refs:
+            time.sleep(LATENCY_S)
+        self._count_reads(len(refs))
+        for ref in refs:
+            yield LocalSnapshot(ref.id, self._load(ref._collection, ref.id), ref)
+
+    # internals
+    def _count_reads(self, n):
+        self.reads += n
+
+    def _select(self, collection, user_id=None):
+        with self._lock:
+            if user_id is None:
+                cur = self._conn.execute("SELECT id, data FROM docs WHERE collection = ?", (collection,))
+            else:
+                cur = self._conn.execute("SELECT id, data FROM docs WHERE collection = ? AND user_id = ?",
+                                         (collection, user_id))
+            return [(doc_id, json.loads(raw, object_hook=_json_hook)) for doc_id, raw in cur.fetchall()]
+
+    def _load(self, collection, doc_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM docs WHERE collection = ? AND id = ?",
+                                     (collection, doc_id)).fetchone()
+        return json.loads(row[0], object_hook=_json_hook) if row else None
+
+    def _watch(self, query, callback):
+        w = LocalWatch(self, query, callback)
+        with self._lock:
+            self._watches.append(w)
+        w._fire()  # initial snapshot, like Firestore
+        return w
+
+    def _unwatch(self, w):
+        with self._lock:
+            if w in self._watches:
+                self._watches.remove(w)
+
+    def _notify(self, touched):
+        """Queue the watches this commit can affect; the writer does not wait for them."""
+        with self._lock:
+            for w in self._watches:
+                if w not in self._dirty and w._affected_by(touched):
+                    self._dirty.append(w)
+            if not self._dirty:
+                return
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name="local-watch", daemon=True)
+                self._dispatcher.start()
+        self._dirty_event.set()
+
+    def _dispatch(self):
+        while True:
+            self._dirty_event.wait()
+            self._dirty_event.clear()
+            with self._lock:
+                watches, self._dirty = self._dirty, []
+            for w in watches:
+                if not w.is_active:
+                    continue
+                try:
+                    w._fire()
+                except Exception:
+                    w.unsubscribe()  # a broken listener stops, like Firestore's; owners check is_active
+
+    def _apply(self, ops):
+        if LATENCY_S:
+            time.sleep(LATENCY_S)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            touched = set()  # (collection, user_id) pairs, for _notify
+            try:
+                for kind, collection, doc_id, data, merge in ops:
+                    current = self._load(collection, doc_id)
+                    if current is not None:
+                        touched.add((collection, _uid(current)))
+                    if kind == "delete":
+                        self._conn.execute("DELETE FROM docs WHERE collection = ? AND id = ?", (collection, doc_id))
+                        continue
+                    data = _resolve_sentinels(data)
+                    if kind == "update":
+                        if current is None:
+                            raise NotFound(f"No document to update: {collection}/{doc_id}")
+                        new = _apply_update(current, data)
+                    elif merge and current is not None:
+                        new = _deep_merge(current, data)
+                    else:
+                        new = data
+                    uid = _uid(new)
+                    touched.add((collection, uid))
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO docs (collection, id, user_id, data) VALUES (?,?,?,?)",
+                        (collection, doc_id, uid, json.dumps(new, default=_json_default)),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.writes += len(ops)
+        if self._watches:
+            self._notify(touched)
+
+
+class LocalBulkWriter:
+    """Mirrors firestore BulkWriter: queue writes, flush in 500-op transactions."""
+
+    def __init__(self, client):
+        self._client = client
+        self._batch = LocalBatch(client)
+
+    def set(self, ref, data, merge=False):
+        self._batch.set(ref, data, merge=merge)
+        if len(self._batch._ops) >= 500:
+            self.flush()
+
+    def update(self, ref, fields):
+        self._batch.update(ref, fields)
+        if len(self._batch._ops) >= 500:
+            self.flush()
+
+    def flush(self):
+        self._batch.commit()
+
+    def close(self):
+        self.flush()
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def client(backend: str | None = None):
+    """Client for a non-production backend (emulator / sqlite / memory), cached per process."""
+    name = (backend or BACKEND).lower()
+    with _clients_lock:
+        if name in _clients:
+            return _clients[name]
+        if name == "memory":
+            c = LocalClient(":memory:")
+        elif name == "sqlite":
+            c = LocalClient(SQLITE_PATH)
+        elif name == "emulator":
+            if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+                raise RuntimeError("SERENITY_STORAGE=emulator needs FIRESTORE_EMULATOR_HOST (e.g. localhost:8080).")
+            from google.auth.credentials import AnonymousCredentials
+            from google.cloud import firestore as gc_firestore
+            c = gc_firestore.Client(project=EMULATOR_PROJECT, credentials=AnonymousCredentials())
+        else:
+            raise ValueError(f"Unknown storage backend: {name}")
+        _clients[name] = c
+        return c
+
+
+def reset(backend: str | None = None):
+    """Drop a cached local client (fresh in-memory DB for benchmarks/tests)."""
+    with _clients_lock:
+        _clients.pop((backend or BACKEND).lower(), None)
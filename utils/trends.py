@@ -0,0 +1,179 @@
+# utils/trends.py
+"""
+Online mood-trend detector, updated on every log_mood with O(1) state per user.
+
+Works on daily average scores (1-5). Per user, trends/{user_id} keeps:
+  mean / var   EWMA of the daily score and its exponentially weighted variance
+  base         slow EWMA: the user's own "normal"
+  cusum        lower CUSUM of (base - day - SLACK): grows while days sit below normal
+  low_run      low days (avg <= LOW_SCORE) on consecutive calendar days; a day
+               without entries resets it
+plus today's running sum/count, so several entries on one day count as one
+day. A sustained decline (CUSUM over CUSUM_H with the short EWMA clearly under
+base, or LOW_RUN_DAYS low days in a row) sets `alert`. The app shows a gentle
+check-in until the user acknowledges it, and the flag clears once days recover.
+The latest numbers are also merged into daily_reports/{user_id}_{day}.trend.
+Nothing is ever recomputed from history; out-of-order (backdated) days are skipped.
+
+Updates are read-modify-write, so they run under a per-user lock (plus a short
+lease in the shared cache when several replicas share Redis) and write the
+new state through to the cache before releasing it.
+"""
+import os, time, datetime, threading, contextlib
+
+from utils import cache
+
+COLLECTION = "trends"
+FAST_ALPHA = float(os.getenv("SERENITY_TREND_ALPHA", "0.3"))
+BASE_ALPHA = 0.05
+SLACK = 0.5          # CUSUM allowance, score points per day
+CUSUM_H = float(os.getenv("SERENITY_TREND_CUSUM_H", "3.0"))  # decision threshold
+DROP = 0.5           # short EWMA must sit this far under base
+LOW_SCORE = 2.5
+LOW_RUN_DAYS = int(os.getenv("SERENITY_TREND_LOW_DAYS", "3"))
+MIN_DAYS = 5         # CUSUM needs a baseline first
+CACHE_TTL_S = 24 * 3600
+LEASE_S = 10         # cross-replica lease; expires on its own if a holder dies
+
+_locks: dict = {}  # user_id -> threading.Lock
+_locks_lock = threading.Lock()
+
+
+def _empty(user_id: str) -> dict:
+    return {"user_id": user_id, "n": 0, "mean": None, "var": 0.0, "base": None, "cusum": 0.0,
+            "low_run": 0, "folded_day": None, "last_day": None, "day_sum": 0.0, "day_n": 0,
+            "alert": False, "alert_since": None, "ack": None}
+
+
+def _gap(a: str | None, b: str) -> int:
+    if not a:
+        return 0
+    return (datetime.date.fromisoformat(b) - datetime.date.fromisoformat(a)).days
+
+
+# -----------------------------
+# Pure updates
+# -----------------------------
+def fold(state: dict, day: str, x: float) -> dict:
+    """State after one more completed day with average score x."""
+    s = dict(state)
+    if s["n"] == 0:
+        s.update(mean=x, base=x, var=0.0)
+    else:
+        d = x - s["mean"]
+        s["mean"] += FAST_ALPHA * d
+        s["var"] = (1 - FAST_ALPHA) * (s["var"] + FAST_ALPHA * d * d)
+        s["cusum"] = max(0.0, s["cusum"] + (s["base"] - x) - SLACK)
+        s["base"] += BASE_ALPHA * (x - s["base"])
+    if _gap(s["folded_day"], day) > 1:
+        s["low_run"] = 0  # skipped a day: no longer "in a row"
+    s["low_run"] = s["low_run"] + 1 if x <= LOW_SCORE else 0
+    s["n"] += 1
+    s["folded_day"] = day
+    return s
+
+
+def declining(s: dict) -> bool:
+    if s["low_run"] >= LOW_RUN_DAYS:
+        return True
+    return (s["n"] >= MIN_DAYS and s["cusum"] > CUSUM_H
+            and s["mean"] is not None and s["mean"] < s["base"] - DROP)
+
+
+def observe(state: dict, day: str, score: float) -> dict:
+    """Add one mood entry; closes the previous day first. Returns the new state."""
+    s = dict(state)
+    if s["last_day"] and day < s["last_day"]:
+        return s  # backdated entry: no rescans
+    if day != s["last_day"]:
+        if s["day_n"]:
+            s = fold(s, s["last_day"], s["day_sum"] / s["day_n"])
+        s.update(last_day=day, day_sum=0.0, day_n=0)
+    s["day_sum"] += score
+    s["day_n"] += 1
+
+    view = current(s)
+    if declining(view):
+        if not s["alert"]:
+            s.update(alert=True, alert_since=day, ack=None)
+    elif s["alert"] and view["mean"] is not None and view["mean"] >= view["base"] - DROP / 2 and view["low_run"] == 0:
+        s.update(alert=False, alert_since=None)
+    return s
+
+
+def current(s: dict) -> dict:
+    """Committed state with today's partial average folded in (not persisted)."""
+    return fold(s, s["last_day"], s["day_sum"] / s["day_n"]) if s["day_n"] else s
+
+
+def report_fields(s: dict) -> dict:
+    v = current(s)
+    r = lambda x: None if x is None else round(x, 3)
+    return {"ewma": r(v["mean"]), "std": r(v["var"] ** 0.5), "baseline": r(v["base"]),
+            "cusum": r(v["cusum"]), "low_run": v["low_run"], "alert": s["alert"]}
+
+
+# -----------------------------
+# Persistence (cache first, then trends/{user_id})
+# -----------------------------
+def load(user_id: str) -> dict:
+    from utils.db import get_trend_state
+    ns = cache.user_ns(user_id, "trend")
+    s = cache.get(ns, "state")
+    if s is None:
+        s = get_trend_state(user_id) or _empty(user_id)
+        cache.set(ns, "state", s, ttl=CACHE_TTL_S)  # also the empty state: no read per rerun for new users
+    return {**_empty(user_id), **s}
+
+
+@contextlib.contextmanager
+def _locked(user_id: str):
+    """Serialize load -> update -> save for one user (this process, then across replicas)."""
+    with _locks_lock:
+        lock = _locks.setdefault(user_id, threading.Lock())
+    with lock:
+        ns, held = cache.user_ns(user_id, "trend"), False
+        if cache.shared():
+            deadline = time.monotonic() + LEASE_S
+            while True:
+                n = cache.incr(ns, "lease", ttl=LEASE_S)
+                if n is None or n == 1 or time.monotonic() > deadline:
+                    held = n == 1  # cache down / stuck lease: go ahead unguarded
+                    break
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if held:
+                cache.delete(ns, "lease")
+
+
+def save(user_id: str, s: dict):
+    from utils.db import put_trend_state
+    cache.set(cache.user_ns(user_id, "trend"), "state", s, ttl=CACHE_TTL_S)
+    put_trend_state(user_id, s, report_day=s["last_day"], report_trend=report_fields(s))
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def record(user_id: str, day: str, score: float) -> dict:
+    """Called from log_mood: one O(1) update + one merged write."""
+    with _locked(user_id):
+        s = observe(load(user_id), day, score)
+        save(user_id, s)
+    return s
+
+
+def check_in_due(user_id: str) -> bool:
+    """True while a decline is flagged and the user hasn't acknowledged it."""
+    s = load(user_id)
+    return bool(s["alert"]) and s["ack"] != s["alert_since"]
+
+
+def acknowledge(user_id: str):
+    with _locked(user_id):
+        s = load(user_id)
+        if s["alert"]:
+            s["ack"] = s["alert_since"]
+            save(user_id, s)
@@ -0,0 +1,237 @@
+# utils/tts.py
+import os, io, glob, time, shutil, hashlib, tempfile, threading, subprocess
+
+# optional engines
+try:
+    from gtts import gTTS
+except Exception:
+    gTTS = None  # network engine (Google Translate TTS)
+
+try:
+    import pyttsx3
+except Exception:
+    pyttsx3 = None  # offline engine (espeak / sapi5 / nsss)
+
+CACHE_DIR = os.getenv("SERENITY_TTS_CACHE_DIR", os.path.join(".cache", "tts"))
+CACHE_MAX_BYTES = int(float(os.getenv("SERENITY_TTS_CACHE_MB", "64")) * 1024 * 1024)
+DEFAULT_BACKEND = os.getenv("SERENITY_TTS_BACKEND", "auto")
+PRERENDER = os.getenv("SERENITY_TTS_PRERENDER", "1") == "1"
+
+BREATHING_CUES = ["Inhale…", "Hold…", "Exhale…"]
+# also the offline fallback for generate_affirmation (utils/ai.py)
+AFFIRMATION_PHRASES = [
+    "You are doing better than you think.",
+    "One slow breath at a time.",
+    "It's okay to take a break.",
+    "It's okay to rest; you're still growing.",
+    "You deserve kindness, especially from yourself.",
+    "Small steps today still count.",
+]
+
+BACKEND_RETRY_S = 300  # an engine that raised is tried last for this long (e.g. pyttsx3 without a driver)
+
+_lock = threading.Lock()
+_failed_at = {}  # backend -> time.monotonic() of its last failure
+_pyttsx3_lock = threading.Lock()  # pyttsx3 engines aren't thread-safe
+_prerender_started = False
+
+
+# -----------------------------
+# Backends: fn(text, voice) -> (bytes, mime)
+# -----------------------------
+def _gtts_backend(text: str, voice: str | None):
+    if gTTS is None:
+        raise RuntimeError("gTTS not installed")
+    buf = io.BytesIO()
+    gTTS(text, lang=voice or "en").write_to_fp(buf)
+    return buf.getvalue(), "audio/mpeg"
+
+
+def _pyttsx3_backend(text: str, voice: str | None):
+    if pyttsx3 is None:
+        raise RuntimeError("pyttsx3 not installed")
+    with _pyttsx3_lock, tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "out.wav")
+        engine = pyttsx3.init()
+        if voice:
+            engine.setProperty("voice", voice)
+        engine.save_to_file(text, path)
+        engine.runAndWait()
+        with open(path, "rb") as f:
+            return f.read(), "audio/wav"
+
+
+def _espeak_backend(text: str, voice: str | None):
+    exe = shutil.which("espeak-ng") or shutil.which("espeak")
+    if exe is None:
+        raise RuntimeError("espeak not installed")
+    cmd = [exe, "--stdout"] + (["-v", voice] if voice else []) + [text]
+    return subprocess.run(cmd, capture_output=True, check=True, timeout=30).stdout, "audio/wav"
+
+
+_BACKENDS = {
+    "pyttsx3": _pyttsx3_backend,
+    "espeak": _espeak_backend,
+    "gtts": _gtts_backend,
+}
+
+
+def register_backend(name: str, fn):
+    """Plug in another engine: fn(text, voice) -> (audio_bytes, mime_type)."""
+    _BACKENDS[name] = fn
+
+
+def available_backends() -> list[str]:
+    out = []
+    if pyttsx3 is not None:
+        out.append("pyttsx3")
+    if shutil.which("espeak-ng") or shutil.which("espeak"):
+        out.append("espeak")
+    if gTTS is not None:
+        out.append("gtts")
+    out += [b for b in _BACKENDS if b not in ("pyttsx3", "espeak", "gtts")]
+    return out
+
+
+def _resolve_backends(backend: str | None) -> list[str]:
+    """Engines to try in order: the named one, or (auto) every available one, offline first."""
+    name = backend or DEFAULT_BACKEND
+    if name != "auto":
+        return [name]
+    avail = available_backends()
+    if not avail:
+        raise RuntimeError("No text-to-speech engine available (install pyttsx3, espeak-ng or gTTS).")
+    now = time.monotonic()
+    up = [b for b in avail if now - _failed_at.get(b, -BACKEND_RETRY_S) >= BACKEND_RETRY_S]
+    return up + [b for b in avail if b not in up]  # recently failing engines go last
+
+
+# -----------------------------
+# Disk cache (LRU by mtime)
+# -----------------------------
+_EXT = {"audio/mpeg": "mp3", "audio/wav": "wav", "audio/ogg": "ogg"}
+_MIME = {v: k for k, v in _EXT.items()}
+
+
+def _cache_key(text: str, voice: str | None, backend: str) -> str:
+    return hashlib.sha256(f"{backend}|{voice or ''}|{text}".encode("utf-8")).hexdigest()
+
+
+def _cache_lookup(key: str):
+    for path in glob.glob(os.path.join(CACHE_DIR, key + ".*")):
+        if path.rsplit(".", 1)[-1] not in _MIME:
+            continue
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # mark as recently used
+        except OSError:
+            continue
+        return data, _MIME.get(path.rsplit(".", 1)[-1], "audio/wav")
+    return None
+
+
+def _evict():
+    files = []
+    for path in glob.glob(os.path.join(CACHE_DIR, "*.*")):
+        try:
+            stt = os.stat(path)
+        except OSError:
+            continue
+        files.append((stt.st_mtime, stt.st_size, path))
+    total = sum(f[1] for f in files)
+    for _, size, path in sorted(files):
+        if total <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def _cache_store(key: str, data: bytes, mime: str):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, f"{key}.{_EXT.get(mime, 'wav')}")
+    # dot-prefixed: glob's "*" skips it, so lookups/eviction never see a half-written file
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    with _lock:
+        _evict()
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def synthesize(text: str, voice: str | None = None, backend: str | None = None):
+    """Returns (audio_bytes, mime_type); cached on disk by text+voice+engine.
+
+    In auto mode an engine that raises falls through to the next available one."""
+    text = (text or "").strip()
+    if not text:
+        return b"", "audio/wav"
+    names = _resolve_backends(backend)
+    hit = _cached(text, voice, names)
+    if hit is not None:
+        return hit
+    for i, name in enumerate(names):
+        try:
+            data, mime = _BACKENDS[name](text, voice)
+        except Exception:
+            _failed_at[name] = time.monotonic()
+            if i == len(names) - 1:
+                raise
+            continue
+        _failed_at.pop(name, None)
+        _cache_store(_cache_key(text, voice, name), data, mime)  # under the engine that produced it
+        return data, mime
+
+
+def _cached(text: str, voice: str | None, names: list[str]):
+    for name in names:
+        hit = _cache_lookup(_cache_key(text, voice, name))
+        if hit is not None:
+            return hit
+    return None
+
+
+def prerender_phrases(phrases=None, voice: str | None = None, backend: str | None = None) -> int:
+    """Render fixed breathing cues and affirmations into the cache. Returns how many were synthesized."""
+    rendered = 0
+    for text in (phrases or BREATHING_CUES + AFFIRMATION_PHRASES):
+        try:
+            if _cached(text, voice, _resolve_backends(backend)) is None:
+                synthesize(text, voice=voice, backend=backend)
+                rendered += 1
+        except Exception:
+            pass  # no engine / offline: playback will simply be skipped
+    return rendered
+
+
+def _claim_prerender() -> bool:
+    global _prerender_started
+    with _lock:
+        if _prerender_started or not PRERENDER:
+            return False
+        _prerender_started = True
+    return True
+
+
+def prerender_once() -> int:
+    """prerender_phrases() unless this process already started it (warmup step)."""
+    return prerender_phrases() if _claim_prerender() else 0
+
+
+def start_prerender():
+    """Kick off phrase pre-rendering once per process, in the background."""
+    if _claim_prerender():
+        threading.Thread(target=prerender_phrases, name="tts-prerender", daemon=True).start()
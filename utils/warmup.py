@@ -0,0 +1,184 @@
+# utils/warmup.py
+"""
+Process warmup + readiness probe.
+
+Pays the one-off startup costs (Firebase Admin init and credential parsing, the
+Firestore gRPC channel, genai model objects, Plotly's first figure, TTS phrases)
+in the server process before it takes traffic, instead of inside the first
+user's rerun.
+
+    python -m utils.warmup app.py [streamlit args]   # warm, then start Streamlit in this process
+
+With SERENITY_READY_PORT set, GET /ready answers 503 until every step has run
+(and, with SERENITY_WARMUP_STRICT=1, succeeded), then 200; /healthz is always
+200. Point the load balancer / autoscaler readiness check at /ready. The probe
+listens on SERENITY_BIND_HOST (127.0.0.1 by default; 0.0.0.0 for an external LB).
+Plain `streamlit run app.py` still warms, but only when the first session starts.
+"""
+import os, sys, json, time, threading
+
+from utils import metrics
+
+READY_PORT = int(os.getenv("SERENITY_READY_PORT", "0") or 0)
+BIND_HOST = os.getenv("SERENITY_BIND_HOST", "127.0.0.1")  # 0.0.0.0 for an external load balancer
+STRICT = os.getenv("SERENITY_WARMUP_STRICT", "0") == "1"
+PRIME_AFFIRMATIONS = os.getenv("SERENITY_WARMUP_AFFIRMATIONS", "0") == "1"  # spends LLM quota
+
+_lock = threading.Lock()
+_started = False
+_done = threading.Event()
+_results: dict = {}  # step -> {"ms", "ok", "error"}
+_probe = None
+
+
+# -----------------------------
+# Steps: fn() -> None, run in order
+# -----------------------------
+def _warm_storage():
+    from utils import db
+    client = db._client()  # firebase_admin.initialize_app + credential parsing
+    client.collection("_warmup").document("ping").get()  # opens the channel; missing doc is fine
+
+
+def _warm_genai():
+    from utils import ai, router
+    if ai.genai is None or ai.LLM_BACKEND == "stub":
+        return
+    for tier in router.MODEL_TIERS.values():
+        ai.genai.GenerativeModel(tier["model"])
+    if os.getenv("GOOGLE_API_KEY"):
+        next(iter(ai.genai.list_models()), None)  # opens the shared client channel; no generation quota
+
+
+def _warm_plotly():
+    import pandas as pd
+    import plotly.express as px
+    df = pd.DataFrame({"x": [0, 1], "y": [0, 1]})
+    px.line(df, x="x", y="y").to_json()  # loads validators/templates
+
+
+def _warm_tts():
+    from utils import tts
+    tts.prerender_once()  # shares the once-per-process flag with tts.start_prerender()
+
+
+def _warm_affirmations():
+    from utils import affirmations
+    if affirmations.load_table() or not PRIME_AFFIRMATIONS:
+        return  # pooled table loaded (utils/affirmations.py)
+    from utils import ai
+    ai.generate_affirmation("no prior mood data")  # the cold-start hint every new user sends
+
+
+_STEPS = [
+    ("storage", _warm_storage),
+    ("genai", _warm_genai),
+    ("plotly", _warm_plotly),
+    ("tts", _warm_tts),
+    ("affirmations", _warm_affirmations),
+]
+
+
+def register_step(name: str, fn):
+    """Add a warmup step (runs after the built-in ones): fn() -> None."""
+    _STEPS.append((name, fn))
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def run() -> dict:
+    """Run every step once (idempotent per process). Returns per-step timings."""
+    global _started
+    with _lock:
+        if _started:
+            wait = True
+        else:
+            _started, wait = True, False
+    if wait:
+        _done.wait()
+        return status()
+    for name, fn in list(_STEPS):
+        t0 = time.perf_counter()
+        try:
+            with metrics.track("warmup", name):
+                fn()
+            _results[name] = {"ok": True}
+        except Exception as e:
+            _results[name] = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        _results[name]["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    _done.set()
+    metrics.set_gauge("warm", 1)
+    return status()
+
+
+def start():
+    """Warm in the background (no-op if already started) and open the readiness probe."""
+    serve_probe()
+    with _lock:
+        if _started:
+            return
+    threading.Thread(target=run, name="warmup", daemon=True).start()
+
+
+def ready() -> bool:
+    if not _done.is_set():
+        return False
+    return not STRICT or all(r["ok"] for r in _results.values())
+
+
+def status() -> dict:
+    return {"ready": ready(), "done": _done.is_set(), "steps": dict(_results)}
+
+
+def serve_probe(port: int | None = None):
+    """/ready and /healthz on SERENITY_READY_PORT (once per process)."""
+    global _probe
+    port = port or READY_PORT
+    if not port or _probe is not None:
+        return
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/healthz"):
+                code, body = 200, {"alive": True}
+            elif self.path.startswith("/ready"):
+                body = status()
+                code = 200 if body["ready"] else 503
+            else:
+                code, body = 404, {}
+            raw = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        _probe = ThreadingHTTPServer((BIND_HOST, port), _Handler)
+    except OSError:
+        return  # already bound by this server
+    threading.Thread(target=_probe.serve_forever, name="readiness-probe", daemon=True).start()
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv:
+        print("usage: python -m utils.warmup app.py [streamlit args]")
+        return 2
+    serve_probe()
+    for name, r in run()["steps"].items():
+        print(f"[warmup] {name}: {'ok' if r['ok'] else r['error']} ({r['ms']} ms)")
+
+    from streamlit.web import cli as stcli
+    sys.argv = ["streamlit", "run", *argv]
+    return stcli.main()
+
+
+if __name__ == "__main__":
+    from utils.warmup import main as _main  # share state with `from utils import warmup` in app.py
+    sys.exit(_main())
@@ -0,0 +1,299 @@
+# utils/writequeue.py
+"""
+Write-behind queue for Firestore.
+
+Writes are journaled to a local SQLite file, acknowledged immediately, and
+flushed by a background worker in WriteBatches (max 500 ops). Anything left in
+the journal (crash / restart) is replayed when the worker starts again.
+Until a write is flushed, reads can overlay it via pending().
+
+If a batch commit fails, its ops are retried one at a time so a single bad op
+(e.g. update on a deleted doc) can't block everyone else's writes. Ops that
+fail permanently, or MAX_ATTEMPTS times, move to the dead_ops table.
+"""
+import os, json, time, sqlite3, string, secrets, datetime, threading, atexit
+
+from utils import metrics
+
+ENABLED = os.getenv("SERENITY_WRITE_BEHIND", "0") == "1"
+JOURNAL_PATH = os.getenv("SERENITY_WRITE_JOURNAL", os.path.join(".cache", "write_journal.sqlite3"))
+FLUSH_INTERVAL_S = float(os.getenv("SERENITY_WRITE_FLUSH_S", "0.5"))
+COALESCE_S = float(os.getenv("SERENITY_WRITE_COALESCE_MS", "50")) / 1000.0
+MAX_BATCH = 500  # Firestore WriteBatch limit
+MAX_ATTEMPTS = int(os.getenv("SERENITY_WRITE_MAX_ATTEMPTS", "5"))
+
+# Retried later without counting an attempt (offline / Firestore down); any OSError counts too
+_TRANSIENT = {"ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "ResourceExhausted",
+              "Aborted", "RetryError", "TooManyRequests", "GatewayTimeout", "BadGateway"}
+# Will never succeed: dead-lettered straight away
+_PERMANENT = {"NotFound", "InvalidArgument", "FailedPrecondition", "PermissionDenied", "AlreadyExists",
+              "OutOfRange", "BadRequest", "Forbidden", "ValueError", "TypeError"}
+
+_SERVER_TS = {"__server_ts__": True}  # journal-safe stand-in for firestore.SERVER_TIMESTAMP
+_AUTO_ID_CHARS = string.ascii_letters + string.digits
+
+_lock = threading.RLock()
+_flush_lock = threading.Lock()  # worker and flush() must not commit the same rows twice
+_wake = threading.Event()
+_conn = None
+_worker = None
+_client_factory = None
+_server_timestamp = None
+_pending = {}  # (collection, doc_id) -> {"seq", "user_id", "kind", "data"}
+
+
+def enabled() -> bool:
+    return ENABLED
+
+
+def auto_id() -> str:
+    """Firestore-style 20 char document id, generated client-side."""
+    return "".join(secrets.choice(_AUTO_ID_CHARS) for _ in range(20))
+
+
+# -----------------------------
+# Journal
+# -----------------------------
+def _db():
+    global _conn
+    if _conn is None:
+        d = os.path.dirname(JOURNAL_PATH)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        _conn = sqlite3.connect(JOURNAL_PATH, check_same_thread=False, isolation_level=None)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""CREATE TABLE IF NOT EXISTS ops (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            collection TEXT NOT NULL, doc_id TEXT NOT NULL, user_id TEXT,
+            kind TEXT NOT NULL, merge INTEGER NOT NULL DEFAULT 0, data TEXT NOT NULL)""")
+        if "attempts" not in {r[1] for r in _conn.execute("PRAGMA table_info(ops)")}:
+            _conn.execute("ALTER TABLE ops ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        _conn.execute("""CREATE TABLE IF NOT EXISTS dead_ops (
+            seq INTEGER PRIMARY KEY, collection TEXT NOT NULL, doc_id TEXT NOT NULL, user_id TEXT,
+            kind TEXT NOT NULL, merge INTEGER NOT NULL, data TEXT NOT NULL,
+            error TEXT, attempts INTEGER NOT NULL, failed_at REAL NOT NULL)""")
+    return _conn
+
+
+def _swap(value, is_sentinel, replacement):
+    """Replace sentinels at any depth (nested maps / arrays too)."""
+    if is_sentinel(value):
+        return replacement
+    if isinstance(value, dict):
+        return {k: _swap(v, is_sentinel, replacement) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_swap(v, is_sentinel, replacement) for v in value]
+    return value
+
+
+def _encode(data: dict, server_timestamp) -> str:
+    return json.dumps(_swap(data, lambda v: v is server_timestamp, _SERVER_TS))
+
+
+def _decode(raw: str, server_timestamp) -> dict:
+    return _swap(json.loads(raw), lambda v: v == _SERVER_TS, server_timestamp)
+
+
+def _transient(e: Exception) -> bool:
+    # OSError covers ConnectionRefusedError / ConnectionResetError / TimeoutError (network blips)
+    return isinstance(e, OSError) or type(e).__name__ in _TRANSIENT
+
+
+def _remember(seq, collection, doc_id, user_id, kind, data):
+    """Track an unflushed write so reads on this process can see it."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    view = _swap(data, lambda v: v is _server_timestamp or v == _SERVER_TS, now)
+    key = (collection, doc_id)
+    prev = _pending.get(key)
+    if prev is not None and kind != "set":
+        view = {**prev["data"], **view}
+        kind = prev["kind"]
+    _pending[key] = {"seq": seq, "user_id": user_id or (prev or {}).get("user_id"), "kind": kind, "data": view}
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+def enqueue(collection: str, data: dict, doc_id: str | None = None, kind: str = "set",
+            merge: bool = False, user_id: str | None = None) -> str:
+    """Journal a write and return its document id without waiting on Firestore."""
+    doc_id = doc_id or auto_id()
+    user_id = user_id or data.get("user_id")
+    with _lock:
+        cur = _db().execute(
+            "INSERT INTO ops (collection, doc_id, user_id, kind, merge, data) VALUES (?,?,?,?,?,?)",
+            (collection, doc_id, user_id, kind, int(merge), _encode(data, _server_timestamp)),
+        )
+        _remember(cur.lastrowid, collection, doc_id, user_id, "merge" if (kind == "set" and merge) else kind, data)
+    _wake.set()
+    return doc_id
+
+
+def pending(collection: str, user_id: str | None = None) -> dict:
+    """Unflushed docs for a collection (optionally one user): {doc_id: {"kind", "data"}}."""
+    with _lock:
+        return {doc_id: {"kind": p["kind"], "data": dict(p["data"])}
+                for (c, doc_id), p in _pending.items()
+                if c == collection and (user_id is None or p["user_id"] == user_id)}
+
+
+def overlay(collection: str, user_id: str, rows: list, keep=None) -> list:
+    """Apply unflushed writes on top of rows read from Firestore (read-your-writes)."""
+    if not ENABLED:
+        return rows
+    by_id = {r.get("id"): r for r in rows}
+    for doc_id, p in pending(collection, user_id).items():
+        if doc_id in by_id:
+            by_id[doc_id] = {**(by_id[doc_id] if p["kind"] != "set" else {}), **p["data"], "id": doc_id}
+        elif p["kind"] != "update":
+            by_id[doc_id] = {**p["data"], "id": doc_id}
+    out = list(by_id.values())
+    return [r for r in out if keep(r)] if keep else out
+
+
+def backlog() -> int:
+    with _lock:
+        return _db().execute("SELECT COUNT(*) FROM ops").fetchone()[0]
+
+
+def dead_letters(limit: int = 100) -> list[dict]:
+    """Ops that were given up on, newest first (for the diagnostics panel / manual replay)."""
+    with _lock:
+        cur = _db().execute(
+            "SELECT seq, collection, doc_id, user_id, kind, error, attempts, failed_at FROM dead_ops "
+            "ORDER BY seq DESC LIMIT ?", (limit,))
+        cols = [c[0] for c in cur.description]
+        return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+def flush_once() -> int:
+    """Commit up to MAX_BATCH journaled ops in one WriteBatch. Returns how many left the journal."""
+    with _flush_lock:
+        return _flush_locked()
+
+
+def _apply(target, db, collection, doc_id, kind, merge, raw):
+    ref = db.collection(collection).document(doc_id)
+    data = _decode(raw, _server_timestamp)
+    if kind == "update":
+        target.update(ref, data) if target is not None else ref.update(data)
+    else:
+        target.set(ref, data, merge=bool(merge)) if target is not None else ref.set(data, merge=bool(merge))
+
+
+def _forget(seq: int):
+    """Drop ops up to seq from the journal and the read overlay."""
+    with _lock:
+        _db().execute("DELETE FROM ops WHERE seq <= ?", (seq,))
+        for key in [k for k, p in _pending.items() if p["seq"] <= seq]:
+            del _pending[key]
+
+
+def _dead_letter(row, error: Exception, attempts: int):
+    seq, collection, doc_id, user_id, kind, merge, raw, _ = row
+    with _lock:
+        _db().execute(
+            "INSERT OR REPLACE INTO dead_ops (seq, collection, doc_id, user_id, kind, merge, data, error, "
+            "attempts, failed_at) VALUES (?,?,?,?,?,?,?,?,?,?)",
+            (seq, collection, doc_id, user_id, kind, merge, raw, f"{type(error).__name__}: {error}",
+             attempts, time.time()))
+        _db().execute("DELETE FROM ops WHERE seq = ?", (seq,))
+        key = (collection, doc_id)
+        if key in _pending and _pending[key]["seq"] <= seq:
+            del _pending[key]
+    metrics.count("write_dead_letter", collection, ok=False, error=type(error).__name__)
+
+
+def _flush_locked() -> int:
+    with _lock:
+        rows = _db().execute(
+            "SELECT seq, collection, doc_id, user_id, kind, merge, data, attempts FROM ops ORDER BY seq LIMIT ?",
+            (MAX_BATCH,)
+        ).fetchall()
+    if not rows:
+        return 0
+
+    db = _client_factory()
+    try:
+        with metrics.track("firestore", "write_batch") as rec:
+            batch = db.batch()
+            for _, collection, doc_id, _, kind, merge, raw, _ in rows:
+                _apply(batch, db, collection, doc_id, kind, merge, raw)
+            batch.commit()
+            rec["docs_written"] = len(rows)
+    except Exception as e:
+        if _transient(e):
+            raise
+        return _flush_singly(db, rows)
+    _forget(rows[-1][0])
+    return len(rows)
+
+
+def _flush_singly(db, rows) -> int:
+    """Batch was rejected: apply ops one by one, dead-lettering the ones that can't land."""
+    done = 0
+    for row in rows:
+        seq, collection, doc_id, _, kind, merge, raw, attempts = row
+        try:
+            with metrics.track("firestore", "write_single") as rec:
+                _apply(None, db, collection, doc_id, kind, merge, raw)
+                rec["docs_written"] = 1
+        except Exception as e:
+            name = type(e).__name__
+            if _transient(e):
+                raise  # outage, not this op: keep the rest for the next round
+            if name in _PERMANENT or attempts + 1 >= MAX_ATTEMPTS:
+                _dead_letter(row, e, attempts + 1)
+                done += 1
+                continue
+            with _lock:
+                _db().execute("UPDATE ops SET attempts = attempts + 1 WHERE seq = ?", (seq,))
+            raise  # keep ordering: later ops for the same doc must not overtake this one
+        _forget(seq)
+        done += 1
+    return done
+
+
+def flush(timeout: float = 10.0) -> bool:
+    """Drain the journal synchronously (shutdown, tests, CLI tools)."""
+    deadline = time.monotonic() + timeout
+    while backlog():
+        if time.monotonic() > deadline:
+            return False
+        try:
+            flush_once()
+        except Exception:
+            time.sleep(0.2)
+    return True
+
+
+def _run():
+    delay = FLUSH_INTERVAL_S
+    while True:
+        if _wake.wait(delay):
+            time.sleep(COALESCE_S)  # let the rest of this rerun's writes join the batch
+        _wake.clear()
+        try:
+            while flush_once() == MAX_BATCH:
+                pass
+            delay = FLUSH_INTERVAL_S
+        except Exception:
+            delay = min(delay * 2, 30.0)  # offline / Firestore down: keep journal, back off
+
+
+def start(client_factory, server_timestamp=None):
+    """Start the background worker once per process; replays anything left in the journal."""
+    global _worker, _client_factory, _server_timestamp
+    with _lock:
+        _client_factory = client_factory
+        _server_timestamp = server_timestamp
+        if _worker is not None:
+            return
+        for seq, collection, doc_id, user_id, kind, merge, raw in _db().execute(
+                "SELECT seq, collection, doc_id, user_id, kind, merge, data FROM ops ORDER BY seq"):
+            _remember(seq, collection, doc_id, user_id, "merge" if (kind == "set" and merge) else kind,
+                      json.loads(raw))
+        _worker = threading.Thread(target=_run, name="write-behind", daemon=True)
+        _worker.start()
+    _wake.set()
+    atexit.register(flush, 5.0)